@@ -1,15 +1,35 @@
 """
 APEX Super Fast Message Search API (Docker-Free)
-Lightweight Flask API with SQLite FTS backend
+Lightweight Flask API over the SQLite FTS or Elasticsearch backend (APEX_SEARCH_BACKEND)
 """
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, send_file, Response, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from datetime import datetime, timedelta
+from functools import wraps
+from typing import Dict, Any, Optional, Tuple
 import json
 import os
+import time
 import logging
-from search_engine import search_engine
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process maintains
+    fcntl = None
+
+import fast_json
+import http_cache
+import metrics
+from search_engine import get_search_engine, query_shape, SEARCH_MODE, DEFAULT_MIN_SIMILARITY
+from search_backend import (DualWriteRouter, TenantNotFound, get_backend, get_tenant_router,
+                            current_customer_id, normalize_customer_id, SEARCH_BACKEND, TENANT_MODE,
+                            TENANT_HEADER)
+from query_parser import parse_query
+from suggest import SuggestIndex, FIELD_ALIASES, DEFAULT_SUGGEST_LIMIT
+from retention import RetentionPolicy, RetentionWorker
+from replica import SnapshotPublisher, ReplicaSync, SNAPSHOT_PATTERN
 
 # Configure logging
 logging.basicConfig(
@@ -22,30 +42,441 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class FastJSONProvider(DefaultJSONProvider):
+    """Serve jsonify responses through fast_json (orjson/ujson when installed)"""
+    
+    def dumps(self, obj: Any, **kwargs) -> str:
+        if kwargs:
+            # Pretty-printing and other stdlib options
+            return super().dumps(obj, **kwargs)
+        return fast_json.dumps(obj)
+    
+    def loads(self, s, **kwargs) -> Any:
+        return fast_json.loads(s)
+    
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(fast_json.dumps_bytes(obj), mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
-@app.route('/')
-def index():
-    """Main search interface"""
-    return render_template('search.html')
+# Retention purge configuration
+RETENTION_INTERVAL_SECONDS = int(os.getenv('APEX_RETENTION_INTERVAL_SECONDS', '3600'))
+RETENTION_BATCH_SIZE = int(os.getenv('APEX_RETENTION_BATCH_SIZE', '1000'))
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
+# Replication configuration: the primary publishes snapshots to
+# APEX_SNAPSHOT_DIR, replicas pull them from APEX_REPLICA_SOURCE
+REPLICATION_INTERVAL_SECONDS = int(os.getenv('APEX_REPLICATION_INTERVAL_SECONDS', '30'))
+SNAPSHOT_DIR = os.getenv('APEX_SNAPSHOT_DIR')
+
+# Only one process per node runs background maintenance (retention purge,
+# snapshot publishing, replica downloads); it is whichever holds this lock
+MAINTENANCE_LOCK_PATH = os.getenv('APEX_MAINTENANCE_LOCK', 'data/.maintenance.lock')
+
+# With APEX_TENANT_MODE=header, endpoints that serve the node rather than a
+# tenant; every other request must name its tenant in TENANT_HEADER
+TENANT_EXEMPT_ENDPOINTS = {
+    'index', 'static', 'health_check', 'get_metrics', 'dual_write_status',
+    'get_retention', 'purge_expired', 'replication_manifest', 'replication_snapshot'
+}
+
+# The only endpoints that may create a tenant's database; reads of a tenant
+# that never ingested anything answer 404
+TENANT_INGEST_ENDPOINTS = {'add_message', 'add_messages_bulk', 'setup_sample_data'}
+
+# Per-process services, created by init_worker() after the fork
+retention_worker = None
+suggest_index = None
+snapshot_publisher = None
+replica_sync = None
+_worker_pid = None
+_maintenance_lock_file = None
+
+def _acquire_maintenance_lock() -> bool:
+    """Try to become this node's maintenance process"""
+    global _maintenance_lock_file
+    if fcntl is None:
+        return True
+    
+    os.makedirs(os.path.dirname(MAINTENANCE_LOCK_PATH) or '.', exist_ok=True)
+    lock_file = open(MAINTENANCE_LOCK_PATH, 'w')
     try:
-        stats = search_engine.get_stats()
-        return jsonify({
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    
+    # Held for the life of the process; the kernel releases it if we die
+    _maintenance_lock_file = lock_file
+    return True
+
+def init_worker(start_background: bool = True):
+    """
+    Initialise this process's search engine and services.
+    Runs once per process after any fork (gunicorn post_worker_init, or
+    lazily on the first request), never in a pre-fork parent.
+    """
+    global retention_worker, suggest_index, snapshot_publisher, replica_sync, _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    _worker_pid = os.getpid()
+    
+    metrics.start_exporter()
+    if TENANT_MODE == 'header':
+        # Retention purges every tenant database in turn; typeahead and
+        # replication work on a single database
+        retention_worker = RetentionWorker(
+            get_tenant_router(),
+            RetentionPolicy.from_env(),
+            interval_seconds=RETENTION_INTERVAL_SECONDS,
+            batch_size=RETENTION_BATCH_SIZE
+        )
+        if retention_worker.policy.enabled and start_background and _acquire_maintenance_lock():
+            retention_worker.start()
+        logger.info(f"APEX Search worker {_worker_pid} ready (tenants by {TENANT_HEADER})")
+        return
+    
+    backend = get_backend()
+    if backend.name != 'sqlite':
+        # Retention, typeahead and replication work on the SQLite database
+        logger.info(f"APEX Search worker {_worker_pid} ready (backend={backend.name})")
+        return
+    
+    engine = get_search_engine()
+    is_maintainer = start_background and _acquire_maintenance_lock()
+    
+    retention_worker = RetentionWorker(
+        engine,
+        RetentionPolicy.from_env(),
+        interval_seconds=RETENTION_INTERVAL_SECONDS,
+        batch_size=RETENTION_BATCH_SIZE
+    )
+    suggest_index = SuggestIndex(engine)
+    snapshot_publisher = None
+    replica_sync = None
+    
+    if SEARCH_MODE == 'replica':
+        # Every worker follows the snapshots on disk; only the maintainer
+        # downloads new generations from the primary
+        replica_sync = ReplicaSync(
+            engine,
+            os.getenv('APEX_REPLICA_SOURCE', 'http://localhost:5000'),
+            replica_dir=os.getenv('APEX_REPLICA_DIR', 'data/replica'),
+            interval_seconds=REPLICATION_INTERVAL_SECONDS,
+            follower=not is_maintainer
+        )
+        replica_sync.attach_latest_local()
+        if start_background:
+            replica_sync.start()
+    else:
+        if SNAPSHOT_DIR:
+            snapshot_publisher = SnapshotPublisher(
+                engine,
+                SNAPSHOT_DIR,
+                interval_seconds=REPLICATION_INTERVAL_SECONDS
+            )
+        if is_maintainer:
+            # Nothing is purged until APEX_RETENTION_POLICY opts in
+            if retention_worker.policy.enabled:
+                retention_worker.start()
+            if snapshot_publisher:
+                snapshot_publisher.start()
+    
+    logger.info(f"APEX Search worker {_worker_pid} ready (mode={SEARCH_MODE}, maintainer={is_maintainer})")
+
+@app.before_request
+def ensure_worker_initialised():
+    """Lazily initialise processes that were not set up by the server hook"""
+    if _worker_pid != os.getpid():
+        init_worker()
+
+@app.before_request
+def track_request_start():
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.teardown_request
+def track_request_end(error=None):
+    metrics.REQUESTS_IN_FLIGHT.dec()
+
+@app.before_request
+def bind_tenant():
+    """Serve the request from the backend of the tenant it names"""
+    if TENANT_MODE != 'header' or request.endpoint in TENANT_EXEMPT_ENDPOINTS:
+        return None
+    try:
+        customer_id = normalize_customer_id(request.headers.get(TENANT_HEADER))
+        create = request.endpoint in TENANT_INGEST_ENDPOINTS and primary_only_error() is None
+        get_tenant_router().backend_for(customer_id, create=create)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except TenantNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    g.tenant_token = current_customer_id.set(customer_id)
+    return None
+
+@app.teardown_request
+def unbind_tenant(error=None):
+    token = g.pop('tenant_token', None)
+    if token is not None:
+        current_customer_id.reset(token)
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """gzip/brotli-encode sizeable JSON and text bodies the client accepts"""
+    if (response.direct_passthrough or response.status_code in (204, 304)
+            or response.status_code < 200 or 'Content-Encoding' in response.headers
+            or not http_cache.is_compressible(response.content_type)):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = http_cache.choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    
+    body = response.get_data()
+    if len(body) < http_cache.COMPRESS_MIN_BYTES:
+        return response
+    
+    response.set_data(http_cache.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def unsupported_error(feature: str) -> Optional[str]:
+    """Error message when the configured backend lacks a feature, else None"""
+    backend = get_backend()
+    if not backend.supports(feature):
+        return f'Not supported by the {backend.name} search backend'
+    return None
+
+def requires_feature(feature: str):
+    """Answer 501 when the configured backend lacks a feature"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            error = unsupported_error(feature)
+            if error:
+                return jsonify({'error': error}), 501
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def primary_only_error() -> Optional[str]:
+    """Error message for write requests on read-only replicas, else None"""
+    if SEARCH_MODE == 'replica':
+        return 'This node is a read-only search replica'
+    return None
+
+def primary_only(view):
+    """Reject writes on read-only replicas"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        error = primary_only_error()
+        if error:
+            return jsonify({'error': error}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def build_storage_stats() -> Optional[Dict[str, Any]]:
+    """Storage figures for /metrics: every tenant database's in header mode, else this process's"""
+    if TENANT_MODE == 'header':
+        return get_tenant_router().storage_stats() if SEARCH_BACKEND == 'sqlite' else None
+    if get_backend().supports('storage_metrics'):
+        return get_search_engine().storage_stats()
+    return None
+
+def build_health() -> Tuple[Dict[str, Any], int]:
+    """Health payload and HTTP status for this process"""
+    try:
+        if TENANT_MODE == 'header' and SEARCH_BACKEND == 'sqlite':
+            # This process's own database is unused; report the tenants'
+            backend = None
+            stats = get_tenant_router().storage_stats()
+        else:
+            backend = get_backend()
+            stats = backend.get_stats()
+            if 'error' in stats:
+                raise RuntimeError(stats['error'])
+        health = {
             'status': 'healthy',
             'database': 'connected',
+            'backend': backend.name if backend else SEARCH_BACKEND,
+            'mode': SEARCH_MODE,
             'total_messages': stats.get('total_messages', 0),
             'timestamp': datetime.utcnow().isoformat()
-        })
+        }
+        if isinstance(backend, DualWriteRouter):
+            health['dual_write'] = backend.status()
+        if TENANT_MODE == 'header':
+            health['tenants'] = get_tenant_router().status()
+            if backend is None:
+                health['tenants']['databases'] = stats['tenants']
+        if replica_sync:
+            health['replication'] = replica_sync.status()
+            if replica_sync.generation is None:
+                # Keep replicas out of the load balancer until they have data
+                health['status'] = 'unhealthy'
+                health['database'] = 'awaiting snapshot'
+                return health, 503
+        return health, 200
     except Exception as e:
-        return jsonify({
+        return {
             'status': 'unhealthy',
             'error': str(e)
-        }), 500
+        }, 500
+
+# Fields every ingested message must carry
+REQUIRED_MESSAGE_FIELDS = ['message_id', 'sender_email', 'sender_domain', 
+                           'recipient_email', 'subject', 'content', 
+                           'threat_category', 'apex_action', 'threat_score']
+
+def prepare_message(data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Validate an ingest payload in place; returns an error message or None"""
+    if not isinstance(data, dict):
+        return 'Message body must be a JSON object'
+    
+    for field in REQUIRED_MESSAGE_FIELDS:
+        if field not in data:
+            return f'Missing required field: {field}'
+    
+    # Add timestamp if not provided
+    if 'timestamp' not in data:
+        data['timestamp'] = datetime.utcnow().isoformat()
+    return None
+
+def build_quick_search_params(query: str) -> Dict[str, Any]:
+    """
+    Compile a quick search query string (from:x domain:y score>0.8
+    "wire transfer" after:2025-10-01 ...) into engine search parameters
+    """
+    return parse_query(query)
+
+def build_advanced_search_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map advanced search request fields onto engine search parameters"""
+    search_params = {}
+    
+    # Text search
+    if 'text' in data:
+        search_params['subject'] = data['text']
+    
+    # Sender filters
+    if 'sender_email' in data:
+        search_params['sender'] = data['sender_email']
+    
+    if 'sender_domain' in data:
+        search_params['domain'] = data['sender_domain']
+    
+    if 'sender_ip' in data:
+        search_params['ip_address'] = data['sender_ip']
+    
+    # Threat filters
+    if 'threat_category' in data:
+        search_params['threat_category'] = data['threat_category']
+    
+    if 'apex_action' in data:
+        search_params['apex_action'] = data['apex_action']
+    
+    # Date range
+    if 'date_from' in data:
+        search_params['date_from'] = data['date_from']
+    
+    if 'date_to' in data:
+        search_params['date_to'] = data['date_to']
+    
+    # Pagination
+    if 'size' in data:
+        search_params['size'] = data['size']
+    
+    if 'from' in data:
+        search_params['from'] = data['from']
+    
+    # Query time budget
+    if 'timeout_ms' in data:
+        search_params['timeout_ms'] = data['timeout_ms']
+    
+    # Response layout ('compact': columns header plus row lists)
+    if 'format' in data:
+        search_params['format'] = data['format']
+    
+    return search_params
+
+def build_slow_query_report(limit: int, since_minutes: Optional[float]) -> Dict[str, Any]:
+    """Top slow-query fingerprints, optionally only from the last since_minutes"""
+    slow_log = get_search_engine().slow_query_log
+    since = datetime.utcnow() - timedelta(minutes=since_minutes) if since_minutes else None
+    return {
+        'threshold_ms': slow_log.threshold_ms,
+        'since': since.isoformat() if since else None,
+        'fingerprints': slow_log.top(limit, since)
+    }
+
+def build_suggestions(field: str, prefix: str, limit: int = DEFAULT_SUGGEST_LIMIT) -> Dict[str, Any]:
+    """Typeahead completions for field, most frequent first (ValueError for unknown fields)"""
+    init_worker()
+    field = FIELD_ALIASES.get(field, field)
+    start_time = time.perf_counter()
+    suggestions = suggest_index.suggest(field, prefix, limit)
+    took = time.perf_counter() - start_time
+    metrics.SUGGEST_SECONDS.observe(took, field=field)
+    return {
+        'field': field,
+        'prefix': prefix,
+        'suggestions': suggestions,
+        'took_ms': round(took * 1000, 3)
+    }
+
+def not_modified(etag: Optional[str], endpoint: str) -> Optional[Response]:
+    """304 response when the client already holds the current representation"""
+    if not http_cache.etag_matches(request.headers.get('If-None-Match'), etag):
+        return None
+    metrics.CACHE_HITS.inc(endpoint=endpoint)
+    response = Response(status=304)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def search_response(endpoint: str, search_params: Dict[str, Any]):
+    """
+    Run a search and return the JSON response, recording its metrics.
+    A client that repeats a search with the ETag it was given gets a 304
+    without the query running, as long as nothing was written since.
+    """
+    backend = get_backend()
+    etag = http_cache.search_etag(backend.write_generation(), endpoint, search_params)
+    cached = not_modified(etag, endpoint)
+    if cached is not None:
+        return cached, {}
+    
+    start_time = time.perf_counter()
+    try:
+        results = backend.search(search_params)
+    except ValueError as e:
+        return (jsonify({'error': str(e)}), 400), {}
+    
+    encode_start = time.perf_counter()
+    response = jsonify(results)
+    end_time = time.perf_counter()
+    
+    metrics.observe_search(endpoint, query_shape(search_params), results,
+                           end_time - start_time, end_time - encode_start)
+    
+    # Partial results must not be revalidated as if they were complete
+    if etag and 'error' not in results and not results.get('timed_out'):
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response, results
+
+@app.route('/')
+def index():
+    """Main search interface"""
+    return render_template('search.html')
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    health, status_code = build_health()
+    return jsonify(health), status_code
 
 @app.route('/search', methods=['POST'])
 def search_messages():
@@ -57,10 +488,11 @@ def search_messages():
         data = request.get_json() or {}
         
         # Execute search
-        results = search_engine.search_messages(data)
+        response, results = search_response('search', data)
         
-        logger.info(f"Search completed in {results.get('query_time_ms', 0):.2f}ms")
-        return jsonify(results)
+        if results:
+            logger.info(f"Search completed in {results.get('query_time_ms', 0):.2f}ms")
+        return response
         
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
@@ -74,56 +506,86 @@ def quick_search():
         if not query:
             return jsonify({'error': 'Query parameter required'}), 400
         
-        # Build search parameters
-        search_params = {}
-        
-        # Try to detect search type
-        if '@' in query:
-            search_params['sender'] = query
-        elif '.' in query and ' ' not in query:
-            search_params['domain'] = query
-        elif query.replace('.', '').replace(':', '').isdigit():
-            search_params['ip_address'] = query
-        else:
-            search_params['subject'] = query
-        
-        results = search_engine.search_messages(search_params)
-        return jsonify(results)
+        search_params = build_quick_search_params(query)
+        if request.args.get('format'):
+            search_params['format'] = request.args['format']
+        response, _ = search_response('quick', search_params)
+        return response
         
     except Exception as e:
         logger.error(f"Quick search error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/suggest', methods=['GET'])
+@requires_feature('suggest')
+def suggest():
+    """Typeahead: most frequent sender_email/sender_domain/subject values with a prefix"""
+    try:
+        field = request.args.get('field', 'sender_domain')
+        prefix = request.args.get('prefix', '')
+        limit = request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int)
+        return jsonify(build_suggestions(field, prefix, limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Suggest error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Get search engine statistics"""
     try:
-        stats = search_engine.get_stats()
-        return jsonify(stats)
+        backend = get_backend()
+        etag = http_cache.stats_etag(backend.write_generation())
+        cached = not_modified(etag, 'stats')
+        if cached is not None:
+            return cached
+        
+        stats = backend.get_stats()
+        response = jsonify(stats)
+        if etag and 'error' not in stats:
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         logger.error(f"Stats error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stats/slow-queries', methods=['GET'])
+@requires_feature('slow_queries')
+def get_slow_queries():
+    """Slow searches aggregated by query fingerprint, worst first"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        since_minutes = request.args.get('since_minutes', None, type=float)
+        return jsonify(build_slow_query_report(limit, since_minutes))
+    except Exception as e:
+        logger.error(f"Slow query stats error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this server"""
+    try:
+        storage = build_storage_stats()
+        if storage:
+            metrics.observe_storage(storage)
+    except Exception as e:
+        logger.error(f"Storage metrics error: {str(e)}")
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/messages', methods=['POST'])
+@primary_only
 def add_message():
     """Add a message to the search index"""
     try:
         data = request.get_json()
         
-        # Validate required fields
-        required_fields = ['message_id', 'sender_email', 'sender_domain', 
-                          'recipient_email', 'subject', 'content', 
-                          'threat_category', 'apex_action', 'threat_score']
-        
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        error = prepare_message(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Add timestamp if not provided
-        if 'timestamp' not in data:
-            data['timestamp'] = datetime.utcnow().isoformat()
-        
-        success = search_engine.add_message(data)
+        success = get_backend().add_message(data)
         
         if success:
             return jsonify({'status': 'success', 'message': 'Message added successfully'})
@@ -134,11 +596,62 @@ def add_message():
         logger.error(f"Add message error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ingest/dual-write', methods=['GET'])
+def dual_write_status():
+    """Progress of copying this process's writes to the secondary backend"""
+    backend = get_backend()
+    if not isinstance(backend, DualWriteRouter):
+        return jsonify({'error': 'Dual writes are not enabled (APEX_SEARCH_SECONDARY_BACKEND)'}), 404
+    return jsonify(backend.status())
+
+@app.route('/messages/<message_id>/similar', methods=['GET'])
+@requires_feature('similar')
+def similar_messages(message_id: str):
+    """Near duplicates of a message (same campaign), most similar first"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        min_similarity = request.args.get('min_similarity', DEFAULT_MIN_SIMILARITY, type=float)
+        results = get_backend().engine.similar_messages(message_id, limit, min_similarity)
+        if results is None:
+            return jsonify({'error': f'Message {message_id} not found'}), 404
+        if 'error' in results:
+            return jsonify(results), 500
+        return jsonify(results)
+    except Exception as e:
+        logger.error(f"Similar messages error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/messages/bulk', methods=['POST'])
+@primary_only
+def add_messages_bulk():
+    """Add a batch of messages to the search index in one transaction"""
+    try:
+        data = request.get_json()
+        messages = data.get('messages') if isinstance(data, dict) else data
+        if not isinstance(messages, list):
+            return jsonify({'error': 'Expected a list of messages'}), 400
+        
+        for index, message in enumerate(messages):
+            error = prepare_message(message)
+            if error:
+                return jsonify({'error': f'Message {index}: {error}'}), 400
+        
+        added = get_backend().add_messages(messages)
+        if messages and not added:
+            return jsonify({'error': 'Failed to add messages'}), 500
+        
+        return jsonify({'status': 'success', 'added': added})
+        
+    except Exception as e:
+        logger.error(f"Bulk add error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/setup', methods=['POST'])
+@primary_only
 def setup_sample_data():
     """Setup sample data for testing"""
     try:
-        search_engine.add_sample_data()
+        get_backend().add_sample_data()
         return jsonify({
             'status': 'success',
             'message': 'Sample data added successfully'
@@ -147,52 +660,69 @@ def setup_sample_data():
         logger.error(f"Setup error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/retention', methods=['GET'])
+@requires_feature('retention')
+def get_retention():
+    """Get the retention policy and the last purge report"""
+    return jsonify({
+        'policy': retention_worker.policy.to_dict(),
+        'interval_seconds': retention_worker.interval_seconds,
+        'last_purge': retention_worker.last_report
+    })
+
+@app.route('/retention/purge', methods=['POST'])
+@primary_only
+@requires_feature('retention')
+def purge_expired():
+    """Run a retention purge now and report rows reclaimed"""
+    if not retention_worker.policy.enabled:
+        return jsonify({'error': 'No retention policy is configured (APEX_RETENTION_POLICY)'}), 409
+    try:
+        report = retention_worker.run_once()
+        return jsonify({'status': 'success', 'purge': report})
+    except Exception as e:
+        logger.error(f"Retention purge error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/replication/manifest', methods=['GET'])
+@primary_only
+@requires_feature('replication')
+def replication_manifest():
+    """Describe the newest published snapshot for replicas"""
+    if not snapshot_publisher:
+        return jsonify({'error': 'Snapshot publishing is not enabled'}), 404
+    return jsonify({'manifest': snapshot_publisher.manifest()})
+
+@app.route('/replication/snapshot', methods=['GET'])
+@primary_only
+@requires_feature('replication')
+def replication_snapshot():
+    """Stream a published snapshot file to a replica"""
+    if not snapshot_publisher:
+        return jsonify({'error': 'Snapshot publishing is not enabled'}), 404
+    
+    generation = request.args.get('generation')
+    if generation:
+        if not generation.isdigit():
+            return jsonify({'error': 'Invalid generation'}), 400
+        path = os.path.join(snapshot_publisher.snapshot_dir, SNAPSHOT_PATTERN.format(generation=generation))
+    else:
+        path = snapshot_publisher.snapshot_path()
+    
+    if not path or not os.path.exists(path):
+        return jsonify({'error': 'Snapshot not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/vnd.sqlite3')
+
 @app.route('/api/search/advanced', methods=['POST'])
 def advanced_search():
     """Advanced search with multiple criteria"""
     try:
         data = request.get_json() or {}
         
-        # Build advanced query
-        search_params = {}
-        
-        # Text search
-        if 'text' in data:
-            search_params['subject'] = data['text']
-        
-        # Sender filters
-        if 'sender_email' in data:
-            search_params['sender'] = data['sender_email']
-        
-        if 'sender_domain' in data:
-            search_params['domain'] = data['sender_domain']
-        
-        if 'sender_ip' in data:
-            search_params['ip_address'] = data['sender_ip']
+        search_params = build_advanced_search_params(data)
         
-        # Threat filters
-        if 'threat_category' in data:
-            search_params['threat_category'] = data['threat_category']
-        
-        if 'apex_action' in data:
-            search_params['apex_action'] = data['apex_action']
-        
-        # Date range
-        if 'date_from' in data:
-            search_params['date_from'] = data['date_from']
-        
-        if 'date_to' in data:
-            search_params['date_to'] = data['date_to']
-        
-        # Pagination
-        if 'size' in data:
-            search_params['size'] = data['size']
-        
-        if 'from' in data:
-            search_params['from'] = data['from']
-        
-        results = search_engine.search_messages(search_params)
-        return jsonify(results)
+        response, _ = search_response('advanced', search_params)
+        return response
         
     except Exception as e:
         logger.error(f"Advanced search error: {str(e)}")
@@ -203,15 +733,17 @@ if __name__ == '__main__':
     os.makedirs('logs', exist_ok=True)
     
     logger.info("Starting APEX Search API (Docker-Free)...")
+    init_worker()
     
     # Add sample data on first run
-    try:
-        stats = search_engine.get_stats()
-        if stats.get('total_messages', 0) == 0:
-            logger.info("Adding sample data...")
-            search_engine.add_sample_data()
-    except Exception as e:
-        logger.error(f"Error setting up sample data: {str(e)}")
+    if SEARCH_MODE != 'replica':
+        try:
+            stats = get_backend().get_stats()
+            if stats.get('total_messages', 0) == 0:
+                logger.info("Adding sample data...")
+                get_backend().add_sample_data()
+        except Exception as e:
+            logger.error(f"Error setting up sample data: {str(e)}")
     
-    # Start the API
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Start the API (development server; use wsgi.py in production)
+    app.run(host='0.0.0.0', port=int(os.getenv('APEX_SEARCH_PORT', '5000')), debug=False)
@@ -0,0 +1,426 @@
+"""
+APEX Super Fast Message Search API (ASGI)
+Async front-end for the configured search backend (SQLite FTS or Elasticsearch)
+
+    uvicorn asgi_app:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+
+Backend work runs on a bounded thread pool. Each query has a deadline, and
+a SQLite query that overruns it is stopped with sqlite3.Connection.interrupt()
+rather than left to finish in the background. Health checks run on their
+own thread so a pile-up of slow searches can never starve them.
+
+With APEX_TENANT_MODE=header each request is served from the backend of
+the tenant named in its X-Customer-Id header, as in app.py.
+"""
+
+import asyncio
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+# The logging handlers in app/search_engine write here at import time
+os.makedirs('logs', exist_ok=True)
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.cors import CORSMiddleware  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import JSONResponse, PlainTextResponse, Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+import fast_json  # noqa: E402
+import http_cache  # noqa: E402
+import metrics  # noqa: E402
+from search_engine import query_shape, DEFAULT_MIN_SIMILARITY  # noqa: E402
+from search_backend import (  # noqa: E402
+    TenantNotFound,
+    get_backend,
+    get_tenant_router,
+    current_customer_id,
+    normalize_customer_id,
+    TENANT_MODE,
+    TENANT_HEADER
+)
+from app import (  # noqa: E402
+    init_worker,
+    build_health,
+    build_storage_stats,
+    build_slow_query_report,
+    build_suggestions,
+    prepare_message,
+    primary_only_error,
+    unsupported_error,
+    build_quick_search_params,
+    build_advanced_search_params
+)
+
+logger = logging.getLogger(__name__)
+
+# Concurrency and deadline configuration
+MAX_CONCURRENT_QUERIES = int(os.getenv('APEX_MAX_CONCURRENT_QUERIES', '8'))
+QUEUE_TIMEOUT_MS = int(os.getenv('APEX_QUEUE_TIMEOUT_MS', '1000'))
+QUERY_TIMEOUT_MS = int(os.getenv('APEX_QUERY_TIMEOUT_MS', '5000'))
+
+# Paths that serve the node rather than a tenant (app.TENANT_EXEMPT_ENDPOINTS)
+TENANT_EXEMPT_PATHS = {'/health', '/metrics'}
+
+# Paths that may create a tenant's database (app.TENANT_INGEST_ENDPOINTS)
+TENANT_INGEST_PATHS = {'/messages'}
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with fast_json (orjson/ujson when installed)"""
+
+    def render(self, content: Any) -> bytes:
+        return fast_json.dumps_bytes(content)
+
+
+class QueryRejected(Exception):
+    """Raised when no query slot frees up within the queue timeout"""
+
+
+class QueryTimeout(Exception):
+    """Raised when a query overran its deadline and was interrupted"""
+
+
+class QueryExecutor:
+    def __init__(self, max_concurrent: int, queue_timeout_ms: int, name: str = 'apex-query'):
+        """Bounded thread pool that can interrupt the backend query it is running"""
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.queue_timeout_ms = queue_timeout_ms
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+
+    async def run(self, func: Callable[..., Any], *args, timeout_ms: int = QUERY_TIMEOUT_MS) -> Any:
+        """Run func(*args) on the pool, interrupting it after timeout_ms"""
+        metrics.QUERY_QUEUE_DEPTH.inc(executor=self.name)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise QueryRejected(f"All {self.max_concurrent} query slots busy")
+        finally:
+            metrics.QUERY_QUEUE_DEPTH.dec(executor=self.name)
+
+        self.in_flight += 1
+        metrics.QUERY_SLOTS_BUSY.inc(executor=self.name)
+        state: Dict[str, Any] = {'interrupt': None, 'cancelled': False}
+        # Pool threads do not see the request's context (its tenant). Node
+        # requests in tenant mode (health, metrics) have no backend to interrupt
+        backend = get_backend() if TENANT_MODE != 'header' or current_customer_id.get() else None
+
+        def job():
+            # Grab this pool thread's interrupt so the event loop can use it
+            state['interrupt'] = backend.interrupter() if backend else None
+            if state['cancelled']:
+                raise QueryTimeout("Query cancelled before it started")
+            return func(*args)
+
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._pool, job)
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout_ms / 1000)
+            except asyncio.TimeoutError:
+                state['cancelled'] = True
+                # Keep interrupting until the worker thread unwinds; an interrupt
+                # that lands between statements is otherwise lost
+                while not future.done():
+                    if state['interrupt'] is not None:
+                        state['interrupt']()
+                    await asyncio.wait([future], timeout=0.05)
+                future.exception()  # retrieved so it is not logged as unhandled
+                raise QueryTimeout(f"Query exceeded {timeout_ms}ms and was interrupted")
+        finally:
+            self.in_flight -= 1
+            metrics.QUERY_SLOTS_BUSY.dec(executor=self.name)
+            self._semaphore.release()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class TenantMiddleware:
+    def __init__(self, app):
+        """ASGI counterpart of app.bind_tenant: serve each request from its tenant's backend"""
+        self.app = app
+        self.header = TENANT_HEADER.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or TENANT_MODE != 'header' or scope['path'] in TENANT_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        try:
+            customer_id = normalize_customer_id(headers.get(self.header, b'').decode('latin-1'))
+            create = scope['path'] in TENANT_INGEST_PATHS and primary_only_error() is None
+            get_tenant_router().backend_for(customer_id, create=create)
+        except ValueError as e:
+            await FastJSONResponse({'error': str(e)}, status_code=400)(scope, receive, send)
+            return
+        except TenantNotFound as e:
+            await FastJSONResponse({'error': str(e)}, status_code=404)(scope, receive, send)
+            return
+
+        token = current_customer_id.set(customer_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_customer_id.reset(token)
+
+
+executors: Dict[str, QueryExecutor] = {}
+
+
+async def _read_json(request: Request) -> Any:
+    body = await request.body()
+    return fast_json.loads(body) if body else {}
+
+
+async def _run_query(func: Callable[..., Any], *args) -> FastJSONResponse:
+    """Run an engine call on the query pool and map overload/timeout to HTTP"""
+    try:
+        result = await executors['query'].run(func, *args)
+    except QueryRejected as e:
+        return FastJSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    except QueryTimeout as e:
+        logger.warning(str(e))
+        return FastJSONResponse({'error': str(e), 'timed_out': True}, status_code=504)
+
+    if isinstance(result, dict) and 'error' in result:
+        return FastJSONResponse(result, status_code=500)
+    return FastJSONResponse(result)
+
+
+def _not_modified(request: Request, etag: Optional[str], endpoint: str) -> Optional[Response]:
+    """304 response when the client already holds the current representation"""
+    if not http_cache.etag_matches(request.headers.get('if-none-match'), etag):
+        return None
+    metrics.CACHE_HITS.inc(endpoint=endpoint)
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+
+async def _run_search(request: Request, endpoint: str, search_params: Dict[str, Any]) -> Response:
+    """Run a search on the query pool, recording its metrics"""
+    backend = get_backend()
+    etag = http_cache.search_etag(backend.write_generation(), endpoint, search_params)
+    cached = _not_modified(request, etag, endpoint)
+    if cached is not None:
+        return cached
+
+    start_time = time.perf_counter()
+    try:
+        results = await executors['query'].run(backend.search, search_params)
+    except ValueError as e:
+        return FastJSONResponse({'error': str(e)}, status_code=400)
+    except QueryRejected as e:
+        metrics.SEARCH_ERRORS.inc(endpoint=endpoint)
+        return FastJSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    except QueryTimeout as e:
+        logger.warning(str(e))
+        metrics.SEARCH_ERRORS.inc(endpoint=endpoint)
+        return FastJSONResponse({'error': str(e), 'timed_out': True}, status_code=504)
+
+    encode_start = time.perf_counter()
+    response = FastJSONResponse(results, status_code=500 if 'error' in results else 200)
+    end_time = time.perf_counter()
+
+    metrics.observe_search(endpoint, query_shape(search_params), results,
+                           end_time - start_time, end_time - encode_start)
+
+    # Partial results must not be revalidated as if they were complete
+    if etag and 'error' not in results and not results.get('timed_out'):
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def health_check(request: Request) -> FastJSONResponse:
+    """Health check endpoint (own thread, outside the query limit)"""
+    try:
+        health, status_code = await executors['health'].run(build_health)
+    except (QueryRejected, QueryTimeout) as e:
+        return FastJSONResponse({'status': 'unhealthy', 'error': str(e)}, status_code=503)
+    return FastJSONResponse(health, status_code=status_code)
+
+
+async def search_messages(request: Request) -> FastJSONResponse:
+    """Super fast message search endpoint"""
+    try:
+        data = await _read_json(request)
+    except ValueError:
+        return FastJSONResponse({'error': 'Invalid JSON body'}, status_code=400)
+
+    response = await _run_search(request, 'search', data)
+    logger.info(f"Search completed with status {response.status_code}")
+    return response
+
+
+async def quick_search(request: Request) -> FastJSONResponse:
+    """Quick search endpoint for simple queries"""
+    query = request.query_params.get('q', '')
+    if not query:
+        return FastJSONResponse({'error': 'Query parameter required'}, status_code=400)
+
+    search_params = build_quick_search_params(query)
+    if request.query_params.get('format'):
+        search_params['format'] = request.query_params['format']
+    return await _run_search(request, 'quick', search_params)
+
+
+async def advanced_search(request: Request) -> FastJSONResponse:
+    """Advanced search with multiple criteria"""
+    try:
+        data = await _read_json(request)
+    except ValueError:
+        return FastJSONResponse({'error': 'Invalid JSON body'}, status_code=400)
+    return await _run_search(request, 'advanced', build_advanced_search_params(data))
+
+
+async def suggest(request: Request) -> FastJSONResponse:
+    """Typeahead: most frequent sender_email/sender_domain/subject values with a prefix"""
+    error = unsupported_error('suggest')
+    if error:
+        return FastJSONResponse({'error': error}, status_code=501)
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return FastJSONResponse({'error': 'limit must be a number'}, status_code=400)
+    field = request.query_params.get('field', 'sender_domain')
+    prefix = request.query_params.get('prefix', '')
+    try:
+        return await _run_query(build_suggestions, field, prefix, limit)
+    except ValueError as e:
+        return FastJSONResponse({'error': str(e)}, status_code=400)
+
+
+async def get_stats(request: Request) -> Response:
+    """Get search engine statistics"""
+    backend = get_backend()
+    etag = http_cache.stats_etag(backend.write_generation())
+    cached = _not_modified(request, etag, 'stats')
+    if cached is not None:
+        return cached
+
+    response = await _run_query(backend.get_stats)
+    if etag and response.status_code == 200:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def get_slow_queries(request: Request) -> FastJSONResponse:
+    """Slow searches aggregated by query fingerprint, worst first"""
+    error = unsupported_error('slow_queries')
+    if error:
+        return FastJSONResponse({'error': error}, status_code=501)
+    try:
+        limit = int(request.query_params.get('limit', 20))
+        since_minutes = request.query_params.get('since_minutes')
+        since_minutes = float(since_minutes) if since_minutes else None
+    except ValueError:
+        return FastJSONResponse({'error': 'limit and since_minutes must be numbers'}, status_code=400)
+    return await _run_query(build_slow_query_report, limit, since_minutes)
+
+
+async def get_metrics(request: Request) -> PlainTextResponse:
+    """Prometheus metrics for this server (health thread, outside the query limit)"""
+    try:
+        storage = await executors['health'].run(build_storage_stats)
+        if storage:
+            metrics.observe_storage(storage)
+    except (QueryRejected, QueryTimeout) as e:
+        logger.warning(f"Storage metrics skipped: {str(e)}")
+    return PlainTextResponse(metrics.render_metrics(), media_type='text/plain; version=0.0.4')
+
+
+async def add_message(request: Request) -> FastJSONResponse:
+    """Add a message to the search index"""
+    error = primary_only_error()
+    if error:
+        return FastJSONResponse({'error': error}, status_code=403)
+
+    try:
+        data = await _read_json(request)
+    except ValueError:
+        return FastJSONResponse({'error': 'Invalid JSON body'}, status_code=400)
+
+    error = prepare_message(data)
+    if error:
+        return FastJSONResponse({'error': error}, status_code=400)
+
+    try:
+        success = await executors['query'].run(get_backend().add_message, data)
+    except QueryRejected as e:
+        return FastJSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    except QueryTimeout as e:
+        return FastJSONResponse({'error': str(e), 'timed_out': True}, status_code=504)
+
+    if success:
+        return FastJSONResponse({'status': 'success', 'message': 'Message added successfully'})
+    return FastJSONResponse({'error': 'Failed to add message'}, status_code=500)
+
+
+async def similar_messages(request: Request) -> FastJSONResponse:
+    """Near duplicates of a message (same campaign), most similar first"""
+    message_id = request.path_params['message_id']
+    error = unsupported_error('similar')
+    if error:
+        return FastJSONResponse({'error': error}, status_code=501)
+    try:
+        limit = int(request.query_params.get('limit', 20))
+        min_similarity = float(request.query_params.get('min_similarity', DEFAULT_MIN_SIMILARITY))
+    except ValueError:
+        return FastJSONResponse({'error': 'limit and min_similarity must be numbers'}, status_code=400)
+
+    engine = get_backend().engine
+    try:
+        results = await executors['query'].run(engine.similar_messages, message_id, limit, min_similarity)
+    except QueryRejected as e:
+        return FastJSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    except QueryTimeout as e:
+        return FastJSONResponse({'error': str(e), 'timed_out': True}, status_code=504)
+
+    if results is None:
+        return FastJSONResponse({'error': f'Message {message_id} not found'}, status_code=404)
+    return FastJSONResponse(results, status_code=500 if 'error' in results else 200)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    # Runs inside each server worker process, after any fork
+    init_worker()
+    executors['query'] = QueryExecutor(MAX_CONCURRENT_QUERIES, QUEUE_TIMEOUT_MS)
+    executors['health'] = QueryExecutor(1, QUERY_TIMEOUT_MS, name='apex-health')
+    logger.info(f"APEX Search ASGI worker ready ({MAX_CONCURRENT_QUERIES} query slots)")
+    yield
+    for executor in executors.values():
+        executor.shutdown()
+    executors.clear()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/search', search_messages, methods=['POST']),
+        Route('/search/quick', quick_search, methods=['GET']),
+        Route('/api/search/advanced', advanced_search, methods=['POST']),
+        Route('/suggest', suggest, methods=['GET']),
+        Route('/stats', get_stats, methods=['GET']),
+        Route('/stats/slow-queries', get_slow_queries, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET']),
+        Route('/messages', add_message, methods=['POST']),
+        Route('/messages/{message_id}/similar', similar_messages, methods=['GET'])
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(http_cache.CompressionMiddleware),
+        Middleware(TenantMiddleware)
+    ],
+    lifespan=lifespan
+)
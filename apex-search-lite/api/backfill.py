@@ -0,0 +1,262 @@
+"""
+APEX Search backfill
+Copies the SQLite messages table into another search backend in rowid order, with resumable checkpoints
+
+    python backfill.py --db data/apex_search.db
+    python backfill.py --since 2025-11-02T10:15:00    # re-copy after lost dual writes
+    python backfill.py --customer-id acme.com         # one tenant's database (APEX_TENANT_MODE)
+
+Rows are read through a read-only connection, so the copy runs next to a
+live API. After each batch the target accepts, the batch's last rowid is
+saved to the checkpoint file, and a rerun carries on from there. Messages
+re-ingested with INSERT OR REPLACE get a new rowid, so they are copied
+again. Rows written during the copy are picked up as well, and the copy
+ends when it has caught up. Turn on dual writes
+(APEX_SEARCH_SECONDARY_BACKEND) before starting, so that nothing written
+after that point is missed.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+# The logging handlers in search_engine write here at import time
+os.makedirs('logs', exist_ok=True)
+
+import fast_json  # noqa: E402
+from search_backend import SearchBackend, create_backend, normalize_customer_id, tenant_db_path  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = int(os.getenv('APEX_BACKFILL_BATCH_SIZE', '1000'))
+BACKFILL_MAX_RETRIES = int(os.getenv('APEX_BACKFILL_MAX_RETRIES', '5'))
+
+# Pause between batches, to leave room for live ingestion on both sides
+BACKFILL_PAUSE_SECONDS = float(os.getenv('APEX_BACKFILL_PAUSE_SECONDS', '0'))
+
+# Seconds between progress log lines
+PROGRESS_INTERVAL_SECONDS = 10
+
+MESSAGE_COLUMNS = [
+    'message_id', 'sender_email', 'sender_domain', 'sender_ip',
+    'recipient_email', 'subject', 'content', 'timestamp',
+    'threat_category', 'apex_action', 'threat_score',
+    'file_attachments', 'urls'
+]
+
+# Stored as JSON text in SQLite, sent as lists
+LIST_COLUMNS = ('file_attachments', 'urls')
+
+
+def row_to_message(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    """A message dict from the MESSAGE_COLUMNS values of one messages row"""
+    message = dict(zip(MESSAGE_COLUMNS, row))
+    for column in LIST_COLUMNS:
+        value = message.get(column)
+        message[column] = fast_json.loads(value) if value else []
+    if message.get('sender_ip') is None:
+        message.pop('sender_ip')
+    return message
+
+
+class BackfillCopier:
+    def __init__(self, db_path: str, target: SearchBackend, checkpoint_path: str,
+                 batch_size: int = BACKFILL_BATCH_SIZE, max_retries: int = BACKFILL_MAX_RETRIES,
+                 pause_seconds: float = BACKFILL_PAUSE_SECONDS):
+        """
+        Copy db_path's messages into target. Copies are keyed by
+        message_id, so a batch retried or copied twice overwrites rather
+        than duplicates.
+        """
+        self.db_path = db_path
+        self.target = target
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.pause_seconds = pause_seconds
+
+    def _connect(self) -> sqlite3.Connection:
+        # Not immutable: the API may be writing while we read
+        uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=30)
+
+    def load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def save_checkpoint(self, state: Dict[str, Any]):
+        """Replace the checkpoint atomically, so a crash leaves the old or the new one"""
+        state['updated_at'] = datetime.utcnow().isoformat()
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _start_state(self, conn: sqlite3.Connection, restart: bool, since: Optional[str]) -> Dict[str, Any]:
+        source = os.path.abspath(self.db_path)
+        state = None if restart else self.load_checkpoint()
+        if state and (state.get('source') != source or state.get('target') != self.target.name):
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} is for {state.get('source')} -> {state.get('target')}; "
+                f"use --restart or another --checkpoint"
+            )
+        if not state:
+            state = {
+                'source': source,
+                'target': self.target.name,
+                'last_rowid': 0,
+                'copied': 0,
+                'batches': 0,
+                'started_at': datetime.utcnow().isoformat(),
+                'completed_at': None
+            }
+
+        if since:
+            # created_at is SQLite's CURRENT_TIMESTAMP: UTC, whole seconds
+            created_after = datetime.fromisoformat(since.replace('Z', '')).strftime('%Y-%m-%d %H:%M:%S')
+            first_rowid = conn.execute("SELECT MIN(id) FROM messages WHERE created_at >= ?",
+                                       (created_after,)).fetchone()[0]
+            if first_rowid is not None:
+                state['last_rowid'] = min(state['last_rowid'], first_rowid - 1)
+        return state
+
+    def _copy_batch(self, messages: List[Dict[str, Any]]):
+        """Write one batch to the target, retrying it whole with backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = self.target.add_messages(messages)
+            except Exception as e:
+                logger.error(f"Backfill batch failed: {str(e)}")
+                written = 0
+            if written == len(messages):
+                return
+            if attempt < self.max_retries:
+                time.sleep(min(2 ** attempt * 0.5, 30))
+        raise RuntimeError(f"{self.target.name} did not accept a batch of {len(messages)} messages "
+                           f"after {self.max_retries} retries")
+
+    def run(self, restart: bool = False, since: Optional[str] = None,
+            max_batches: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Copy from the checkpoint (or the first row created at or after
+        since, when that is earlier) until caught up or max_batches have
+        been copied. Returns the final checkpoint state plus this run's
+        counts.
+        """
+        start_time = time.time()
+        self.target.setup()
+        conn = self._connect()
+        try:
+            state = self._start_state(conn, restart, since)
+            state['completed_at'] = None
+            self.save_checkpoint(state)
+            logger.info(f"Backfill {state['source']} -> {self.target.name} from rowid {state['last_rowid']}")
+
+            copied = 0
+            batches = 0
+            last_progress = time.time()
+            select_sql = (f"SELECT id, {', '.join(MESSAGE_COLUMNS)} FROM messages "
+                          f"WHERE id > ? ORDER BY id LIMIT ?")
+            while max_batches is None or batches < max_batches:
+                rows = conn.execute(select_sql, (state['last_rowid'], self.batch_size)).fetchall()
+                if not rows:
+                    state['completed_at'] = datetime.utcnow().isoformat()
+                    break
+
+                self._copy_batch([row_to_message(row[1:]) for row in rows])
+                state['last_rowid'] = rows[-1][0]
+                state['copied'] += len(rows)
+                state['batches'] += 1
+                self.save_checkpoint(state)
+                copied += len(rows)
+                batches += 1
+
+                if time.time() - last_progress >= PROGRESS_INTERVAL_SECONDS:
+                    rate = copied / (time.time() - start_time)
+                    logger.info(f"Backfill at rowid {state['last_rowid']}: {copied} copied ({rate:.0f}/s)")
+                    last_progress = time.time()
+                if self.pause_seconds:
+                    time.sleep(self.pause_seconds)
+
+            remaining = conn.execute("SELECT COUNT(*) FROM messages WHERE id > ?",
+                                     (state['last_rowid'],)).fetchone()[0]
+        finally:
+            conn.close()
+
+        self.save_checkpoint(state)
+        self.target.refresh()
+        duration = time.time() - start_time
+        report = dict(state, copied_this_run=copied, batches_this_run=batches, remaining=remaining,
+                      duration_ms=round(duration * 1000, 2),
+                      messages_per_second=round(copied / duration, 1) if duration else 0.0)
+        logger.info(f"Backfill copied {copied} messages in {batches} batches ({report['duration_ms']:.2f}ms), "
+                    f"{remaining} remaining")
+        return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Copy the SQLite search database into another backend')
+    parser.add_argument('--db', default=None,
+                        help="SQLite search database to copy from (default: data/apex_search.db, "
+                             "or the tenant's database with --customer-id)")
+    parser.add_argument('--customer-id', default=None,
+                        help="copy one tenant's messages, stored as that tenant's in the target")
+    parser.add_argument('--target', default='elasticsearch', help='backend to copy into (ELASTICSEARCH_URL for ES)')
+    parser.add_argument('--checkpoint', default=None,
+                        help='checkpoint file (default: data/backfill.<target>[.<customer-id>].json)')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument('--max-retries', type=int, default=BACKFILL_MAX_RETRIES)
+    parser.add_argument('--pause-seconds', type=float, default=BACKFILL_PAUSE_SECONDS)
+    parser.add_argument('--max-batches', type=int, default=None, help='stop after this many batches')
+    parser.add_argument('--since', default=None,
+                        help='also re-copy rows created at or after this UTC time (e.g. a dual-write first_lost_at)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and copy everything')
+    args = parser.parse_args(argv)
+
+    customer_id = None
+    if args.customer_id:
+        try:
+            customer_id = normalize_customer_id(args.customer_id)
+        except ValueError:
+            parser.error(f"Invalid --customer-id {args.customer_id}")
+    if args.db is None:
+        args.db = tenant_db_path(customer_id) if customer_id else 'data/apex_search.db'
+    if not os.path.exists(args.db):
+        parser.error(f"No database at {args.db}")
+    if args.target == 'sqlite':
+        parser.error("--target sqlite would copy the database into itself")
+
+    target = create_backend(args.target, customer_id=customer_id)
+    checkpoint_name = '.'.join(part for part in ('backfill', args.target, customer_id, 'json') if part)
+    copier = BackfillCopier(
+        args.db, target,
+        args.checkpoint or os.path.join('data', checkpoint_name),
+        batch_size=args.batch_size,
+        max_retries=args.max_retries,
+        pause_seconds=args.pause_seconds
+    )
+    try:
+        report = copier.run(restart=args.restart, since=args.since, max_batches=args.max_batches)
+    except (ValueError, RuntimeError) as e:
+        logger.error(f"Backfill stopped: {str(e)}")
+        return 1
+    finally:
+        target.close()
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+APEX Search JSON encoding
+Uses orjson or ujson when installed and falls back to the stdlib json module
+"""
+
+import json
+import os
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional: much faster encoding of large search responses
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Force an encoder with APEX_JSON_BACKEND=orjson|ujson|json; by default the
+# fastest installed one is used
+_requested = os.getenv('APEX_JSON_BACKEND', '').lower()
+if _requested == 'json' or (orjson is None and ujson is None):
+    JSON_BACKEND = 'json'
+elif _requested == 'ujson' and ujson is not None:
+    JSON_BACKEND = 'ujson'
+elif orjson is not None:
+    JSON_BACKEND = 'orjson'
+else:
+    JSON_BACKEND = 'ujson'
+
+if _requested and _requested != JSON_BACKEND:
+    logger.warning(f"APEX_JSON_BACKEND={_requested} is not installed, using {JSON_BACKEND}")
+
+
+def _default(value: Any) -> Any:
+    """Encode the non-JSON types search results can carry"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Compact UTF-8 JSON, as sent in response bodies"""
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    if JSON_BACKEND == 'ujson':
+        return ujson.dumps(obj, ensure_ascii=False, default=_default).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def dumps(obj: Any) -> str:
+    """Compact JSON text"""
+    if JSON_BACKEND == 'orjson':
+        return dumps_bytes(obj).decode('utf-8')
+    if JSON_BACKEND == 'ujson':
+        return ujson.dumps(obj, ensure_ascii=False, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    if JSON_BACKEND == 'ujson':
+        return ujson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration for the APEX Search API
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('APEX_SEARCH_BIND', '0.0.0.0:5000')
+
+# SQLite reads scale across processes; each worker holds its own connections
+workers = int(os.getenv('APEX_SEARCH_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('APEX_SEARCH_THREADS', '4'))
+timeout = int(os.getenv('APEX_SEARCH_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound SQLite page-cache growth
+max_requests = int(os.getenv('APEX_SEARCH_MAX_REQUESTS', '10000'))
+max_requests_jitter = 1000
+
+# The app is safe to preload (nothing is opened at import), which lets
+# workers share the imported code pages
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+# Workers share /metrics through per-process files in this directory, so a
+# scrape that lands on any worker reports the whole server
+os.environ.setdefault('APEX_METRICS_DIR', 'data/metrics')
+
+
+def on_starting(server):
+    """Drop metric files left by a previous server run"""
+    metrics_dir = os.environ['APEX_METRICS_DIR']
+    if os.path.isdir(metrics_dir):
+        for filename in os.listdir(metrics_dir):
+            if filename.endswith('.json') or filename.endswith('.tmp'):
+                os.remove(os.path.join(metrics_dir, filename))
+
+
+def post_worker_init(worker):
+    """Open the search engine and start services inside the worker process"""
+    from app import init_worker
+    init_worker()
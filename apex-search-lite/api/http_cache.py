@@ -0,0 +1,158 @@
+"""
+APEX Search HTTP caching and compression
+ETags derived from the engine's write generation, and gzip/brotli bodies
+"""
+
+import gzip
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fast_json
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed; the headers would eat the saving
+COMPRESS_MIN_BYTES = int(os.getenv('APEX_COMPRESS_MIN_BYTES', '1024'))
+
+# Favour speed: search responses are built per request, never cached compressed
+GZIP_LEVEL = int(os.getenv('APEX_GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.getenv('APEX_BROTLI_QUALITY', '4'))
+
+# How long a /stats ETag stays valid without any writes
+STATS_ETAG_SECONDS = int(os.getenv('APEX_STATS_ETAG_SECONDS', '60'))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript')
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best content coding the client accepts: br, then gzip, else None"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', accepted.get('*', 0)) > 0:
+        return 'gzip'
+    return None
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def make_etag(*parts: Any) -> str:
+    """Opaque tag for a response that depends only on parts"""
+    digest = hashlib.sha1(fast_json.dumps_bytes(parts)).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def search_etag(generation: Optional[str], endpoint: str, params: Dict[str, Any]) -> Optional[str]:
+    """
+    ETag for a search: identical parameters against the same write
+    generation always produce the same hits, so the tag can be checked
+    before running the query at all
+    """
+    if generation is None:
+        return None
+    return make_etag('search', generation, endpoint, sorted(params.items(), key=lambda item: item[0]))
+
+
+def stats_etag(generation: Optional[str]) -> Optional[str]:
+    """
+    ETag for /stats. recent_messages_24h moves with the clock as well as
+    with writes, so the tag also rolls over every STATS_ETAG_SECONDS.
+    """
+    if generation is None:
+        return None
+    return make_etag('stats', generation, int(time.time() // STATS_ETAG_SECONDS))
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    wanted = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        """ASGI middleware compressing complete (non-streamed) response bodies"""
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state: Dict[str, Any] = {'start': None, 'streaming': False}
+
+        async def send_compressed(message):
+            if message['type'] == 'http.response.start':
+                state['start'] = message
+                return
+            if message['type'] != 'http.response.body' or state['streaming']:
+                await send(message)
+                return
+
+            start = state['start']
+            body = message.get('body', b'')
+            if message.get('more_body'):
+                # Streamed response: pass it through untouched
+                state['streaming'] = True
+                await send(start)
+                await send(message)
+                return
+
+            response_headers: List[Tuple[bytes, bytes]] = list(start.get('headers', []))
+            names = {name.lower() for name, _ in response_headers}
+            content_type = dict(response_headers).get(b'content-type', b'').decode('latin-1')
+            if (len(body) >= self.minimum_size and b'content-encoding' not in names
+                    and is_compressible(content_type)):
+                body = compress(body, encoding)
+                response_headers = [(name, value) for name, value in response_headers
+                                    if name.lower() != b'content-length']
+                response_headers.append((b'content-length', str(len(body)).encode()))
+                response_headers.append((b'content-encoding', encoding.encode()))
+            response_headers.append((b'vary', b'Accept-Encoding'))
+
+            await send(dict(start, headers=response_headers))
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,455 @@
+"""
+APEX Search Metrics
+Counters, gauges and histograms rendered in the Prometheus text format
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cached lookups up to the query timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Messages per ingest call: single adds and bulk batches
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000)
+
+# Server processes (gunicorn workers) share metrics through this directory:
+# each writes its own state file and /metrics merges them all
+METRICS_DIR = os.getenv('APEX_METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('APEX_METRICS_FLUSH_SECONDS', '5'))
+
+# Counters and histograms of exited processes, folded into one file so the
+# directory does not grow with every recycled worker
+DEAD_METRICS_FILE = 'dead.json'
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[Any, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self) -> List[List[Any]]:
+        """Serializable [label values, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), local: bool = False):
+        """local gauges describe shared state (file sizes) and are never summed across processes"""
+        super().__init__(name, documentation, labels)
+        self.local = local
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = state
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self) -> List[List[Any]]:
+        with self._lock:
+            return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        """All metrics of this process, in registration order"""
+        self.metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = (), local: bool = False) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, local))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State of every metric, as written to the shared metrics directory"""
+        return {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'metrics': {name: metric.snapshot() for name, metric in self.metrics.items()}
+        }
+
+    def render(self, snapshots: Optional[List[Dict[str, Any]]] = None) -> str:
+        """
+        Prometheus text exposition of this process's metrics, or of the
+        merged snapshots of several processes. Counters and histograms are
+        summed across processes (including exited ones, so totals never go
+        backwards when a worker is recycled); gauges are summed across
+        processes that are still running, except local ones, which come
+        from the rendering process alone.
+        """
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+
+        lines = []
+        for name, metric in self.metrics.items():
+            merged: Dict[Tuple[Any, ...], Any] = {}
+            for snapshot in snapshots:
+                if metric.type_name == 'gauge':
+                    if not snapshot.get('alive', True):
+                        continue
+                    if metric.local and snapshot.get('pid') != os.getpid():
+                        continue
+                for key, value in snapshot['metrics'].get(name, []):
+                    key = tuple(key)
+                    if metric.type_name == 'histogram':
+                        if len(value[0]) != len(metric.buckets) + 1:
+                            continue  # written with different buckets by an older build
+                        state = merged.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            for key in sorted(merged):
+                value = merged[key]
+                if metric.type_name == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float('inf'),), value[0]):
+                        cumulative += count
+                        le = f'le="{_format_value(bound)}"'
+                        lines.append(f"{name}_bucket{_format_labels(metric.label_names, key, le)} {cumulative}")
+                    labels = _format_labels(metric.label_names, key)
+                    lines.append(f"{name}_sum{labels} {_format_value(value[1])}")
+                    lines.append(f"{name}_count{labels} {value[2]}")
+                else:
+                    lines.append(f"{name}{_format_labels(metric.label_names, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsExporter:
+    def __init__(self, registry: Registry, metrics_dir: str, interval_seconds: float = METRICS_FLUSH_SECONDS):
+        """Periodically writes this process's metrics to the shared directory"""
+        self.registry = registry
+        self.metrics_dir = metrics_dir
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    def flush(self):
+        path = os.path.join(self.metrics_dir, f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(temp_path, path)
+
+    def collect(self) -> List[Dict[str, Any]]:
+        """
+        Latest snapshot of every process that has written one. Files of
+        exited processes are folded into DEAD_METRICS_FILE (their gauges
+        dropped) under a lock file, so concurrent scrapes never count a
+        process twice.
+        """
+        self.flush()
+        with open(os.path.join(self.metrics_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            dead = None
+            snapshots, exited = [], []
+            for filename in os.listdir(self.metrics_dir):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.metrics_dir, filename)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue  # being replaced or truncated; the next scrape will see it
+                if filename == DEAD_METRICS_FILE:
+                    dead = snapshot
+                elif _pid_alive(snapshot.get('pid', 0)):
+                    snapshot['alive'] = True
+                    snapshots.append(snapshot)
+                else:
+                    exited.append((filename, snapshot))
+
+            if exited:
+                dead = self._fold(dead, [snapshot for _, snapshot in exited])
+                path = os.path.join(self.metrics_dir, DEAD_METRICS_FILE)
+                with open(f"{path}.tmp", 'w') as f:
+                    json.dump(dead, f)
+                os.replace(f"{path}.tmp", path)
+                for filename, _ in exited:
+                    try:
+                        os.remove(os.path.join(self.metrics_dir, filename))
+                    except OSError:
+                        pass
+
+        if dead is not None:
+            dead['alive'] = False
+            snapshots.append(dead)
+        return snapshots
+
+    def _fold(self, dead: Optional[Dict[str, Any]], exited: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Sum the counters and histograms of exited processes into one snapshot"""
+        totals: Dict[str, Dict[Tuple[Any, ...], Any]] = {}
+        for snapshot in ([dead] if dead else []) + exited:
+            for name, values in snapshot['metrics'].items():
+                metric = self.registry.metrics.get(name)
+                if metric is None or metric.type_name == 'gauge':
+                    continue
+                merged = totals.setdefault(name, {})
+                for key, value in values:
+                    key = tuple(key)
+                    if metric.type_name == 'histogram':
+                        if len(value[0]) != len(metric.buckets) + 1:
+                            continue  # written with different buckets by an older build
+                        state = merged.setdefault(key, [[0] * len(value[0]), 0.0, 0])
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+        return {
+            'pid': None,
+            'written_at': time.time(),
+            'metrics': {name: [[list(key), value] for key, value in merged.items()]
+                        for name, merged in totals.items()}
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Metrics flush error: {str(e)}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='apex-metrics', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+REGISTRY = Registry()
+
+# Search
+SEARCH_REQUEST_SECONDS = REGISTRY.histogram(
+    'apex_search_request_seconds', 'End-to-end search request latency', ('endpoint', 'shape'))
+SEARCH_PHASE_SECONDS = REGISTRY.histogram(
+    'apex_search_phase_seconds',
+    'Search latency by phase (SQLite: build, fetch, count, facets; Elasticsearch: cluster, client; encode)',
+    ('endpoint', 'shape', 'phase'))
+SEARCH_TIMEOUTS = REGISTRY.counter(
+    'apex_search_timed_out_total', 'Searches that ran out of time budget and returned partial results',
+    ('endpoint', 'shape'))
+SLOW_QUERIES = REGISTRY.counter(
+    'apex_search_slow_queries_total', 'Searches over the slow-query threshold', ('shape',))
+SEARCH_ERRORS = REGISTRY.counter(
+    'apex_search_errors_total', 'Searches that failed', ('endpoint',))
+ES_CLIENT_SECONDS = REGISTRY.histogram(
+    'apex_es_client_request_seconds', 'Elasticsearch request round trips as the API sees them (elasticsearch backend)',
+    ('operation', 'outcome'))
+
+CACHE_HITS = REGISTRY.counter(
+    'apex_http_not_modified_total', 'Requests answered 304 from an ETag match (client cache hits)',
+    ('endpoint',))
+
+SUGGEST_SECONDS = REGISTRY.histogram(
+    'apex_suggest_seconds', 'Typeahead lookup latency', ('field',))
+
+# Ingest
+INGEST_MESSAGES = REGISTRY.counter(
+    'apex_ingest_messages_total', 'Messages written to the search index', ('path',))
+INGEST_FAILURES = REGISTRY.counter(
+    'apex_ingest_failures_total', 'Messages that failed to be written', ('path',))
+INGEST_SECONDS = REGISTRY.histogram(
+    'apex_ingest_seconds', 'Latency of one ingest call (a message or a batch)', ('path',))
+INGEST_BATCH_SIZE = REGISTRY.histogram(
+    'apex_ingest_batch_size', 'Messages per ingest call', ('path',), buckets=BATCH_SIZE_BUCKETS)
+
+DUAL_WRITE_MESSAGES = REGISTRY.counter(
+    'apex_dual_write_messages_total', 'Messages handed to the secondary backend, by outcome (written, failed, dropped)',
+    ('outcome',))
+DUAL_WRITE_QUEUE_DEPTH = REGISTRY.gauge(
+    'apex_dual_write_queue_depth', 'Messages waiting to be written to the secondary backend')
+
+# Concurrency
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    'apex_http_requests_in_flight', 'HTTP requests being served')
+QUERY_QUEUE_DEPTH = REGISTRY.gauge(
+    'apex_query_queue_depth', 'Queries waiting for a query slot', ('executor',))
+QUERY_SLOTS_BUSY = REGISTRY.gauge(
+    'apex_query_slots_busy', 'Query slots currently running a query', ('executor',))
+
+# Storage (sampled at scrape time)
+DB_FILE_BYTES = REGISTRY.gauge(
+    'apex_db_file_bytes', 'Size of the SQLite database files (summed over tenant databases in tenant mode)',
+    ('file',), local=True)
+SQLITE_TENANT_DATABASES = REGISTRY.gauge(
+    'apex_sqlite_tenant_databases', 'SQLite tenant databases the storage figures are summed over', local=True)
+SQLITE_PAGES = REGISTRY.gauge(
+    'apex_sqlite_pages', 'SQLite page counts: database pages and free pages', ('kind',), local=True)
+SQLITE_CACHE_SIZE_LIMIT = REGISTRY.gauge(
+    'apex_sqlite_cache_size_limit_pages',
+    'Configured page-cache limit per connection (PRAGMA cache_size); a setting, not cache usage', local=True)
+SQLITE_PAGE_SIZE = REGISTRY.gauge(
+    'apex_sqlite_page_size_bytes', 'SQLite page size', local=True)
+
+_import_pid = os.getpid()
+_exporter: Optional[MetricsExporter] = None
+_exporter_pid: Optional[int] = None
+
+
+def start_exporter() -> Optional[MetricsExporter]:
+    """Share this process's metrics through APEX_METRICS_DIR, if configured"""
+    global _exporter, _exporter_pid
+    if not METRICS_DIR:
+        return None
+    if _exporter_pid != os.getpid():
+        if os.getpid() != _import_pid:
+            # Values inherited from a pre-fork parent belong to the parent
+            for metric in REGISTRY.metrics.values():
+                with metric._lock:
+                    metric._values.clear()
+        _exporter = MetricsExporter(REGISTRY, METRICS_DIR)
+        _exporter.start()
+        # Keep the counts of the final seconds when a worker is recycled
+        atexit.register(_exporter.flush)
+        _exporter_pid = os.getpid()
+    return _exporter
+
+
+def render_metrics() -> str:
+    """Prometheus exposition for the whole server (all workers when shared)"""
+    if _exporter is not None and _exporter_pid == os.getpid():
+        return REGISTRY.render(_exporter.collect())
+    return REGISTRY.render()
+
+
+def observe_search(endpoint: str, shape: str, results: Dict[str, Any],
+                   total_seconds: float, encode_seconds: float = 0.0):
+    """Record one search request's latency, phase timings and outcome"""
+    if 'error' in results:
+        SEARCH_ERRORS.inc(endpoint=endpoint)
+        return
+
+    SEARCH_REQUEST_SECONDS.observe(total_seconds, endpoint=endpoint, shape=shape)
+    for phase, phase_ms in results.get('phases_ms', {}).items():
+        SEARCH_PHASE_SECONDS.observe(phase_ms / 1000, endpoint=endpoint, shape=shape, phase=phase)
+    SEARCH_PHASE_SECONDS.observe(encode_seconds, endpoint=endpoint, shape=shape, phase='encode')
+    if results.get('timed_out'):
+        SEARCH_TIMEOUTS.inc(endpoint=endpoint, shape=shape)
+
+
+def observe_storage(storage: Dict[str, Any]):
+    """Update the storage gauges from ApexSearchEngine.storage_stats() or TenantRouter.storage_stats()"""
+    for file_kind in ('db', 'wal', 'shm'):
+        DB_FILE_BYTES.set(storage.get(f'{file_kind}_bytes', 0), file=file_kind)
+    for kind in ('page_count', 'freelist_count'):
+        if kind in storage:
+            SQLITE_PAGES.set(storage[kind], kind=kind)
+    if 'tenants' in storage:
+        SQLITE_TENANT_DATABASES.set(storage['tenants'])
+    if 'cache_size_limit_pages' in storage:
+        SQLITE_CACHE_SIZE_LIMIT.set(storage['cache_size_limit_pages'])
+    if 'page_size' in storage:
+        SQLITE_PAGE_SIZE.set(storage['page_size'])
@@ -0,0 +1,130 @@
+"""
+APEX Search query-string parser
+Turns an analyst's one-line query into search_messages parameters
+
+    from:billing domain:acme.com score>0.8 "wire transfer" after:2025-10-01
+
+Operators (values may be "quoted"):
+    from: sender:       sender address contains
+    to: recipient:      recipient address contains
+    domain:             sender domain contains
+    ip:                 sender IP equals
+    category: threat:   threat category equals
+    action:             APEX action equals
+    subject:            words in the subject
+    content: body:      words in the body
+    after: since:       timestamp on or after (ISO date or datetime)
+    before: until:      timestamp on or before (a bare date includes that whole day)
+    score>0.8           threat score comparison (>, >=, <, <=)
+    sort:recent         newest first instead of by relevance
+
+Everything else is free text searched across subject and content and
+ranked by relevance: words, "exact phrases", -excluded words and prefix*.
+A query that is a single bare email address, domain or IP is treated as
+that filter, as quick search always has.
+"""
+
+import re
+from typing import Dict, List, Any
+
+# operator -> search_messages parameter
+FIELD_OPERATORS = {
+    'from': 'sender',
+    'sender': 'sender',
+    'to': 'recipient',
+    'recipient': 'recipient',
+    'domain': 'domain',
+    'ip': 'ip_address',
+    'category': 'threat_category',
+    'threat': 'threat_category',
+    'action': 'apex_action',
+    'subject': 'subject',
+    'content': 'content',
+    'body': 'content',
+    'after': 'date_from',
+    'since': 'date_from',
+    'before': 'date_to',
+    'until': 'date_to'
+}
+
+# Words accumulate across repeated operators (subject:wire subject:transfer)
+TEXT_FIELDS = {'subject', 'content'}
+
+SCORE_OPERATORS = {'>': 'gt', '>=': 'gte', '<': 'lt', '<=': 'lte'}
+
+_TOKEN_RE = re.compile(
+    r'(?P<field>[A-Za-z_]+)(?P<op>:|>=|<=|>|<)(?:"(?P<quoted_value>[^"]*)"|(?P<value>[^\s"]+))'
+    r'|(?P<phrase>-?"[^"]*")'
+    r'|(?P<word>\S+)'
+)
+_EMAIL_RE = re.compile(r'^[^@\s]*@[^@\s]+$')
+_IP_RE = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$|^[0-9a-fA-F:]*:[0-9a-fA-F:]+$')
+_DOMAIN_RE = re.compile(r'^[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)+$')
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Appended to a bare before:/until: date. Timestamps compare as ISO
+# strings, and '2025-10-01T09:00:00' <= '2025-10-01' is False
+END_OF_DAY = 'T23:59:59.999999'
+
+
+def _bare_term_params(term: str) -> Dict[str, Any]:
+    """Quick search's original single-term heuristics"""
+    if _EMAIL_RE.match(term):
+        return {'sender': term}
+    if _IP_RE.match(term):
+        return {'ip_address': term}
+    if _DOMAIN_RE.match(term) and not term.replace('.', '').isdigit():
+        return {'domain': term}
+    return {}
+
+
+def parse_query(query: str) -> Dict[str, Any]:
+    """
+    Compile a query string into search_messages parameters. Free text
+    goes to 'text' and, unless sort:recent was given, asks for relevance
+    ordering.
+    """
+    query = query.strip()
+    params: Dict[str, Any] = {}
+    text_terms: List[str] = []
+    sort = None
+
+    single = _bare_term_params(query) if ' ' not in query else {}
+    if single:
+        return single
+
+    for match in _TOKEN_RE.finditer(query):
+        field = (match.group('field') or '').lower()
+        operator = match.group('op')
+        value = match.group('quoted_value')
+        if value is None:
+            value = match.group('value')
+
+        if field == 'score' and operator in SCORE_OPERATORS:
+            try:
+                params.setdefault('threat_score', {})[SCORE_OPERATORS[operator]] = float(value)
+                continue
+            except ValueError:
+                pass  # not a number: search for it as text
+
+        if operator == ':' and field == 'sort' and value in ('relevance', 'recent'):
+            sort = value
+            continue
+
+        if operator == ':' and field in FIELD_OPERATORS and value:
+            name = FIELD_OPERATORS[field]
+            if name in TEXT_FIELDS and name in params:
+                params[name] = f"{params[name]} {value}"
+            elif name == 'date_to' and _DATE_RE.match(value):
+                params[name] = value + END_OF_DAY
+            else:
+                params[name] = value
+            continue
+
+        text_terms.append(match.group(0))
+
+    if text_terms:
+        params['text'] = " ".join(text_terms)
+    if sort == 'relevance' or (sort is None and ('text' in params or TEXT_FIELDS & set(params))):
+        params['sort'] = 'relevance'
+    return params
@@ -0,0 +1,277 @@
+"""
+APEX Search Replication
+Snapshot shipping from the writer node to read-only search replicas
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import logging
+import urllib.request
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_PATTERN = 'apex_search.{generation}.db'
+
+# Generations kept on disk: the current one, the one follower workers may
+# still be attached to until their next sync tick, and one more so a
+# follower that missed a tick can still open new connections
+KEEP_GENERATIONS = 3
+
+
+def _file_sha256(path: str) -> str:
+    """Checksum a snapshot file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _prune_generations(directory: str, keep: int = KEEP_GENERATIONS):
+    """Delete all but the newest snapshot files in a directory"""
+    snapshots = glob.glob(os.path.join(directory, SNAPSHOT_PATTERN.format(generation='*')))
+    snapshots.sort(key=lambda path: int(path.rsplit('.', 2)[-2]))
+    for path in snapshots[:-keep]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove old snapshot {path}: {str(e)}")
+
+
+class _PeriodicThread:
+    """Shared start/stop plumbing for the publisher and the replica sync"""
+
+    thread_name = 'apex-replication'
+
+    def __init__(self, interval_seconds: int):
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"{self.thread_name} error: {str(e)}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        logger.info(f"{self.thread_name} started (every {self.interval_seconds}s)")
+
+    def stop(self):
+        """Stop the background thread"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+class SnapshotPublisher(_PeriodicThread):
+    """
+    Runs on the writer node. Copies the live database into an immutable,
+    numbered snapshot with the SQLite online backup API whenever it has
+    changed, and describes the newest one in manifest.json.
+    """
+
+    thread_name = 'apex-snapshot-publisher'
+
+    def __init__(self, engine, snapshot_dir: str, interval_seconds: int = 30,
+                 pages_per_step: int = 1024):
+        super().__init__(interval_seconds)
+        self.engine = engine
+        self.snapshot_dir = snapshot_dir
+        self.pages_per_step = pages_per_step
+        self._conn: Optional[sqlite3.Connection] = None
+        self._published_data_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        """Return the current manifest, if a snapshot has been published"""
+        path = os.path.join(self.snapshot_dir, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def snapshot_path(self) -> Optional[str]:
+        """Absolute path of the newest published snapshot"""
+        manifest = self.manifest()
+        if not manifest:
+            return None
+        return os.path.join(self.snapshot_dir, manifest['file'])
+
+    def run_once(self) -> Dict[str, Any]:
+        """Publish a new snapshot if the database changed since the last one"""
+        with self._lock:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            if self._conn is None:
+                self._conn = self.engine._connect()
+
+            # data_version only moves when another connection commits, so an
+            # idle index is never re-copied
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._published_data_version and self.manifest():
+                return {'published': False, 'generation': self.manifest()['generation']}
+
+            start_time = time.time()
+            generation = int(time.time() * 1000)
+            file_name = SNAPSHOT_PATTERN.format(generation=generation)
+            tmp_path = os.path.join(self.snapshot_dir, f'.{file_name}.tmp')
+
+            # Copy in steps so the writer is only paused for a page batch at a time
+            target = sqlite3.connect(tmp_path)
+            try:
+                self._conn.backup(target, pages=self.pages_per_step, sleep=0.005)
+                # Replicas open snapshots immutable, so fold everything into
+                # a single rollback-journal file with no WAL
+                target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+
+            final_path = os.path.join(self.snapshot_dir, file_name)
+            os.replace(tmp_path, final_path)
+
+            manifest = {
+                'generation': generation,
+                'file': file_name,
+                'size_bytes': os.path.getsize(final_path),
+                'sha256': _file_sha256(final_path),
+                'created_at': datetime.utcnow().isoformat(),
+                'copy_time_ms': round((time.time() - start_time) * 1000, 2)
+            }
+            manifest_tmp = os.path.join(self.snapshot_dir, f'.{MANIFEST_NAME}.tmp')
+            with open(manifest_tmp, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_tmp, os.path.join(self.snapshot_dir, MANIFEST_NAME))
+
+            self._published_data_version = data_version
+            _prune_generations(self.snapshot_dir)
+
+            logger.info(f"Published search snapshot {generation} ({manifest['size_bytes']} bytes)")
+            return dict(manifest, published=True)
+
+    def stop(self):
+        super().stop()
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+
+class ReplicaSync(_PeriodicThread):
+    """
+    Runs on read replicas. Polls the writer (an http(s) base URL exposing
+    /replication/manifest and /replication/snapshot, or a shared snapshot
+    directory) and swaps the engine onto each new generation.
+    With follower=True it never contacts the writer and only picks up
+    generations another worker process has already downloaded into
+    replica_dir.
+    """
+
+    thread_name = 'apex-replica-sync'
+
+    def __init__(self, engine, source: str, replica_dir: str = 'data/replica',
+                 interval_seconds: int = 30, timeout_seconds: int = 60,
+                 follower: bool = False):
+        super().__init__(interval_seconds)
+        self.engine = engine
+        self.source = source.rstrip('/')
+        self.replica_dir = replica_dir
+        self.timeout_seconds = timeout_seconds
+        self.follower = follower
+        self.generation: Optional[int] = None
+        self.last_sync: Optional[str] = None
+        # If a follower lags further behind and its snapshot gets pruned,
+        # move to the newest one rather than failing new connections
+        engine.on_snapshot_missing = self.attach_latest_local
+
+    def _is_remote(self) -> bool:
+        return self.source.startswith('http://') or self.source.startswith('https://')
+
+    def _fetch_manifest(self) -> Optional[Dict[str, Any]]:
+        if self._is_remote():
+            with urllib.request.urlopen(f"{self.source}/replication/manifest",
+                                        timeout=self.timeout_seconds) as response:
+                return json.load(response).get('manifest')
+
+        path = os.path.join(self.source, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _download(self, manifest: Dict[str, Any], destination: str):
+        if self._is_remote():
+            url = f"{self.source}/replication/snapshot?generation={manifest['generation']}"
+            with urllib.request.urlopen(url, timeout=self.timeout_seconds) as response, \
+                    open(destination, 'wb') as f:
+                shutil.copyfileobj(response, f, 1024 * 1024)
+        else:
+            shutil.copyfile(os.path.join(self.source, manifest['file']), destination)
+
+    def attach_latest_local(self) -> bool:
+        """Open the newest snapshot already on disk, e.g. after a restart"""
+        snapshots = glob.glob(os.path.join(self.replica_dir, SNAPSHOT_PATTERN.format(generation='*')))
+        if not snapshots:
+            return False
+        latest = max(snapshots, key=lambda path: int(path.rsplit('.', 2)[-2]))
+        generation = int(latest.rsplit('.', 2)[-2])
+        if generation == self.generation:
+            return False
+        self.engine.open_snapshot(latest)
+        self.generation = generation
+        self.last_sync = datetime.utcnow().isoformat()
+        return True
+
+    def run_once(self) -> Dict[str, Any]:
+        """Download and attach the writer's newest snapshot if it is new"""
+        if self.follower:
+            return {'updated': self.attach_latest_local(), 'generation': self.generation}
+
+        manifest = self._fetch_manifest()
+        if not manifest or manifest['generation'] == self.generation:
+            return {'updated': False, 'generation': self.generation}
+
+        os.makedirs(self.replica_dir, exist_ok=True)
+        final_path = os.path.join(self.replica_dir, manifest['file'])
+        tmp_path = os.path.join(self.replica_dir, f".{manifest['file']}.{os.getpid()}.tmp")
+
+        self._download(manifest, tmp_path)
+        if os.path.getsize(tmp_path) != manifest['size_bytes'] or \
+                _file_sha256(tmp_path) != manifest['sha256']:
+            os.remove(tmp_path)
+            raise ValueError(f"Snapshot {manifest['generation']} failed verification")
+
+        os.replace(tmp_path, final_path)
+        self.engine.open_snapshot(final_path)
+        self.generation = manifest['generation']
+        self.last_sync = datetime.utcnow().isoformat()
+        _prune_generations(self.replica_dir)
+
+        return {'updated': True, 'generation': self.generation}
+
+    def status(self) -> Dict[str, Any]:
+        """Replication state for health checks"""
+        return {
+            'source': self.source,
+            'follower': self.follower,
+            'generation': self.generation,
+            'last_sync': self.last_sync
+        }
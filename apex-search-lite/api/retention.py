@@ -0,0 +1,104 @@
+"""
+APEX Search Retention Policy
+Per-category TTLs for the search index, enforced by a background purge
+"""
+
+import json
+import os
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    def __init__(self, retention_days: Optional[Dict[str, int]] = None,
+                 default_days: Optional[int] = None):
+        """
+        Days to keep per threat category; default_days covers categories
+        without an entry (None: keep them). An empty policy deletes nothing.
+        """
+        self.retention_days = dict(retention_days or {})
+        self.default_days = default_days
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.retention_days) or self.default_days is not None
+
+    @classmethod
+    def from_env(cls) -> 'RetentionPolicy':
+        """
+        Load the policy from APEX_RETENTION_POLICY, a JSON object of
+        category -> days, e.g. {"legitimate": 30, "spam": 90, "default": 365}.
+        A "default" key sets the period for unlisted categories. Unset, the
+        policy is disabled and nothing is ever purged.
+        """
+        raw = os.getenv('APEX_RETENTION_POLICY')
+        if not raw:
+            return cls()
+
+        config = {category: int(days) for category, days in json.loads(raw).items()}
+        default_days = config.pop('default', None)
+        return cls(config, default_days)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable view of the policy"""
+        return {
+            'enabled': self.enabled,
+            'retention_days': self.retention_days,
+            'default_days': self.default_days
+        }
+
+
+class RetentionWorker:
+    def __init__(self, engine, policy: RetentionPolicy, interval_seconds: int = 3600,
+                 batch_size: int = 1000, pause_seconds: float = 0.05):
+        """Background thread that periodically purges expired messages"""
+        self.engine = engine
+        self.policy = policy
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Dict[str, Any]:
+        """Run a single purge pass and remember its report"""
+        # Serialize passes so a manual purge never overlaps the scheduled one
+        with self._lock:
+            report = self.engine.purge_expired(
+                self.policy.retention_days,
+                default_days=self.policy.default_days,
+                batch_size=self.batch_size,
+                pause_seconds=self.pause_seconds
+            )
+            report['completed_at'] = datetime.utcnow().isoformat()
+            self.last_report = report
+            return report
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention purge error: {str(e)}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        """Start the background purge thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='apex-retention', daemon=True)
+        self._thread.start()
+        logger.info(f"Retention worker started (every {self.interval_seconds}s)")
+
+    def stop(self):
+        """Stop the background purge thread"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,673 @@
+"""
+APEX Search backends
+One search/ingest/stats interface over the SQLite and Elasticsearch engines, chosen by APEX_SEARCH_BACKEND, with optional dual writes to a second one and per-tenant routing
+"""
+
+import atexit
+import importlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+import metrics
+from search_engine import ApexSearchEngine, get_search_engine
+from slow_queries import SlowQueryLog
+
+logger = logging.getLogger(__name__)
+
+# sqlite | elasticsearch
+SEARCH_BACKEND = os.getenv('APEX_SEARCH_BACKEND', 'sqlite')
+
+# While migrating, a second backend that every accepted write is copied to
+# in the background (empty: no dual writes). Searches stay on SEARCH_BACKEND
+SECONDARY_BACKEND = os.getenv('APEX_SEARCH_SECONDARY_BACKEND', '')
+
+# Dual-write queue: messages waiting for the secondary, per process. When
+# it is full a write waits up to DUAL_WRITE_ENQUEUE_TIMEOUT_SECONDS for
+# room, then its copy is dropped (and counted) rather than stall ingestion
+DUAL_WRITE_QUEUE_SIZE = int(os.getenv('APEX_DUAL_WRITE_QUEUE_SIZE', '10000'))
+DUAL_WRITE_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv('APEX_DUAL_WRITE_ENQUEUE_TIMEOUT_SECONDS', '0.5'))
+DUAL_WRITE_BATCH_SIZE = int(os.getenv('APEX_DUAL_WRITE_BATCH_SIZE', '500'))
+DUAL_WRITE_MAX_RETRIES = int(os.getenv('APEX_DUAL_WRITE_MAX_RETRIES', '3'))
+
+# How long an exiting process (e.g. a recycled worker) keeps draining its queue
+DUAL_WRITE_DRAIN_SECONDS = float(os.getenv('APEX_DUAL_WRITE_DRAIN_SECONDS', '10'))
+
+# Message ids of the latest copies that never reached the secondary, for status
+MAX_RECENT_LOST = 20
+
+# Tenancy: off, or header (every search and write is for the tenant -
+# customerId, the customer's email domain - named in TENANT_HEADER, as set
+# by the APEX web app's middleware)
+TENANT_MODE = os.getenv('APEX_TENANT_MODE', 'off')
+TENANT_HEADER = 'X-Customer-Id'
+
+# SQLite tenants each get their own database, <dir>/<customer_id>/apex_search.db,
+# so one tenant's searches never read another's pages
+TENANT_DATA_DIR = os.getenv('APEX_TENANT_DATA_DIR', 'data/tenants')
+
+# Backend per tenant, as JSON: {"big.com": "elasticsearch", "moving.com":
+# ["sqlite", "elasticsearch"]} (a pair dual-writes while migrating). Tenants
+# not listed use SEARCH_BACKEND
+TENANT_BACKENDS: Dict[str, Any] = json.loads(os.getenv('APEX_TENANT_BACKENDS', '{}'))
+
+# Tenant SQLite databases kept open per process; the least recently used
+# beyond this are closed
+TENANT_MAX_OPEN = int(os.getenv('APEX_TENANT_MAX_OPEN', '32'))
+
+# What a tenant's own SQLite database serves to that tenant. Suggestions,
+# slow query reports, replication and storage metrics are per process;
+# retention runs over every tenant database (TenantRouter.purge_expired)
+TENANT_SQLITE_FEATURES = frozenset(['similar'])
+
+# Where the Elasticsearch engine (es_engine.py) lives; by default the
+# apex-search API next to this one
+ES_API_DIR = os.getenv(
+    'APEX_ES_API_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'apex-search', 'api')
+)
+
+# Features beyond search, ingest and stats, for routes to check before use
+FEATURES = ['suggest', 'similar', 'retention', 'replication', 'slow_queries', 'storage_metrics']
+
+# Search parameters both backends take with the same meaning. Each also
+# takes a few of its own (SQLite: sort; Elasticsearch: aggs,
+# track_total_hits, cursor).
+COMMON_SEARCH_PARAMS = ['text', 'sender', 'recipient', 'domain', 'ip_address', 'subject', 'content',
+                        'date_from', 'date_to', 'threat_category', 'apex_action', 'threat_score',
+                        'size', 'from', 'timeout_ms', 'format']
+
+_CUSTOMER_ID_RE = re.compile(r'^[a-z0-9]([a-z0-9-]*[a-z0-9])?(\.[a-z0-9]([a-z0-9-]*[a-z0-9])?)*$')
+
+# The tenant the current request is for (None: no tenant, the process's backend)
+current_customer_id: ContextVar[Optional[str]] = ContextVar('apex_customer_id', default=None)
+
+
+def normalize_customer_id(value: Optional[str]) -> str:
+    """A tenant id as stored (lowercase domain), or ValueError"""
+    customer_id = (value or '').strip().lower()
+    if not customer_id or len(customer_id) > 253 or not _CUSTOMER_ID_RE.match(customer_id):
+        raise ValueError(f'Invalid or missing {TENANT_HEADER}')
+    return customer_id
+
+
+def tenant_db_path(customer_id: str, data_dir: str = TENANT_DATA_DIR) -> str:
+    return os.path.join(data_dir, customer_id, 'apex_search.db')
+
+
+class TenantNotFound(LookupError):
+    """Raised when a read names a SQLite tenant that has no database yet"""
+
+
+class SearchBackend:
+    """
+    What the API needs from a search engine. search() returns the engine's
+    response dict ({'error': ...} when the search failed) and raises
+    ValueError for parameters the backend cannot use.
+    """
+    name = 'base'
+    features = frozenset()
+
+    def supports(self, feature: str) -> bool:
+        return feature in self.features
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        raise NotImplementedError
+
+    def add_sample_data(self):
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def setup(self):
+        """Create whatever the backend needs before its first write"""
+
+    def write_generation(self) -> Optional[str]:
+        """Token that changes on every write, or None when the backend has none (no HTTP caching)"""
+        return None
+
+    def refresh(self):
+        """Make everything written so far searchable"""
+
+    def interrupter(self) -> Optional[Callable[[], None]]:
+        """
+        Callable that aborts the query running on the calling thread, or
+        None when queries are bounded some other way
+        """
+        return None
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(SearchBackend):
+    name = 'sqlite'
+    features = frozenset(FEATURES)
+
+    def __init__(self, engine: Optional[ApexSearchEngine] = None, customer_id: Optional[str] = None,
+                 features: Optional[frozenset] = None):
+        """
+        The SQLite FTS engine; this process's shared engine unless one is
+        given. customer_id names the tenant whose database engine is.
+        """
+        self._engine = engine
+        self.customer_id = customer_id
+        if features is not None:
+            self.features = features
+
+    @property
+    def engine(self) -> ApexSearchEngine:
+        return self._engine or get_search_engine()
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self.engine.search_messages(params)
+
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        return self.engine.add_message(message)
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return self.engine.add_messages(messages)
+
+    def add_sample_data(self):
+        self.engine.add_sample_data()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.engine.get_stats()
+
+    def write_generation(self) -> Optional[str]:
+        generation = self.engine.write_generation()
+        # Tenant databases count writes from the same start
+        if self.customer_id and generation is not None:
+            return f"{self.customer_id}:{generation}"
+        return generation
+
+    def interrupter(self) -> Optional[Callable[[], None]]:
+        # Connections are per thread: this is the caller's
+        return self.engine.conn.interrupt
+
+    def close(self):
+        if self._engine:
+            self._engine.close()
+
+
+def add_es_api_path():
+    """Make ES_API_DIR's modules importable, after this API's own"""
+    if ES_API_DIR not in sys.path:
+        # Appended, so the apex-search API's app.py never shadows ours
+        sys.path.append(ES_API_DIR)
+
+
+def load_es_engine():
+    """Import es_engine from ES_API_DIR"""
+    add_es_api_path()
+    return importlib.import_module('es_engine')
+
+
+class ElasticsearchBackend(SearchBackend):
+    name = 'elasticsearch'
+    features = frozenset()
+
+    def __init__(self, client: Any = None, customer_id: Optional[str] = None, engine: Any = None):
+        """
+        apex-search's Elasticsearch engine; a client is created from
+        ELASTICSEARCH_URL unless a client or engine is given. With a
+        customer_id every search, write and stat is that tenant's (tenants
+        share one engine and its connection pool).
+        """
+        self.module = load_es_engine()
+        self.customer_id = customer_id
+        if engine is None:
+            engine = self.module.ElasticsearchEngine(client)
+            engine.metrics.listeners.append(self._observe_request)
+        self.engine = engine
+
+    @staticmethod
+    def _observe_request(operation: str, seconds: float, error: bool):
+        metrics.ES_CLIENT_SECONDS.observe(seconds, operation=operation, outcome='error' if error else 'ok')
+
+    def _stamp(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        # Whatever tenant the message names, it is stored as this one's
+        return dict(message, customer_id=self.customer_id) if self.customer_id else message
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self.customer_id:
+            params = dict(params, customer_id=self.customer_id)
+        return self.engine.search_messages(params)
+
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        return self.engine.add_message(self._stamp(message))
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return self.engine.add_messages([self._stamp(message) for message in messages])
+
+    def add_sample_data(self):
+        if self.customer_id:
+            raise ValueError('Sample data is not loaded for tenants')
+        self.engine.add_sample_data()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.engine.get_stats(customer_id=self.customer_id)
+
+    def setup(self):
+        self.engine.setup_index()
+
+    def refresh(self):
+        self.engine.refresh()
+
+
+class DualWriteRouter(SearchBackend):
+    def __init__(self, primary: SearchBackend, secondary: SearchBackend,
+                 queue_size: int = DUAL_WRITE_QUEUE_SIZE, batch_size: int = DUAL_WRITE_BATCH_SIZE,
+                 max_retries: int = DUAL_WRITE_MAX_RETRIES,
+                 enqueue_timeout_seconds: float = DUAL_WRITE_ENQUEUE_TIMEOUT_SECONDS):
+        """
+        Ingestion router for moving between backends without downtime.
+        Searches, stats and features are the primary's. Writes go to the
+        primary first and, once it has accepted them, are queued for a
+        background thread that copies them to the secondary in batches.
+        Both backends key messages by message_id, so retried or repeated
+        copies overwrite rather than duplicate.
+        
+        Copies that are dropped (queue full) or keep failing are counted
+        and the time of the first is kept (first_lost_at): rerun the
+        backfill with --since that time to repair the secondary.
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.name = primary.name
+        self.features = primary.features
+        self.customer_id = getattr(primary, 'customer_id', None)
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.enqueue_timeout_seconds = enqueue_timeout_seconds
+        self.counts = {'queued': 0, 'written': 0, 'failed': 0, 'dropped': 0}
+        self.first_lost_at: Optional[str] = None
+        self.recent_lost: deque = deque(maxlen=MAX_RECENT_LOST)
+        self._queue: 'queue.Queue[Tuple[float, Dict[str, Any]]]' = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='apex-dual-write', daemon=True)
+        self._thread.start()
+        tenant = f" for {self.customer_id}" if self.customer_id else ''
+        logger.info(f"Dual-writing {primary.name} -> {secondary.name}{tenant} (queue {queue_size})")
+
+    @property
+    def engine(self) -> Any:
+        return self.primary.engine
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self.primary.search(params)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.primary.get_stats()
+
+    def write_generation(self) -> Optional[str]:
+        return self.primary.write_generation()
+
+    def interrupter(self) -> Optional[Callable[[], None]]:
+        return self.primary.interrupter()
+
+    def refresh(self):
+        self.primary.refresh()
+
+    def setup(self):
+        self.primary.setup()
+        self.secondary.setup()
+
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        if not self.primary.add_message(message):
+            return False
+        self._enqueue([message])
+        return True
+
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        added = self.primary.add_messages(messages)
+        if added:
+            self._enqueue(messages)
+        return added
+
+    def add_sample_data(self):
+        # Sample data is for trying a backend out, not migrated
+        self.primary.add_sample_data()
+
+    def _lost(self, outcome: str, messages: List[Dict[str, Any]], written_at: float):
+        """Record copies that will not reach the secondary; written_at is when the primary took them"""
+        with self._lock:
+            self.counts[outcome] += len(messages)
+            if self.first_lost_at is None:
+                self.first_lost_at = datetime.utcfromtimestamp(written_at).isoformat()
+            self.recent_lost.extend(message.get('message_id') for message in messages)
+        metrics.DUAL_WRITE_MESSAGES.inc(len(messages), outcome=outcome)
+
+    def _enqueue(self, messages: List[Dict[str, Any]]):
+        dropped = []
+        written_at = time.time()
+        for message in messages:
+            try:
+                # A copy: callers may go on to change their dict
+                self._queue.put((written_at, dict(message)), timeout=self.enqueue_timeout_seconds)
+            except queue.Full:
+                dropped.append(message)
+        queued = len(messages) - len(dropped)
+        with self._lock:
+            self.counts['queued'] += queued
+        metrics.DUAL_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+        if dropped:
+            self._lost('dropped', dropped, written_at)
+            logger.warning(f"Dual-write queue full: dropped {len(dropped)} copies for {self.secondary.name}")
+
+    def _write_batch(self, batch: List[Tuple[float, Dict[str, Any]]]):
+        """Copy one batch to the secondary, retrying the whole batch with backoff"""
+        messages = [message for _, message in batch]
+        written = 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                written = self.secondary.add_messages(messages)
+            except Exception as e:
+                logger.error(f"Dual-write to {self.secondary.name} failed: {str(e)}")
+                written = 0
+            if written == len(messages) or self._stop.is_set():
+                break
+            self._stop.wait(min(2 ** attempt * 0.1, 5))
+
+        if written == len(messages):
+            with self._lock:
+                self.counts['written'] += written
+            metrics.DUAL_WRITE_MESSAGES.inc(written, outcome='written')
+        else:
+            # Which copies failed is not known; count the whole batch
+            self._lost('failed', messages, batch[0][0])
+            logger.error(f"Dual-write gave up on {len(messages)} messages for {self.secondary.name}")
+
+    def _run(self):
+        try:
+            self.secondary.setup()
+        except Exception as e:
+            logger.error(f"Dual-write secondary setup failed: {str(e)}")
+
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                metrics.DUAL_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued copy has been handled; False on timeout"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        """Dual-write progress for health checks"""
+        with self._lock:
+            status = dict(self.counts)
+            status['recent_lost'] = list(self.recent_lost)
+        oldest = self._queue.queue[0][0] if self._queue.qsize() else None
+        status.update({
+            'customer_id': self.customer_id,
+            'primary': self.primary.name,
+            'secondary': self.secondary.name,
+            'pending': self._queue.qsize(),
+            'lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'first_lost_at': self.first_lost_at
+        })
+        return status
+
+    def close(self):
+        self.flush(DUAL_WRITE_DRAIN_SECONDS)
+        self._stop.set()
+        self._thread.join(DUAL_WRITE_DRAIN_SECONDS)
+        self.primary.close()
+        self.secondary.close()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'elasticsearch': ElasticsearchBackend
+}
+
+
+def create_backend(name: str = SEARCH_BACKEND, **kwargs) -> SearchBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown search backend '{name}'; use one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+def create_router(primary: str = SEARCH_BACKEND, secondary: str = SECONDARY_BACKEND) -> SearchBackend:
+    """The primary backend, dual-writing to the secondary when one is configured"""
+    backend = create_backend(primary)
+    if not secondary or secondary == primary:
+        return backend
+    router = DualWriteRouter(backend, create_backend(secondary))
+    # Hand the queue over before the process goes
+    atexit.register(router.flush, DUAL_WRITE_DRAIN_SECONDS)
+    return router
+
+
+class TenantRouter:
+    def __init__(self, data_dir: str = TENANT_DATA_DIR, assignments: Optional[Dict[str, Any]] = None,
+                 max_open: int = TENANT_MAX_OPEN, es_client: Any = None):
+        """
+        Backends per tenant. A SQLite tenant searches its own database under
+        data_dir, so its queries only read its own pages and a large tenant's
+        database never slows a small one's; an Elasticsearch tenant shares
+        the cluster, with its documents routed to its own shard of each
+        index and every search filtered to it. assignments (default
+        TENANT_BACKENDS) maps tenants to a backend name, or to a
+        [primary, secondary] pair to dual-write while migrating them.
+        """
+        self.data_dir = data_dir
+        self.assignments = TENANT_BACKENDS if assignments is None else assignments
+        self.max_open = max(1, max_open)
+        self.es_client = es_client
+        # One slow query log file handle for every tenant database
+        self.slow_query_log = SlowQueryLog()
+        self._es_engine = None
+        self._backends: 'OrderedDict[str, SearchBackend]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_es_engine(self) -> Any:
+        if self._es_engine is None:
+            self._es_engine = ElasticsearchBackend(self.es_client).engine
+        return self._es_engine
+
+    def _create_one(self, name: str, customer_id: str) -> SearchBackend:
+        if name == 'sqlite':
+            engine = ApexSearchEngine(tenant_db_path(customer_id, self.data_dir))
+            engine.slow_query_log = self.slow_query_log
+            return SQLiteBackend(engine, customer_id=customer_id, features=TENANT_SQLITE_FEATURES)
+        if name == 'elasticsearch':
+            return ElasticsearchBackend(customer_id=customer_id, engine=self._shared_es_engine())
+        raise ValueError(f"Unknown search backend '{name}'; use one of {', '.join(BACKENDS)}")
+
+    def _create(self, customer_id: str) -> SearchBackend:
+        assignment = self.assignments.get(customer_id, SEARCH_BACKEND)
+        if isinstance(assignment, list):
+            primary, secondary = assignment
+            return DualWriteRouter(self._create_one(primary, customer_id),
+                                   self._create_one(secondary, customer_id))
+        return self._create_one(assignment, customer_id)
+
+    def _has_database(self, customer_id: str) -> bool:
+        """False for a tenant whose (primary) SQLite database was never created"""
+        assignment = self.assignments.get(customer_id, SEARCH_BACKEND)
+        primary = assignment[0] if isinstance(assignment, list) else assignment
+        return primary != 'sqlite' or os.path.exists(tenant_db_path(customer_id, self.data_dir))
+
+    def backend_for(self, customer_id: str, create: bool = False) -> SearchBackend:
+        """
+        The tenant's backend, opened on first use. Only ingest passes
+        create: any other request for a SQLite tenant without a database
+        raises TenantNotFound rather than leaving an empty one behind.
+        """
+        with self._lock:
+            backend = self._backends.get(customer_id)
+            if backend is not None:
+                self._backends.move_to_end(customer_id)
+                return backend
+            if not create and not self._has_database(customer_id):
+                raise TenantNotFound(f"Unknown tenant {customer_id}")
+            backend = self._create(customer_id)
+            self._backends[customer_id] = backend
+            self._evict()
+            return backend
+
+    def _evict(self):
+        """
+        Forget the least recently used SQLite tenants beyond max_open. Their
+        per-thread connections close once in-flight requests let go of the
+        backend; dual-writing tenants are kept until their migration ends.
+        """
+        idle = [customer_id for customer_id, backend in self._backends.items()
+                if isinstance(backend, SQLiteBackend)]
+        while len(self._backends) > self.max_open and idle:
+            self._backends.pop(idle.pop(0))
+
+    def sqlite_tenants(self) -> List[str]:
+        """Tenants with a database under data_dir"""
+        if not os.path.isdir(self.data_dir):
+            return []
+        return sorted(name for name in os.listdir(self.data_dir)
+                      if os.path.exists(tenant_db_path(name, self.data_dir)))
+
+    def storage_stats(self) -> Dict[str, Any]:
+        """
+        File sizes, page counts and messages summed over every SQLite tenant
+        database. Each is read through a short-lived read-only connection, so
+        health checks and scrapes neither open tenants nor reorder open ones.
+        """
+        stats = {'tenants': 0, 'total_messages': 0, 'db_bytes': 0, 'wal_bytes': 0, 'shm_bytes': 0,
+                 'page_count': 0, 'freelist_count': 0}
+        for customer_id in self.sqlite_tenants():
+            if self.assignments.get(customer_id, SEARCH_BACKEND) == 'elasticsearch':
+                continue
+            path = tenant_db_path(customer_id, self.data_dir)
+            for kind, suffix in (('db', ''), ('wal', '-wal'), ('shm', '-shm')):
+                if os.path.exists(path + suffix):
+                    stats[f'{kind}_bytes'] += os.path.getsize(path + suffix)
+            try:
+                conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, timeout=5)
+                try:
+                    stats['page_count'] += conn.execute("PRAGMA page_count").fetchone()[0]
+                    stats['freelist_count'] += conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    stats['total_messages'] += conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading storage stats of tenant {customer_id}: {str(e)}")
+            stats['tenants'] += 1
+        return stats
+
+    def purge_expired(self, retention_days: Dict[str, int], default_days: Optional[int] = None,
+                      batch_size: int = 1000, pause_seconds: float = 0.05) -> Dict[str, Any]:
+        """Retention purge of every SQLite tenant database, one after another, as one report"""
+        start_time = time.time()
+        report: Dict[str, Any] = {'rows_deleted': 0, 'deleted_by_category': {}, 'batches': 0,
+                                  'bytes_reclaimable': 0, 'tenants': 0}
+        for customer_id in self.sqlite_tenants():
+            if self.assignments.get(customer_id, SEARCH_BACKEND) == 'elasticsearch':
+                continue
+            engine = self.backend_for(customer_id).engine
+            if not isinstance(engine, ApexSearchEngine):
+                continue
+            tenant_report = engine.purge_expired(retention_days, default_days=default_days,
+                                                 batch_size=batch_size, pause_seconds=pause_seconds)
+            for key in ('rows_deleted', 'batches', 'bytes_reclaimable'):
+                report[key] += tenant_report[key]
+            for category, count in tenant_report['deleted_by_category'].items():
+                report['deleted_by_category'][category] = report['deleted_by_category'].get(category, 0) + count
+            report['tenants'] += 1
+        report['duration_ms'] = round((time.time() - start_time) * 1000, 2)
+        return report
+
+    def status(self) -> Dict[str, Any]:
+        """Open tenants and any tenant migrations, for health checks"""
+        with self._lock:
+            backends = list(self._backends.values())
+        return {
+            'mode': TENANT_MODE,
+            'data_dir': self.data_dir,
+            'open': len(backends),
+            'dual_write': [backend.status() for backend in backends if isinstance(backend, DualWriteRouter)]
+        }
+
+    def close(self):
+        with self._lock:
+            backends = list(self._backends.values())
+            self._backends.clear()
+        for backend in backends:
+            backend.close()
+
+
+_backend: Optional[SearchBackend] = None
+_backend_pid: Optional[int] = None
+_backend_lock = threading.Lock()
+
+_tenant_router: Optional[TenantRouter] = None
+_tenant_router_pid: Optional[int] = None
+
+
+def get_tenant_router() -> TenantRouter:
+    """This process's tenant router, created on first use (after any fork)"""
+    global _tenant_router, _tenant_router_pid
+    if _tenant_router is None or _tenant_router_pid != os.getpid():
+        with _backend_lock:
+            if _tenant_router is None or _tenant_router_pid != os.getpid():
+                _tenant_router = TenantRouter()
+                _tenant_router_pid = os.getpid()
+                # Hand tenant dual-write queues over before the process goes
+                atexit.register(_tenant_router.close)
+    return _tenant_router
+
+
+def get_backend() -> SearchBackend:
+    """
+    The backend of the tenant this request is for (current_customer_id),
+    else this process's configured backend, created on first use (after
+    any fork)
+    """
+    customer_id = current_customer_id.get()
+    if customer_id is not None:
+        return get_tenant_router().backend_for(customer_id)
+
+    global _backend, _backend_pid
+    if _backend is None or _backend_pid != os.getpid():
+        with _backend_lock:
+            if _backend is None or _backend_pid != os.getpid():
+                _backend = create_router()
+                _backend_pid = os.getpid()
+                logger.info(f"Search backend: {_backend.name}")
+    return _backend
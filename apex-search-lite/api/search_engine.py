@@ -3,14 +3,20 @@ APEX Super Fast Message Search Engine (Docker-Free)
 Uses SQLite FTS for sub-100ms search performance
 """
 
+import re
 import sqlite3
+import threading
 import time
-import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional, Tuple
 import logging
 
+import fast_json
+import metrics
+import minhash
+from slow_queries import SlowQueryLog, query_fingerprint, fingerprint_text
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,22 +28,214 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Columns mirrored from messages into the messages_fts index
+FTS_COLUMNS = [
+    'sender_email',
+    'sender_domain',
+    'sender_ip',
+    'recipient_email',
+    'subject',
+    'content',
+    'threat_category',
+    'apex_action',
+    'file_attachments',
+    'urls'
+]
+FTS_COLUMN_LIST = ", ".join(FTS_COLUMNS)
+
+MESSAGE_INSERT_SQL = """
+    INSERT OR REPLACE INTO messages (
+        message_id, sender_email, sender_domain, sender_ip,
+        recipient_email, subject, content, timestamp,
+        threat_category, apex_action, threat_score,
+        file_attachments, urls
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Bumped in the same transaction as every write to messages, so readers
+# (in any process, or on a replica's snapshot) can tell whether results
+# they served before are still current
+WRITE_GENERATION_SQL = "UPDATE search_meta SET value = value + 1 WHERE key = 'write_generation'"
+
+# Search time budget; requests may ask for less or more, up to the maximum
+DEFAULT_SEARCH_TIMEOUT_MS = int(os.getenv('APEX_SEARCH_TIMEOUT_MS', '2000'))
+MAX_SEARCH_TIMEOUT_MS = int(os.getenv('APEX_SEARCH_MAX_TIMEOUT_MS', '30000'))
+
+# SQLite VM instructions between deadline checks
+PROGRESS_HANDLER_INTERVAL = 1000
+
+# Near-duplicate lookups score at most this many LSH candidates, most
+# shared bands first
+MAX_SIMILAR_CANDIDATES = int(os.getenv('APEX_SIMILAR_MAX_CANDIDATES', '1000'))
+DEFAULT_MIN_SIMILARITY = 0.5
+
+def _deadline_passed(deadline: Optional[float]) -> bool:
+    """True when a search's time budget is spent"""
+    return deadline is not None and time.monotonic() >= deadline
+
+def _fts_column_query(column: str, text: str) -> Optional[str]:
+    """
+    FTS5 expression matching every word of text in one column.
+    Words are quoted so user input ("Urgent: Verify", "$1 Million!") can
+    never be parsed as FTS query syntax.
+    """
+    words = [word.replace('"', '""') for word in str(text).split()]
+    if not words:
+        return None
+    return f"{column} : (" + " ".join(f'"{word}"' for word in words) + ")"
+
+# Columns the free-text 'text' parameter searches, and their BM25 weights
+# when results are ranked by relevance (a subject hit outweighs a body hit)
+TEXT_SEARCH_COLUMNS = ['subject', 'content']
+BM25_COLUMN_WEIGHTS = {'subject': 3.0, 'content': 1.0}
+BM25_WEIGHT_LIST = ", ".join(str(BM25_COLUMN_WEIGHTS.get(column, 1.0)) for column in FTS_COLUMNS)
+
+# Free-text syntax: words, "quoted phrases", -exclusions and prefix*
+_TEXT_TERM_RE = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+
+def _fts_text_terms(text: str) -> Tuple[List[str], List[str]]:
+    """Quoted FTS5 phrases a free-text query includes and excludes"""
+    include = []
+    exclude = []
+    for negated, phrase, word in _TEXT_TERM_RE.findall(str(text)):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith('*')
+        term = term.rstrip('*') if prefix else term
+        if not re.search(r'\w', term):
+            continue  # punctuation only: nothing the tokenizer would index
+        quoted = '"' + term.replace('"', '""') + '"' + (' *' if prefix else '')
+        (exclude if negated else include).append(quoted)
+    return include, exclude
+
+def _fts_text_query(text: str, columns: List[str] = TEXT_SEARCH_COLUMNS) -> Optional[str]:
+    """
+    FTS5 expression for a free-text query across columns. Every term is
+    quoted, so only the supported operators (phrases, -exclusion, prefix*)
+    ever reach FTS5's query syntax. FTS5 cannot express a pure exclusion;
+    those are applied by _build_where instead.
+    """
+    include, exclude = _fts_text_terms(text)
+    if not include:
+        return None
+    column_filter = "{" + " ".join(columns) + "}"
+    expression = f"{column_filter} : (" + " ".join(include) + ")"
+    if exclude:
+        expression = f"({expression}) NOT ({column_filter} : (" + " OR ".join(exclude) + "))"
+    return expression
+
+# Search parameters that select messages, in the order they appear in a
+# query shape; date_from/date_to both count as "date"
+SHAPE_FILTERS = ['text', 'sender', 'recipient', 'domain', 'ip_address', 'subject', 'content', 'date',
+                 'threat_category', 'apex_action', 'threat_score']
+
+def query_shape(query_params: Dict[str, Any]) -> str:
+    """
+    Low-cardinality label for which filters a search used, e.g.
+    "domain+subject", so latency can be broken down by kind of query
+    """
+    present = set(key for key in query_params if key in SHAPE_FILTERS)
+    if 'date_from' in query_params or 'date_to' in query_params:
+        present.add('date')
+    return "+".join(name for name in SHAPE_FILTERS if name in present) or 'match_all'
+
+# Bump whenever init_database's DDL changes; databases already at this
+# version skip schema creation on startup
+SCHEMA_VERSION = 3
+
 class ApexSearchEngine:
-    def __init__(self, db_path: str = "data/apex_search.db"):
+    def __init__(self, db_path: Optional[str] = "data/apex_search.db", read_only: bool = False):
         """Initialize the APEX search engine"""
         self.db_path = db_path
-        self.conn = None
-        self.init_database()
+        self.read_only = read_only
+        self._local = threading.local()
+        self._immutable = True
+        # Called when the attached snapshot can no longer be opened (pruned
+        # by the process that downloads them); returns True once re-attached
+        self.on_snapshot_missing: Optional[Callable[[], bool]] = None
+        self.slow_query_log = SlowQueryLog()
+        if read_only:
+            # Replicas attach to a snapshot once one has been shipped
+            if db_path and os.path.exists(db_path):
+                self.open_snapshot(db_path)
+        else:
+            self.init_database()
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        Connection for the calling thread. sqlite3 connections must not be
+        shared between threads (and must be interruptible one query at a
+        time), so each server thread lazily opens its own. On replicas a
+        thread reopens when the engine has moved to a newer snapshot.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self.read_only and self._local.db_path != self.db_path:
+            conn.close()
+            conn = None
+        
+        if conn is None:
+            if self.read_only:
+                if not self.db_path:
+                    raise RuntimeError("Search replica has no snapshot attached yet")
+                try:
+                    conn = self._connect_read_only(self.db_path, self._immutable)
+                except sqlite3.OperationalError:
+                    if self.on_snapshot_missing is None or not self.on_snapshot_missing():
+                        raise
+                    conn = self._connect_read_only(self.db_path, self._immutable)
+            else:
+                conn = self._connect()
+            self._local.conn = conn
+            self._local.db_path = self.db_path
+        return conn
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the search database with performance pragmas"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging for performance
+        conn.execute("PRAGMA synchronous=NORMAL")  # Faster writes
+        conn.execute("PRAGMA cache_size=10000")   # Larger cache
+        conn.execute("PRAGMA temp_store=MEMORY")  # Store temp tables in memory
+        return conn
+    
+    def _connect_read_only(self, db_path: str, immutable: bool = True) -> sqlite3.Connection:
+        """Open a read-only connection, skipping all locking for immutable snapshots"""
+        uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+        if immutable:
+            uri += "&immutable=1"
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute("PRAGMA cache_size=10000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def open_snapshot(self, db_path: str, immutable: bool = True):
+        """
+        Point a read-only engine at a new snapshot file.
+        Threads switch over on their next query, so searches already running
+        against the previous snapshot finish undisturbed.
+        """
+        if not self.read_only:
+            raise RuntimeError("open_snapshot requires a read-only engine")
+        
+        # Fail before swapping if the file is not a usable database
+        probe = self._connect_read_only(db_path, immutable)
+        probe.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        probe.close()
+        
+        self._immutable = immutable
+        self.db_path = db_path
+        logger.info(f"Search replica attached to snapshot {db_path}")
     
     def init_database(self):
         """Initialize SQLite database with FTS support"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute("PRAGMA journal_mode=WAL")  # Write-Ahead Logging for performance
-        self.conn.execute("PRAGMA synchronous=NORMAL")  # Faster writes
-        self.conn.execute("PRAGMA cache_size=10000")   # Larger cache
-        self.conn.execute("PRAGMA temp_store=MEMORY")  # Store temp tables in memory
+        # Skip DDL entirely when the schema is already current; every
+        # worker process runs this on startup
+        schema_version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version == SCHEMA_VERSION:
+            logger.info(f"APEX Search Engine schema v{schema_version} already current")
+            return
         
         # Create main messages table
         self.conn.execute("""
@@ -61,23 +259,39 @@ class ApexSearchEngine:
         """)
         
         # Create FTS virtual table for super fast text search
-        self.conn.execute("""
+        self.conn.execute(f"""
             CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
-                sender_email,
-                sender_domain,
-                sender_ip,
-                recipient_email,
-                subject,
-                content,
-                threat_category,
-                apex_action,
-                file_attachments,
-                urls,
+                {FTS_COLUMN_LIST},
                 content='messages',
                 content_rowid='id'
             )
         """)
         
+        # Engine bookkeeping (write generation)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("INSERT OR IGNORE INTO search_meta (key, value) VALUES ('write_generation', 0)")
+        
+        # MinHash signatures and their LSH band buckets, for near-duplicate
+        # lookup; a bucket's messages are one index range scan
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS message_signatures (
+                id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS message_lsh (
+                bucket INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (bucket, id)
+            ) WITHOUT ROWID
+        """)
+        
         # Create indexes for ultra-fast lookups
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sender_email ON messages(sender_email)")
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sender_domain ON messages(sender_domain)")
@@ -87,165 +301,438 @@ class ApexSearchEngine:
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_apex_action ON messages(apex_action)")
         self.conn.execute("CREATE INDEX IF NOT EXISTS idx_threat_score ON messages(threat_score)")
         
+        # Databases from before schema v3 hold messages without signatures
+        self._backfill_signatures()
+        
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         self.conn.commit()
         logger.info("APEX Search Engine initialized successfully")
     
+    def _backfill_signatures(self, batch_size: int = 1000):
+        """Sign messages stored before near-duplicate signatures existed"""
+        start_time = time.time()
+        reader = self.conn.cursor()
+        writer = self.conn.cursor()
+        reader.execute("""
+            SELECT id, subject, content FROM messages
+            WHERE id NOT IN (SELECT id FROM message_signatures)
+        """)
+        signed = 0
+        while True:
+            batch = reader.fetchmany(batch_size)
+            if not batch:
+                break
+            self._add_similarity_rows(writer, batch)
+            signed += len(batch)
+        logger.info(f"Signed {signed} existing messages in {(time.time() - start_time) * 1000:.2f}ms")
+    
+    def _message_row(self, message_data: Dict[str, Any]) -> Tuple[Any, ...]:
+        """Column values for one messages row, in MESSAGE_INSERT_SQL order"""
+        return (
+            message_data['message_id'],
+            message_data['sender_email'],
+            message_data['sender_domain'],
+            message_data.get('sender_ip'),
+            message_data['recipient_email'],
+            message_data['subject'],
+            message_data['content'],
+            message_data['timestamp'],
+            message_data['threat_category'],
+            message_data['apex_action'],
+            message_data['threat_score'],
+            fast_json.dumps(message_data.get('file_attachments', [])),
+            fast_json.dumps(message_data.get('urls', []))
+        )
+    
     def add_message(self, message_data: Dict[str, Any]) -> bool:
         """Add a message to the search index"""
+        start_time = time.perf_counter()
         try:
             cursor = self.conn.cursor()
             
+            # Drop the FTS entry of any row this message replaces so the
+            # external-content index never points at a stale rowid
+            cursor.execute(
+                "SELECT id FROM messages WHERE message_id = ?",
+                (message_data['message_id'],)
+            )
+            existing = cursor.fetchone()
+            if existing:
+                self._delete_fts_rows(cursor, "id = ?", [existing[0]])
+                self._delete_similarity_rows(cursor, "id = ?", [existing[0]])
+            
             # Insert into main table
-            cursor.execute("""
-                INSERT OR REPLACE INTO messages (
-                    message_id, sender_email, sender_domain, sender_ip,
-                    recipient_email, subject, content, timestamp,
-                    threat_category, apex_action, threat_score,
-                    file_attachments, urls
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                message_data['message_id'],
-                message_data['sender_email'],
-                message_data['sender_domain'],
-                message_data.get('sender_ip'),
-                message_data['recipient_email'],
-                message_data['subject'],
-                message_data['content'],
-                message_data['timestamp'],
-                message_data['threat_category'],
-                message_data['apex_action'],
-                message_data['threat_score'],
-                json.dumps(message_data.get('file_attachments', [])),
-                json.dumps(message_data.get('urls', []))
-            ))
-            
-            # Insert into FTS table
-            cursor.execute("""
-                INSERT OR REPLACE INTO messages_fts (
-                    sender_email, sender_domain, sender_ip,
-                    recipient_email, subject, content,
-                    threat_category, apex_action,
-                    file_attachments, urls
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                message_data['sender_email'],
-                message_data['sender_domain'],
-                message_data.get('sender_ip', ''),
-                message_data['recipient_email'],
-                message_data['subject'],
-                message_data['content'],
-                message_data['threat_category'],
-                message_data['apex_action'],
-                json.dumps(message_data.get('file_attachments', [])),
-                json.dumps(message_data.get('urls', []))
-            ))
+            cursor.execute(MESSAGE_INSERT_SQL, self._message_row(message_data))
+            row_id = cursor.lastrowid
+            
+            # Insert into FTS table, keyed by the new row's id
+            cursor.execute(f"""
+                INSERT INTO messages_fts (rowid, {FTS_COLUMN_LIST})
+                SELECT id, {FTS_COLUMN_LIST} FROM messages WHERE id = ?
+            """, (row_id,))
+            self._add_similarity_rows(
+                cursor, [(row_id, message_data['subject'], message_data['content'])]
+            )
             
+            cursor.execute(WRITE_GENERATION_SQL)
             self.conn.commit()
+            metrics.INGEST_MESSAGES.inc(path='single')
             return True
             
         except Exception as e:
+            self.conn.rollback()
+            metrics.INGEST_FAILURES.inc(path='single')
             logger.error(f"Error adding message: {str(e)}")
             return False
+        finally:
+            metrics.INGEST_SECONDS.observe(time.perf_counter() - start_time, path='single')
+            metrics.INGEST_BATCH_SIZE.observe(1, path='single')
+    
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Add a batch of messages in one transaction.
+        Much faster than add_message per row: one commit (one WAL sync)
+        for the whole batch, and the FTS index is filled with a single
+        INSERT ... SELECT over the new rowid range.
+        Returns the number of messages written; a bad message fails the batch.
+        """
+        if not messages:
+            return 0
+        
+        start_time = time.perf_counter()
+        try:
+            cursor = self.conn.cursor()
+            
+            # Drop FTS entries of rows the batch replaces
+            message_ids = [message['message_id'] for message in messages]
+            for chunk_start in range(0, len(message_ids), 500):
+                chunk = message_ids[chunk_start:chunk_start + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                self._delete_fts_rows(cursor, f"message_id IN ({placeholders})", chunk)
+                self._delete_similarity_rows(cursor, f"message_id IN ({placeholders})", chunk)
+            
+            # AUTOINCREMENT ids only grow, so every row written below lands
+            # above the current high-water mark
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'")
+            row = cursor.fetchone()
+            high_water = row[0] if row else 0
+            
+            cursor.executemany(MESSAGE_INSERT_SQL, [self._message_row(message) for message in messages])
+            
+            cursor.execute(f"""
+                INSERT INTO messages_fts (rowid, {FTS_COLUMN_LIST})
+                SELECT id, {FTS_COLUMN_LIST} FROM messages WHERE id > ?
+            """, (high_water,))
+            cursor.execute("SELECT id, subject, content FROM messages WHERE id > ?", (high_water,))
+            self._add_similarity_rows(cursor, cursor.fetchall())
+            
+            cursor.execute(WRITE_GENERATION_SQL)
+            self.conn.commit()
+            metrics.INGEST_MESSAGES.inc(len(messages), path='bulk')
+            return len(messages)
+            
+        except Exception as e:
+            self.conn.rollback()
+            metrics.INGEST_FAILURES.inc(len(messages), path='bulk')
+            logger.error(f"Error adding message batch: {str(e)}")
+            return 0
+        finally:
+            metrics.INGEST_SECONDS.observe(time.perf_counter() - start_time, path='bulk')
+            metrics.INGEST_BATCH_SIZE.observe(len(messages), path='bulk')
+    
+    def _delete_fts_rows(self, cursor: sqlite3.Cursor, where_clause: str, params: List[Any]):
+        """Remove FTS entries for the messages rows matching where_clause"""
+        # External-content FTS5 tables need the original column values
+        # to remove tokens, so feed them straight from the messages table
+        cursor.execute(f"""
+            INSERT INTO messages_fts (messages_fts, rowid, {FTS_COLUMN_LIST})
+            SELECT 'delete', id, {FTS_COLUMN_LIST} FROM messages
+            WHERE {where_clause}
+        """, params)
+    
+    def _add_similarity_rows(self, cursor: sqlite3.Cursor, rows: List[Tuple[int, str, str]]):
+        """Store MinHash signatures and LSH buckets for (id, subject, content) rows"""
+        signatures = []
+        buckets = []
+        for row_id, subject, content in rows:
+            signature = minhash.signature(minhash.message_text(subject, content))
+            if signature is None:
+                continue
+            signatures.append((row_id, minhash.pack(signature)))
+            buckets.extend((key, row_id) for key in minhash.band_keys(signature))
+        cursor.executemany("INSERT OR REPLACE INTO message_signatures (id, signature) VALUES (?, ?)", signatures)
+        cursor.executemany("INSERT OR IGNORE INTO message_lsh (bucket, id) VALUES (?, ?)", buckets)
+    
+    def _delete_similarity_rows(self, cursor: sqlite3.Cursor, where_clause: str, params: List[Any]):
+        """Remove signatures and LSH buckets of the messages rows matching where_clause"""
+        # Bucket keys are recomputed from the stored signature, so the
+        # bucket table needs no second index by message id
+        cursor.execute(f"""
+            SELECT id, signature FROM message_signatures
+            WHERE id IN (SELECT id FROM messages WHERE {where_clause})
+        """, params)
+        signed = cursor.fetchall()
+        if not signed:
+            return
+        cursor.executemany(
+            "DELETE FROM message_lsh WHERE bucket = ? AND id = ?",
+            [(key, row_id) for row_id, blob in signed for key in minhash.band_keys(minhash.unpack(blob))]
+        )
+        cursor.executemany("DELETE FROM message_signatures WHERE id = ?", [(row_id,) for row_id, _ in signed])
+    
+    def _build_fts_query(self, query_params: Dict[str, Any]) -> Optional[str]:
+        """The search's full-text conditions as one FTS5 MATCH expression"""
+        fts_terms = []
+        if 'text' in query_params:
+            fts_terms.append(_fts_text_query(query_params['text']))
+        
+        if 'subject' in query_params:
+            fts_terms.append(_fts_column_query('subject', query_params['subject']))
+        
+        if 'content' in query_params:
+            fts_terms.append(_fts_column_query('content', query_params['content']))
+        
+        fts_terms = [term for term in fts_terms if term]
+        return " AND ".join(fts_terms) if fts_terms else None
+    
+    def _build_where(self, query_params: Dict[str, Any], include_fts: bool = True) -> Tuple[str, List[Any]]:
+        """
+        Build the WHERE clause and parameters for a search.
+        include_fts=False leaves out the full-text condition for queries
+        that join messages_fts themselves (relevance ranking).
+        """
+        where_clauses = []
+        params = []
+        
+        # Sender email search
+        if 'sender' in query_params:
+            where_clauses.append("sender_email LIKE ?")
+            params.append(f"%{query_params['sender']}%")
+        
+        # Recipient search
+        if 'recipient' in query_params:
+            where_clauses.append("recipient_email LIKE ?")
+            params.append(f"%{query_params['recipient']}%")
+        
+        # Domain search
+        if 'domain' in query_params:
+            where_clauses.append("sender_domain LIKE ?")
+            params.append(f"%{query_params['domain']}%")
+        
+        # IP address search
+        if 'ip_address' in query_params:
+            where_clauses.append("sender_ip = ?")
+            params.append(query_params['ip_address'])
+        
+        # Free-text, subject and content search (using FTS), combined into one MATCH
+        fts_query = self._build_fts_query(query_params) if include_fts else None
+        if fts_query:
+            where_clauses.append("id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(fts_query)
+        
+        # Free text that only excludes words ("-newsletter")
+        if 'text' in query_params:
+            include, exclude = _fts_text_terms(query_params['text'])
+            if exclude and not include:
+                column_filter = "{" + " ".join(TEXT_SEARCH_COLUMNS) + "}"
+                where_clauses.append("id NOT IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+                params.append(f"{column_filter} : (" + " OR ".join(exclude) + ")")
+        
+        # Date range search
+        if 'date_from' in query_params:
+            where_clauses.append("timestamp >= ?")
+            params.append(query_params['date_from'])
+        
+        if 'date_to' in query_params:
+            where_clauses.append("timestamp <= ?")
+            params.append(query_params['date_to'])
+        
+        # Threat category search
+        if 'threat_category' in query_params:
+            where_clauses.append("threat_category = ?")
+            params.append(query_params['threat_category'])
+        
+        # APEX action search
+        if 'apex_action' in query_params:
+            where_clauses.append("apex_action = ?")
+            params.append(query_params['apex_action'])
+        
+        # Threat score range, e.g. {'gt': 0.8} or {'gte': 0.2, 'lte': 0.5}
+        if 'threat_score' in query_params:
+            for operator, sql_operator in (('gt', '>'), ('gte', '>='), ('lt', '<'), ('lte', '<=')):
+                if operator in query_params['threat_score']:
+                    where_clauses.append(f"threat_score {sql_operator} ?")
+                    params.append(float(query_params['threat_score'][operator]))
+        
+        where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
+        return where_clause, params
     
     def search_messages(self, query_params: Dict[str, Any]) -> Dict[str, Any]:
-        """Super fast message search with sub-100ms performance"""
+        """
+        Super fast message search with sub-100ms performance.
+        timeout_ms bounds the whole search; when it runs out the results
+        gathered so far are returned with timed_out set, as Elasticsearch
+        does, instead of an error. phases_ms breaks query_time_ms down into
+        build, fetch, count and facets.
+        With format='compact' hits come back as a columns header plus one
+        row list per message instead of a dict per message, which is
+        smaller on the wire and cheaper to build and serialise.
+        With sort='relevance' full-text searches are ordered by BM25 (subject
+        weighted over content) and each hit carries its relevance score.
+        """
         start_time = time.time()
         
+        timeout_ms = query_params.get('timeout_ms') or DEFAULT_SEARCH_TIMEOUT_MS
+        if timeout_ms:
+            timeout_ms = min(float(timeout_ms), MAX_SEARCH_TIMEOUT_MS)
+        deadline = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+        
+        conn = self.conn
+        result = None
+        where_clause, params = None, []
+        if deadline is not None:
+            # Returning non-zero from the handler aborts the running statement
+            conn.set_progress_handler(
+                lambda: 1 if time.monotonic() >= deadline else 0,
+                PROGRESS_HANDLER_INTERVAL
+            )
+        
+        phases_ms = {}
+        phase_start = time.perf_counter()
+        
+        def end_phase(name: str):
+            nonlocal phase_start
+            now = time.perf_counter()
+            phases_ms[name] = round((now - phase_start) * 1000, 3)
+            phase_start = now
+        
         try:
-            # Build SQL query based on search parameters
-            where_clauses = []
-            params = []
-            
-            # Sender email search
-            if 'sender' in query_params:
-                where_clauses.append("sender_email LIKE ?")
-                params.append(f"%{query_params['sender']}%")
-            
-            # Domain search
-            if 'domain' in query_params:
-                where_clauses.append("sender_domain LIKE ?")
-                params.append(f"%{query_params['domain']}%")
-            
-            # IP address search
-            if 'ip_address' in query_params:
-                where_clauses.append("sender_ip = ?")
-                params.append(query_params['ip_address'])
-            
-            # Subject search (using FTS)
-            if 'subject' in query_params:
-                where_clauses.append("messages_fts MATCH ?")
-                params.append(f"subject:{query_params['subject']}")
-            
-            # Content search (using FTS)
-            if 'content' in query_params:
-                where_clauses.append("messages_fts MATCH ?")
-                params.append(f"content:{query_params['content']}")
-            
-            # Date range search
-            if 'date_from' in query_params:
-                where_clauses.append("timestamp >= ?")
-                params.append(query_params['date_from'])
-            
-            if 'date_to' in query_params:
-                where_clauses.append("timestamp <= ?")
-                params.append(query_params['date_to'])
-            
-            # Threat category search
-            if 'threat_category' in query_params:
-                where_clauses.append("threat_category = ?")
-                params.append(query_params['threat_category'])
-            
-            # APEX action search
-            if 'apex_action' in query_params:
-                where_clauses.append("apex_action = ?")
-                params.append(query_params['apex_action'])
-            
-            # Build final query
-            where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
+            where_clause, params = self._build_where(query_params)
             
-            # Get total count
-            count_query = f"SELECT COUNT(*) FROM messages WHERE {where_clause}"
-            cursor = self.conn.cursor()
-            cursor.execute(count_query, params)
-            total_hits = cursor.fetchone()[0]
-            
-            # Get paginated results
             limit = query_params.get('size', 50)
             offset = query_params.get('from', 0)
+            compact = query_params.get('format') == 'compact'
             
-            search_query = f"""
-                SELECT * FROM messages 
-                WHERE {where_clause}
-                ORDER BY timestamp DESC, threat_score DESC
-                LIMIT ? OFFSET ?
-            """
+            timed_out = False
+            columns = []
+            rows = []
+            total_hits = None
+            facets = {}
             
-            cursor.execute(search_query, params + [limit, offset])
-            rows = cursor.fetchall()
+            end_phase('build')
             
-            # Convert rows to dictionaries
-            columns = [description[0] for description in cursor.description]
-            messages = [dict(zip(columns, row)) for row in rows]
+            # Fetch the page first so a query that runs out of budget still
+            # returns the hits it found
+            fts_query = self._build_fts_query(query_params)
+            if fts_query and query_params.get('sort') == 'relevance':
+                # Rank inside FTS5 and join only the matches back to messages
+                filter_clause, filter_params = self._build_where(query_params, include_fts=False)
+                search_query = f"""
+                    SELECT messages.*, -ranked.score AS relevance
+                    FROM (
+                        SELECT rowid, bm25(messages_fts, {BM25_WEIGHT_LIST}) AS score
+                        FROM messages_fts WHERE messages_fts MATCH ?
+                    ) AS ranked
+                    JOIN messages ON messages.id = ranked.rowid
+                    WHERE {filter_clause}
+                    ORDER BY ranked.score, timestamp DESC
+                    LIMIT ? OFFSET ?
+                """
+                page_params = [fts_query] + filter_params + [limit, offset]
+            else:
+                search_query = f"""
+                    SELECT * FROM messages 
+                    WHERE {where_clause}
+                    ORDER BY timestamp DESC, threat_score DESC
+                    LIMIT ? OFFSET ?
+                """
+                page_params = params + [limit, offset]
+            cursor = conn.cursor()
+            try:
+                cursor.execute(search_query, page_params)
+                columns = [description[0] for description in cursor.description]
+                while True:
+                    batch = cursor.fetchmany(100)
+                    if not batch:
+                        break
+                    rows.extend(batch)
+            except sqlite3.OperationalError:
+                if not _deadline_passed(deadline):
+                    raise
+                timed_out = True
+            end_phase('fetch')
+            
+            # Get total count
+            if not timed_out:
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM messages WHERE {where_clause}", params)
+                    total_hits = cursor.fetchone()[0]
+                except sqlite3.OperationalError:
+                    if not _deadline_passed(deadline):
+                        raise
+                    timed_out = True
+                end_phase('count')
             
             # Get facets/aggregations
-            facets = self._get_facets(where_clause, params)
+            if not timed_out:
+                facets, timed_out = self._get_facets(where_clause, params, deadline)
+                end_phase('facets')
             
             end_time = time.time()
             query_time_ms = (end_time - start_time) * 1000
             
-            return {
+            if timed_out:
+                logger.warning(f"Search timed out after {query_time_ms:.2f}ms, returning partial results")
+            
+            result = {
                 'query_time_ms': round(query_time_ms, 2),
-                'total_hits': total_hits,
-                'messages': messages,
+                'timed_out': timed_out,
+                # Without a completed count, report a lower bound like ES does
+                'total_hits': total_hits if total_hits is not None else offset + len(rows),
+                'total_hits_relation': 'eq' if total_hits is not None else 'gte',
+                'phases_ms': phases_ms,
                 'facets': facets
             }
+            if compact:
+                result['columns'] = columns
+                result['rows'] = rows
+            else:
+                result['messages'] = [dict(zip(columns, row)) for row in rows]
+            return result
             
         except Exception as e:
             logger.error(f"Search error: {str(e)}")
             return {'error': str(e)}
+        finally:
+            if deadline is not None:
+                conn.set_progress_handler(None, PROGRESS_HANDLER_INTERVAL)
+            if result is not None and self.slow_query_log.is_slow(result['query_time_ms']):
+                self._log_slow_query(query_params, where_clause, params, result)
+    
+    def _log_slow_query(self, query_params: Dict[str, Any], where_clause: str,
+                        params: List[Any], result: Dict[str, Any]):
+        """Write a slow search to the slow-query log with its query plan"""
+        try:
+            plan_rows = self.conn.execute(f"""
+                EXPLAIN QUERY PLAN SELECT * FROM messages
+                WHERE {where_clause}
+                ORDER BY timestamp DESC, threat_score DESC
+                LIMIT ? OFFSET ?
+            """, params + [query_params.get('size', 50), query_params.get('from', 0)]).fetchall()
+            plan = [row[-1] for row in plan_rows]
+            
+            self.slow_query_log.record(query_params, result, plan)
+            metrics.SLOW_QUERIES.inc(shape=query_shape(query_params))
+            logger.warning(
+                f"Slow search ({result['query_time_ms']:.2f}ms): "
+                f"{fingerprint_text(query_fingerprint(query_params))}"
+            )
+        except Exception as e:
+            logger.error(f"Error logging slow query: {str(e)}")
     
-    def _get_facets(self, where_clause: str, params: List[Any]) -> Dict[str, List[Dict]]:
-        """Get aggregation facets for search results"""
+    def _get_facets(self, where_clause: str, params: List[Any],
+                    deadline: Optional[float] = None) -> Tuple[Dict[str, List[Dict]], bool]:
+        """Get aggregation facets for search results, and whether time ran out"""
         facets = {}
         
         try:
@@ -292,9 +779,95 @@ class ApexSearchEngine:
             ]
             
         except Exception as e:
+            if _deadline_passed(deadline):
+                # Keep the facets that completed
+                return facets, True
             logger.error(f"Error getting facets: {str(e)}")
         
-        return facets
+        return facets, False
+    
+    def similar_messages(self, message_id: str, limit: int = 20,
+                         min_similarity: float = DEFAULT_MIN_SIMILARITY) -> Optional[Dict[str, Any]]:
+        """
+        Near duplicates of a message, most similar first.
+        Candidates come from the LSH buckets the message's signature falls
+        in (a few index lookups, no text scan) and are ranked by estimated
+        Jaccard similarity of their subject + content shingles.
+        Returns None when the message does not exist.
+        """
+        start_time = time.time()
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                SELECT messages.id, message_signatures.signature FROM messages
+                LEFT JOIN message_signatures ON message_signatures.id = messages.id
+                WHERE messages.message_id = ?
+            """, (message_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            
+            row_id, blob = row
+            scored = []
+            candidate_count = 0
+            if blob is not None:
+                signature = minhash.unpack(blob)
+                keys = minhash.band_keys(signature)
+                placeholders = ", ".join("?" for _ in keys)
+                cursor.execute(f"""
+                    SELECT id FROM message_lsh
+                    WHERE bucket IN ({placeholders}) AND id != ?
+                    GROUP BY id
+                    ORDER BY COUNT(*) DESC
+                    LIMIT ?
+                """, keys + [row_id, MAX_SIMILAR_CANDIDATES])
+                candidates = [candidate for candidate, in cursor.fetchall()]
+                candidate_count = len(candidates)
+                
+                for chunk_start in range(0, len(candidates), 500):
+                    chunk = candidates[chunk_start:chunk_start + 500]
+                    chunk_placeholders = ", ".join("?" for _ in chunk)
+                    cursor.execute(
+                        f"SELECT id, signature FROM message_signatures WHERE id IN ({chunk_placeholders})",
+                        chunk
+                    )
+                    for candidate, candidate_blob in cursor.fetchall():
+                        score = minhash.similarity(signature, minhash.unpack(candidate_blob))
+                        if score >= min_similarity:
+                            scored.append((score, candidate))
+            
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            total_similar = len(scored)
+            scored = scored[:limit]
+            
+            messages = []
+            if scored:
+                placeholders = ", ".join("?" for _ in scored)
+                cursor.execute(
+                    f"SELECT * FROM messages WHERE id IN ({placeholders})",
+                    [candidate for _, candidate in scored]
+                )
+                columns = [description[0] for description in cursor.description]
+                by_id = {}
+                for message_row in cursor.fetchall():
+                    message = dict(zip(columns, message_row))
+                    by_id[message['id']] = message
+                for score, candidate in scored:
+                    if candidate in by_id:
+                        messages.append(dict(by_id[candidate], similarity=round(score, 3)))
+            
+            return {
+                'message_id': message_id,
+                'query_time_ms': round((time.time() - start_time) * 1000, 2),
+                'candidates': candidate_count,
+                'total_similar': total_similar,
+                'min_similarity': min_similarity,
+                'messages': messages
+            }
+            
+        except Exception as e:
+            logger.error(f"Similar messages error: {str(e)}")
+            return {'error': str(e)}
     
     def get_stats(self) -> Dict[str, Any]:
         """Get search engine statistics"""
@@ -341,6 +914,45 @@ class ApexSearchEngine:
             logger.error(f"Error getting stats: {str(e)}")
             return {'error': str(e)}
     
+    def write_generation(self) -> Optional[str]:
+        """
+        Token that changes whenever the indexed messages change, or None
+        when the database predates it (callers must then assume it changed)
+        """
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM search_meta WHERE key = 'write_generation'"
+            ).fetchone()
+        except (sqlite3.Error, RuntimeError):
+            return None
+        if row is None:
+            return None
+        if self.read_only:
+            # Every snapshot is a new file, so key on the file as well
+            return f"{os.path.basename(self.db_path)}:{row[0]}"
+        return str(row[0])
+    
+    def storage_stats(self) -> Dict[str, Any]:
+        """Database and WAL file sizes, SQLite page counts and the configured page-cache limit"""
+        stats = {}
+        if self.db_path:
+            for kind, suffix in (('db', ''), ('wal', '-wal'), ('shm', '-shm')):
+                path = self.db_path + suffix
+                stats[f'{kind}_bytes'] = os.path.getsize(path) if os.path.exists(path) else 0
+        
+        try:
+            cursor = self.conn.cursor()
+            page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+            cache_size = cursor.execute("PRAGMA cache_size").fetchone()[0]
+            stats['page_size'] = page_size
+            stats['page_count'] = cursor.execute("PRAGMA page_count").fetchone()[0]
+            stats['freelist_count'] = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            # A negative cache_size is a budget in KiB rather than pages
+            stats['cache_size_limit_pages'] = cache_size if cache_size >= 0 else (-cache_size * 1024) // page_size
+        except Exception as e:
+            logger.error(f"Error reading storage stats: {str(e)}")
+        return stats
+    
     def add_sample_data(self):
         """Add sample data for testing"""
         sample_messages = [
@@ -396,10 +1008,128 @@ class ApexSearchEngine:
         
         logger.info(f"Added {len(sample_messages)} sample messages")
     
+    def purge_expired(self, retention_days: Dict[str, int], default_days: Optional[int] = None,
+                      batch_size: int = 1000, pause_seconds: float = 0.05) -> Dict[str, Any]:
+        """
+        Delete messages older than their category's retention period.
+        Works through the table in small rowid ranges, each in its own short
+        transaction, so ingestion is never blocked for more than one batch.
+        """
+        start_time = time.time()
+        now = datetime.utcnow()
+        
+        # Build the expiry condition: one clause per configured category,
+        # plus a catch-all for categories without an explicit policy
+        expiry_clauses = []
+        expiry_params = []
+        for category, days in retention_days.items():
+            expiry_clauses.append("(threat_category = ? AND timestamp < ?)")
+            expiry_params.extend([category, (now - timedelta(days=days)).isoformat()])
+        
+        if default_days is not None:
+            placeholders = ", ".join("?" for _ in retention_days)
+            category_filter = f"threat_category NOT IN ({placeholders}) AND " if retention_days else ""
+            expiry_clauses.append(f"({category_filter}timestamp < ?)")
+            expiry_params.extend(list(retention_days))
+            expiry_params.append((now - timedelta(days=default_days)).isoformat())
+        
+        report = {
+            'rows_deleted': 0,
+            'deleted_by_category': {},
+            'batches': 0,
+            'bytes_reclaimable': 0
+        }
+        if not expiry_clauses:
+            report['duration_ms'] = 0.0
+            return report
+        
+        expiry_condition = " OR ".join(expiry_clauses)
+        
+        # The purge runs on its own connection so it can be driven from a
+        # background thread while the main connection keeps serving searches
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(id), MAX(id) FROM messages")
+            min_id, max_id = cursor.fetchone()
+            
+            batch_start = min_id
+            while min_id is not None and batch_start <= max_id:
+                batch_end = batch_start + batch_size
+                where_clause = f"id >= ? AND id < ? AND ({expiry_condition})"
+                params = [batch_start, batch_end] + expiry_params
+                
+                cursor.execute(f"""
+                    SELECT threat_category, COUNT(*) FROM messages
+                    WHERE {where_clause}
+                    GROUP BY threat_category
+                """, params)
+                batch_counts = dict(cursor.fetchall())
+                
+                if batch_counts:
+                    self._delete_fts_rows(cursor, where_clause, params)
+                    self._delete_similarity_rows(cursor, where_clause, params)
+                    cursor.execute(f"DELETE FROM messages WHERE {where_clause}", params)
+                    deleted = cursor.rowcount
+                    cursor.execute(WRITE_GENERATION_SQL)
+                    conn.commit()
+                    
+                    report['rows_deleted'] += deleted
+                    for category, count in batch_counts.items():
+                        report['deleted_by_category'][category] = (
+                            report['deleted_by_category'].get(category, 0) + count
+                        )
+                    
+                    # Give waiting writers a chance at the lock
+                    if pause_seconds:
+                        time.sleep(pause_seconds)
+                
+                report['batches'] += 1
+                batch_start = batch_end
+            
+            cursor.execute("PRAGMA freelist_count")
+            free_pages = cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_size")
+            report['bytes_reclaimable'] = free_pages * cursor.fetchone()[0]
+        finally:
+            conn.close()
+        
+        report['duration_ms'] = round((time.time() - start_time) * 1000, 2)
+        logger.info(
+            f"Retention purge removed {report['rows_deleted']} messages "
+            f"in {report['batches']} batches ({report['duration_ms']:.2f}ms)"
+        )
+        return report
+    
     def close(self):
         """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        conn = getattr(self._local, 'conn', None)
+        if conn:
+            conn.close()
+            self._local.conn = None
+
+# Replicas serve shipped snapshots read-only
+SEARCH_MODE = os.getenv('APEX_SEARCH_MODE', 'primary')
+SEARCH_DB_PATH = os.getenv('APEX_SEARCH_DB', 'data/apex_search.db')
+
+_engine: Optional[ApexSearchEngine] = None
+_engine_pid: Optional[int] = None
+_engine_lock = threading.Lock()
 
-# Global search engine instance
-search_engine = ApexSearchEngine()
+def get_search_engine() -> ApexSearchEngine:
+    """
+    Return this process's search engine, creating it on first use.
+    Nothing is opened at import time, and a process forked from one that
+    already had an engine (e.g. gunicorn --preload) builds a fresh one
+    instead of reusing the parent's SQLite handles.
+    """
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine_pid != os.getpid():
+                if SEARCH_MODE == 'replica':
+                    _engine = ApexSearchEngine(None, read_only=True)
+                else:
+                    _engine = ApexSearchEngine(SEARCH_DB_PATH)
+                _engine_pid = os.getpid()
+    return _engine
@@ -0,0 +1,207 @@
+"""
+APEX Search Slow-Query Log
+Query fingerprints and a structured log of searches over the slow threshold
+"""
+
+import hashlib
+import json
+import os
+import threading
+import logging
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Searches slower than this are written to the slow log (0 logs everything)
+SLOW_QUERY_MS = float(os.getenv('APEX_SLOW_QUERY_MS', '500'))
+SLOW_QUERY_LOG_PATH = os.getenv('APEX_SLOW_QUERY_LOG', 'logs/apex_slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv('APEX_SLOW_QUERY_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# How each filter is matched by ApexSearchEngine._build_where
+FILTER_MATCH_TYPES = {
+    'text': 'fts',
+    'sender': 'contains',
+    'recipient': 'contains',
+    'domain': 'contains',
+    'ip_address': 'exact',
+    'subject': 'fts',
+    'content': 'fts',
+    'threat_category': 'exact',
+    'apex_action': 'exact',
+    'threat_score': 'range'
+}
+
+# Upper bounds (in hours) of the date-span buckets in a fingerprint
+DATE_SPAN_BUCKETS = [(1, '1h'), (24, '1d'), (24 * 7, '7d'), (24 * 30, '30d'), (24 * 90, '90d')]
+
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None)
+
+
+def _date_span(query_params: Dict[str, Any]) -> Optional[str]:
+    """Bucketed width of the date range, or how it is open-ended"""
+    if 'date_from' not in query_params and 'date_to' not in query_params:
+        return None
+    if 'date_from' not in query_params:
+        return 'until'
+    if 'date_to' not in query_params:
+        return 'since'
+
+    date_from = _parse_time(query_params['date_from'])
+    date_to = _parse_time(query_params['date_to'])
+    if date_from is None or date_to is None:
+        return 'unparsed'
+
+    hours = (date_to - date_from).total_seconds() / 3600
+    for limit, label in DATE_SPAN_BUCKETS:
+        if hours <= limit:
+            return f"<={label}"
+    return f">{DATE_SPAN_BUCKETS[-1][1]}"
+
+
+def query_fingerprint(query_params: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Describe a search by its structure rather than its values: which
+    filters were present and how each is matched (exact, substring or
+    user wildcard, FTS word count), the date span and the page depth.
+    Searches with the same fingerprint run the same kind of plan.
+    """
+    fingerprint = {}
+    for name, match_type in FILTER_MATCH_TYPES.items():
+        if name not in query_params:
+            continue
+        value = str(query_params[name])
+        if match_type == 'contains' and ('%' in value or '_' in value):
+            match_type = 'wildcard'
+        elif match_type == 'fts':
+            words = len(value.split())
+            match_type = f"fts:{words if words < 4 else '4+'}w"
+        fingerprint[name] = match_type
+
+    date_span = _date_span(query_params)
+    if date_span:
+        fingerprint['date'] = date_span
+
+    if query_params.get('sort') == 'relevance':
+        fingerprint['sort'] = 'relevance'
+
+    offset = int(query_params.get('from', 0) or 0)
+    if offset:
+        fingerprint['offset'] = '<1k' if offset < 1000 else '>=1k'
+    return fingerprint
+
+
+def fingerprint_text(fingerprint: Dict[str, str]) -> str:
+    """Stable one-line form of a fingerprint, e.g. "domain=contains date=<=7d" """
+    return " ".join(f"{name}={value}" for name, value in sorted(fingerprint.items())) or 'match_all'
+
+
+def fingerprint_id(fingerprint: Dict[str, str]) -> str:
+    """Short hash identifying a fingerprint across log lines and processes"""
+    return hashlib.sha1(fingerprint_text(fingerprint).encode()).hexdigest()[:12]
+
+
+class SlowQueryLog:
+    def __init__(self, path: str = SLOW_QUERY_LOG_PATH, threshold_ms: float = SLOW_QUERY_MS,
+                 max_bytes: int = SLOW_QUERY_LOG_MAX_BYTES, backups: int = SLOW_QUERY_LOG_BACKUPS):
+        """
+        JSON-lines log of slow searches. Every server process appends to the
+        same file, so aggregating it covers all workers.
+        """
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._handler = None
+        self._lock = threading.Lock()
+
+    def is_slow(self, query_time_ms: float) -> bool:
+        return query_time_ms >= self.threshold_ms
+
+    def _get_handler(self) -> RotatingFileHandler:
+        if self._handler is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups)
+        return self._handler
+
+    def record(self, query_params: Dict[str, Any], result: Dict[str, Any],
+               plan: Optional[List[str]] = None):
+        """Append one slow search with its fingerprint, timings and plan"""
+        fingerprint = query_fingerprint(query_params)
+        entry = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'pid': os.getpid(),
+            'fingerprint_id': fingerprint_id(fingerprint),
+            'fingerprint': fingerprint_text(fingerprint),
+            'query_time_ms': result.get('query_time_ms'),
+            'phases_ms': result.get('phases_ms', {}),
+            'timed_out': result.get('timed_out', False),
+            'total_hits': result.get('total_hits'),
+            'params': {key: value for key, value in query_params.items() if not key.startswith('_')},
+            'plan': plan or []
+        }
+        record = logging.LogRecord(__name__, logging.WARNING, self.path, 0, json.dumps(entry, default=str), None, None)
+        with self._lock:
+            self._get_handler().handle(record)
+
+    def entries(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Logged slow searches, oldest first, from the current log file"""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        since_text = since.isoformat() if since else None
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # partially written by another process
+                if since_text and entry.get('timestamp', '') < since_text:
+                    continue
+                entries.append(entry)
+        return entries
+
+    def top(self, limit: int = 20, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Slow searches grouped by fingerprint, worst total time first"""
+        groups: Dict[str, Dict[str, Any]] = {}
+        for entry in self.entries(since):
+            group = groups.get(entry['fingerprint_id'])
+            if group is None:
+                group = groups[entry['fingerprint_id']] = {
+                    'fingerprint_id': entry['fingerprint_id'],
+                    'fingerprint': entry['fingerprint'],
+                    'count': 0,
+                    'timed_out': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'mean_phases_ms': {},
+                    'first_seen': entry['timestamp']
+                }
+            query_time_ms = entry.get('query_time_ms') or 0.0
+            group['count'] += 1
+            group['timed_out'] += 1 if entry.get('timed_out') else 0
+            group['total_ms'] += query_time_ms
+            for phase, phase_ms in entry.get('phases_ms', {}).items():
+                group['mean_phases_ms'][phase] = group['mean_phases_ms'].get(phase, 0.0) + phase_ms
+            if query_time_ms >= group['max_ms']:
+                # Keep the worst instance as the example to reproduce
+                group['max_ms'] = query_time_ms
+                group['example_params'] = entry.get('params')
+                group['plan'] = entry.get('plan')
+            group['last_seen'] = entry['timestamp']
+
+        ranked = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:limit]
+        for group in ranked:
+            group['mean_ms'] = round(group['total_ms'] / group['count'], 2)
+            group['total_ms'] = round(group['total_ms'], 2)
+            group['mean_phases_ms'] = {phase: round(total / group['count'], 2)
+                                       for phase, total in group['mean_phases_ms'].items()}
+        return ranked
@@ -0,0 +1,189 @@
+"""
+APEX Search Typeahead
+In-memory prefix index of senders, domains and subjects ranked by frequency
+"""
+
+import bisect
+import heapq
+import os
+import threading
+import time
+import logging
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields that can be completed, and the names the API also accepts for them
+SUGGEST_FIELDS = ['sender_email', 'sender_domain', 'subject']
+FIELD_ALIASES = {'sender': 'sender_email', 'domain': 'sender_domain'}
+
+# New messages are folded in at most this often, so a burst of keystrokes
+# never waits on more than one incremental refresh
+SUGGEST_REFRESH_SECONDS = float(os.getenv('APEX_SUGGEST_REFRESH_SECONDS', '1'))
+
+# Incremental refreshes only ever add; a periodic rebuild drops values whose
+# messages were purged or replaced
+SUGGEST_REBUILD_SECONDS = float(os.getenv('APEX_SUGGEST_REBUILD_SECONDS', '600'))
+
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+# Prefix ranges wider than this are answered by walking keys in count order
+# instead of selecting the top N out of the whole range
+WIDE_PREFIX_KEYS = 1000
+
+
+class _FieldIndex:
+    def __init__(self):
+        """Sorted lowercase keys with a display value and count for each"""
+        self.keys: List[str] = []
+        self.values: Dict[str, List[Any]] = {}  # key -> [display value, count]
+        self.ranked: List[str] = []  # the same keys, most frequent first
+
+    def _count(self, key: str) -> int:
+        return self.values[key][1]
+
+    def add_counts(self, counts: Dict[str, int]):
+        """
+        Fold in new occurrences. Lists are replaced rather than sorted in
+        place so lookups running on other threads always see a whole list.
+        """
+        new_keys = []
+        for value, count in counts.items():
+            if not value:
+                continue
+            key = value.lower()
+            entry = self.values.get(key)
+            if entry is None:
+                self.values[key] = [value, count]
+                new_keys.append(key)
+            else:
+                entry[1] += count
+
+        if len(new_keys) > 64:
+            self.keys = sorted(self.values)
+        else:
+            for key in new_keys:
+                bisect.insort(self.keys, key)
+        # Counts only grow a little between refreshes, so this is close to
+        # a linear pass over already-ordered keys
+        self.ranked = sorted(self.ranked + new_keys, key=self._count, reverse=True)
+
+    def complete(self, prefix: str, limit: int) -> List[Dict[str, Any]]:
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff')
+
+        if end - start > WIDE_PREFIX_KEYS:
+            best = []
+            for key in self.ranked:
+                if key.startswith(prefix):
+                    best.append(key)
+                    if len(best) == limit:
+                        break
+        else:
+            best = heapq.nlargest(limit, self.keys[start:end], key=self._count)
+
+        return [{'value': self.values[key][0], 'count': self.values[key][1]} for key in best]
+
+
+class SuggestIndex:
+    def __init__(self, engine, fields: List[str] = SUGGEST_FIELDS,
+                 refresh_seconds: float = SUGGEST_REFRESH_SECONDS,
+                 rebuild_seconds: float = SUGGEST_REBUILD_SECONDS):
+        """
+        Per-process typeahead index over the engine's messages. Lookups are
+        a binary search plus a top-N selection in memory; the index follows
+        writes in the background by reading rows above the highest id it
+        has seen, so a lookup never waits on the database.
+        """
+        self.engine = engine
+        self.fields = list(fields)
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._indexes: Dict[str, _FieldIndex] = {field: _FieldIndex() for field in self.fields}
+        self._last_id = 0
+        self._generation: Optional[str] = None
+        self._db_path: Optional[str] = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        cursor = self.engine.conn.cursor()
+        indexes = {}
+        for field in self.fields:
+            cursor.execute(f"SELECT {field}, COUNT(*) FROM messages GROUP BY {field}")
+            index = _FieldIndex()
+            index.add_counts(dict(cursor.fetchall()))
+            indexes[field] = index
+        cursor.execute("SELECT MAX(id) FROM messages")
+        self._last_id = cursor.fetchone()[0] or 0
+
+        self._indexes = indexes
+        self._built_at = time.monotonic()
+        self._db_path = self.engine.db_path
+
+    def _add_new_rows(self):
+        cursor = self.engine.conn.cursor()
+        cursor.execute(
+            f"SELECT id, {', '.join(self.fields)} FROM messages WHERE id > ? ORDER BY id",
+            (self._last_id,)
+        )
+        counts: Dict[str, Dict[str, int]] = {field: {} for field in self.fields}
+        for row in cursor:
+            self._last_id = row[0]
+            for field, value in zip(self.fields, row[1:]):
+                counts[field][value] = counts[field].get(value, 0) + 1
+        for field, field_counts in counts.items():
+            if field_counts:
+                self._indexes[field].add_counts(field_counts)
+
+    def refresh(self, force: bool = False):
+        """Bring the index up to date with the database if it may have changed"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            generation = self.engine.write_generation()
+            if not force and generation is not None and generation == self._generation:
+                return
+
+            start_time = time.time()
+            if (force or time.monotonic() - self._built_at >= self.rebuild_seconds
+                    or self._db_path != self.engine.db_path):
+                self._rebuild()
+                logger.info(f"Suggest index rebuilt in {(time.time() - start_time) * 1000:.2f}ms")
+            else:
+                self._add_new_rows()
+            self._generation = generation
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Suggest index refresh error: {str(e)}")
+
+    def _maybe_refresh(self):
+        if not self._built_at:
+            self.refresh(force=True)
+        elif time.monotonic() - self._checked_at >= self.refresh_seconds and not self._lock.locked():
+            # Mark as checked now so concurrent lookups start one refresh, not many
+            self._checked_at = time.monotonic()
+            threading.Thread(target=self._refresh_in_background, name='apex-suggest-refresh',
+                             daemon=True).start()
+
+    def suggest(self, field: str, prefix: str, limit: int = DEFAULT_SUGGEST_LIMIT) -> List[Dict[str, Any]]:
+        """Most frequent values of field starting with prefix (case-insensitive)"""
+        field = FIELD_ALIASES.get(field, field)
+        if field not in self._indexes:
+            raise ValueError(f"Cannot suggest values for '{field}'; use one of {', '.join(self.fields)}")
+
+        self._maybe_refresh()
+        limit = max(1, min(int(limit), MAX_SUGGEST_LIMIT))
+        return self._indexes[field].complete(prefix, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fields': {field: len(index.keys) for field, index in self._indexes.items()},
+            'last_id': self._last_id,
+            'built_seconds_ago': round(time.monotonic() - self._built_at, 1) if self._built_at else None
+        }
@@ -0,0 +1,225 @@
+"""
+Tests for the Elasticsearch bulk loader, against a stand-in _bulk server
+
+    python -m pytest test_bulk_indexer.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import pytest
+
+# bulk_indexer lives with the Elasticsearch API next to this one
+ES_API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                          'apex-search', 'api')
+if ES_API_DIR not in sys.path:
+    sys.path.append(ES_API_DIR)
+
+from bulk_indexer import BulkIndexer  # noqa: E402
+
+
+class StandInElasticsearch(ThreadingHTTPServer):
+    """
+    Answers /_bulk, /<index>/_settings, /<index>/_refresh and the refresh
+    hold documents. Each _bulk request takes the next entry of plan:
+    ('status', code, retry_after) fails the whole request, ('items', codes)
+    gives each document its status; with the plan used up every document
+    is indexed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.plan = []
+        self.bulk_bodies = []
+        self.settings_log = []
+        self.refreshed = []
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body if body is not None else {}).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        es = self.server
+        body = self._body()
+        path = urlsplit(self.path).path
+        if path.endswith('/_refresh'):
+            es.refreshed.append(unquote(path.split('/')[1]))
+            return self._reply(200)
+
+        lines = body.splitlines()
+        actions = [json.loads(line)['index'] for line in lines[::2]]
+        with es.lock:
+            es.bulk_bodies.append(body)
+            step = es.plan.pop(0) if es.plan else ('items', [201] * len(actions))
+        if step[0] == 'status':
+            return self._reply(step[1], {'error': 'stand-in'}, {'Retry-After': step[2]} if step[2] else {})
+
+        items = []
+        for action, status in zip(actions, step[1]):
+            outcome = {'_id': action.get('_id'), 'status': status}
+            if status >= 300:
+                outcome['error'] = {'type': 'rejected' if status == 429 else 'mapper_parsing_exception'}
+            items.append({'index': outcome})
+        self._reply(200, {'errors': any(status >= 300 for status in step[1]), 'items': items})
+
+    def do_PUT(self):
+        es = self.server
+        body = json.loads(self._body())
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split('/')[1:]]
+        if parts[1] == '_settings':
+            es.settings_log.append((parts[0], body['index']['refresh_interval']))
+            return self._reply(200, {'acknowledged': True})
+
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        with es.lock:
+            current = es.documents.get(parts[2])
+            if query.get('op_type') == 'create':
+                if current is not None:
+                    return self._reply(409)
+            elif current is None or int(query['if_seq_no']) != current[0]:
+                return self._reply(409)
+            seq_no = current[0] + 1 if current else 0
+            es.documents[parts[2]] = (seq_no, body)
+        self._reply(200, {'result': 'updated'})
+
+    def do_GET(self):
+        es = self.server
+        document_id = unquote(urlsplit(self.path).path.split('/')[-1])
+        with es.lock:
+            current = es.documents.get(document_id)
+        if current is None:
+            return self._reply(404, {'found': False})
+        self._reply(200, {'_seq_no': current[0], '_primary_term': 1, '_source': current[1]})
+
+
+@pytest.fixture
+def es():
+    server = StandInElasticsearch()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def messages(count):
+    return [{'message_id': f'm{i}', 'subject': 'Invoice overdue'} for i in range(count)]
+
+
+def bulk_ids(body):
+    return [json.loads(line)['index']['_id'] for line in body.splitlines()[::2]]
+
+
+def test_whole_request_429_waits_for_retry_after(es):
+    es.plan = [('status', 429, '0.2')]
+    indexer = BulkIndexer(es.url, 'apex_messages', backoff_seconds=0)
+
+    start_time = time.time()
+    report = indexer.index_documents(messages(3))
+
+    assert time.time() - start_time >= 0.2
+    assert report['indexed'] == 3
+    assert report['failed'] == 0
+    assert report['retries'] == 1
+    assert [bulk_ids(body) for body in es.bulk_bodies] == [['m0', 'm1', 'm2']] * 2
+
+
+def test_item_429_resends_only_the_rejected_documents(es):
+    es.plan = [('items', [201, 429, 201])]
+    report = BulkIndexer(es.url, 'apex_messages', backoff_seconds=0).index_documents(messages(3))
+
+    assert report['indexed'] == 3
+    assert report['retries'] == 1
+    assert bulk_ids(es.bulk_bodies[1]) == ['m1']
+
+
+def test_non_retryable_item_failures_are_reported(es):
+    es.plan = [('items', [201, 400, 201])]
+    report = BulkIndexer(es.url, 'apex_messages', backoff_seconds=0).index_documents(messages(3))
+
+    assert report['indexed'] == 2
+    assert report['failed'] == 1
+    assert report['retries'] == 0
+    assert report['errors'] == [{'id': 'm1', 'error': {'type': 'mapper_parsing_exception'}}]
+    assert len(es.bulk_bodies) == 1
+
+
+def test_chunks_by_document_count(es):
+    BulkIndexer(es.url, 'apex_messages', workers=1, chunk_docs=3).index_documents(messages(7))
+
+    assert [len(bulk_ids(body)) for body in es.bulk_bodies] == [3, 3, 1]
+
+
+def test_chunks_by_bytes(es):
+    line_bytes = len(json.dumps({'index': {'_index': 'apex_messages', '_id': 'm0'}}, separators=(',', ':'))) + \
+        len(json.dumps(messages(1)[0], separators=(',', ':'))) + 2
+    BulkIndexer(es.url, 'apex_messages', workers=1, chunk_bytes=2 * line_bytes + 1).index_documents(messages(5))
+
+    assert [len(bulk_ids(body)) for body in es.bulk_bodies] == [2, 2, 1]
+    assert all(len(body) <= 2 * line_bytes + 1 for body in es.bulk_bodies)
+
+
+def test_large_load_switches_refresh_off_and_back_on(es):
+    report = BulkIndexer(es.url, 'apex_messages', chunk_docs=2, large_load_docs=5).index_documents(messages(10))
+
+    assert report['refresh_disabled'] is True
+    assert es.settings_log == [('apex_messages', '-1'), ('apex_messages', None)]
+    assert es.refreshed == ['apex_messages']
+    assert es.documents['apex_messages'][1] == {'holds': []}
+
+
+def test_small_load_leaves_refresh_alone(es):
+    report = BulkIndexer(es.url, 'apex_messages', chunk_docs=2, large_load_docs=50).index_documents(messages(10))
+
+    assert report['refresh_disabled'] is False
+    assert es.settings_log == []
+
+
+def test_refresh_stays_off_until_the_last_load_in_any_process_finishes(es):
+    # Another worker process's load, seen only through the shared hold document
+    other = BulkIndexer(es.url, 'apex_messages')
+    assert other._hold_refresh_off('apex_messages')
+
+    BulkIndexer(es.url, 'apex_messages', chunk_docs=2, large_load_docs=5).index_documents(messages(10))
+    assert es.settings_log == [('apex_messages', '-1')]
+
+    other._release_refresh('apex_messages')
+    assert es.settings_log == [('apex_messages', '-1'), ('apex_messages', None)]
+
+
+def test_abandoned_holds_expire(es):
+    es.documents['apex_messages'] = (0, {'holds': [{'id': 'crashed', 'expires_at': time.time() - 1}]})
+
+    BulkIndexer(es.url, 'apex_messages', chunk_docs=2, large_load_docs=5).index_documents(messages(10))
+
+    assert es.settings_log == [('apex_messages', '-1'), ('apex_messages', None)]
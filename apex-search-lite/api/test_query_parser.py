@@ -0,0 +1,71 @@
+"""
+Tests for the query-string parser
+
+    python -m pytest test_query_parser.py
+"""
+
+from query_parser import parse_query, END_OF_DAY
+
+
+def test_bare_terms_keep_quick_search_heuristics():
+    assert parse_query('phisher@evil.com') == {'sender': 'phisher@evil.com'}
+    assert parse_query('10.0.0.1') == {'ip_address': '10.0.0.1'}
+    assert parse_query('evil.com') == {'domain': 'evil.com'}
+
+
+def test_field_operators_and_aliases():
+    params = parse_query('from:billing to:cfo@ domain:acme.com ip:1.2.3.4 category:phishing action:quarantine')
+    assert params == {
+        'sender': 'billing',
+        'recipient': 'cfo@',
+        'domain': 'acme.com',
+        'ip_address': '1.2.3.4',
+        'threat_category': 'phishing',
+        'apex_action': 'quarantine'
+    }
+    assert parse_query('sender:a threat:spam')['threat_category'] == 'spam'
+
+
+def test_quoted_values_and_repeated_text_fields():
+    params = parse_query('subject:wire subject:transfer body:"act now"')
+    assert params['subject'] == 'wire transfer'
+    assert params['content'] == 'act now'
+    assert params['sort'] == 'relevance'
+
+
+def test_free_text_phrases_exclusions_and_prefixes():
+    params = parse_query('invoice "wire transfer" -newsletter pay*')
+    assert params == {'text': 'invoice "wire transfer" -newsletter pay*', 'sort': 'relevance'}
+
+
+def test_score_comparisons():
+    assert parse_query('score>0.8 score<=0.95')['threat_score'] == {'gt': 0.8, 'lte': 0.95}
+    assert parse_query('score>=high x')['text'] == 'score>=high x'
+
+
+def test_sort_recent_overrides_relevance():
+    params = parse_query('invoice sort:recent')
+    assert params['text'] == 'invoice'
+    assert 'sort' not in params
+
+
+def test_after_keeps_the_date_as_lower_bound():
+    assert parse_query('after:2025-10-01 x')['date_from'] == '2025-10-01'
+    assert parse_query('since:2025-10-01T09:00:00 x')['date_from'] == '2025-10-01T09:00:00'
+
+
+def test_before_a_bare_date_includes_that_day():
+    date_to = parse_query('before:2025-10-01 x')['date_to']
+    assert date_to == '2025-10-01' + END_OF_DAY
+    assert '2025-10-01T09:00:00' <= date_to
+    assert '2025-10-01T23:59:59' <= date_to
+    assert not '2025-10-02T00:00:00' <= date_to
+    assert parse_query('until:2025-10-01 x')['date_to'] == date_to
+
+
+def test_before_a_datetime_is_kept_as_given():
+    assert parse_query('before:2025-10-01T09:00:00 x')['date_to'] == '2025-10-01T09:00:00'
+
+
+def test_unknown_operators_are_free_text():
+    assert parse_query('foo:bar baz') == {'text': 'foo:bar baz', 'sort': 'relevance'}
@@ -0,0 +1,17 @@
+"""
+APEX Search API production entry point
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module opens nothing: each worker builds its own search
+engine after the fork (see gunicorn.conf.py and app.init_worker).
+"""
+
+import os
+
+# The logging handlers in app/search_engine write here at import time
+os.makedirs('logs', exist_ok=True)
+
+from app import app, init_worker  # noqa: E402
+
+__all__ = ['app', 'init_worker']
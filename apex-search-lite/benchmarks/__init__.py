@@ -0,0 +1,18 @@
+"""
+APEX Search Benchmarks
+Synthetic mail corpus, query replay and latency reporting for the search backends
+
+    cd apex-search-lite
+    python -m benchmarks.search_bench --size 100000 --backend both
+"""
+
+import os
+import sys
+
+# The search API modules are flat scripts in api/, imported by bare name
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# search_engine/app configure file logging into logs/ at import time
+os.makedirs('logs', exist_ok=True)
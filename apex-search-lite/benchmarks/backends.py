@@ -0,0 +1,99 @@
+"""
+Search backends under benchmark
+Each wraps one of the API's search backends (api/search_backend.py) behind
+load/search/size_bytes so the same corpus and query mix can be replayed
+against all of them
+"""
+
+import json
+import os
+from typing import Dict, Any, Iterable, Optional
+
+from benchmarks.es_mock import MockElasticsearch
+
+# Messages per add_messages call while loading
+LOAD_BATCH_SIZE = 1000
+
+
+class BenchBackend:
+    def __init__(self, backend):
+        """Load and replay helpers around a search_backend.SearchBackend"""
+        self.backend = backend
+        self.name = backend.name
+
+    def load(self, messages: Iterable[Dict[str, Any]]) -> int:
+        count = 0
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) >= LOAD_BATCH_SIZE:
+                count += self.backend.add_messages(batch)
+                batch = []
+        if batch:
+            count += self.backend.add_messages(batch)
+        self.backend.refresh()
+        return count
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return self.backend.search(params)
+        except ValueError as e:
+            return {'error': str(e)}
+
+    def size_bytes(self) -> int:
+        return 0
+
+    def close(self):
+        self.backend.close()
+
+
+class SqliteBackend(BenchBackend):
+    def __init__(self, db_path: str):
+        """SQLite FTS engine from apex-search-lite/api/search_engine.py, on its own database"""
+        from search_engine import ApexSearchEngine
+        from search_backend import SQLiteBackend
+        self.db_path = db_path
+        super().__init__(SQLiteBackend(ApexSearchEngine(db_path)))
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal')
+                   if os.path.exists(path))
+
+
+class EsBackend(BenchBackend):
+    def __init__(self, es_url: Optional[str] = None):
+        """
+        apex-search's Elasticsearch engine. Without es_url it runs against
+        the in-memory MockElasticsearch, so latency covers the engine's own
+        work plus naive in-memory evaluation, not a real cluster. With
+        es_url the index template is installed first (existing indices are
+        kept; benchmark against a scratch cluster).
+        """
+        from search_backend import ElasticsearchBackend, load_es_engine
+        if es_url:
+            client = load_es_engine().Elasticsearch([es_url])
+        else:
+            client = MockElasticsearch()
+        super().__init__(ElasticsearchBackend(client))
+        self.client = client
+        self.name = 'elasticsearch' if es_url else 'elasticsearch-mock'
+        self.backend.engine.setup_index()
+
+    def size_bytes(self) -> int:
+        if isinstance(self.client, MockElasticsearch):
+            return sum(len(json.dumps(doc)) for docs in self.client.docs.values() for doc in docs.values())
+        stats = self.client.indices.stats(index=self.backend.module.LAYOUT.read_alias, metric='store')
+        return stats['_all']['primaries']['store']['size_in_bytes']
+
+    def close(self):
+        if isinstance(self.client, MockElasticsearch):
+            self.client.docs.clear()
+
+
+def create_backend(name: str, db_path: str, es_url: Optional[str] = None) -> BenchBackend:
+    """Backend factory for the --backend option"""
+    if name == 'sqlite':
+        return SqliteBackend(db_path)
+    if name in ('es', 'elasticsearch', 'elasticsearch-mock'):
+        return EsBackend(es_url)
+    raise ValueError(f"Unknown backend: {name}")
@@ -0,0 +1,248 @@
+"""
+Backend conformance and latency comparison
+
+Loads one synthetic corpus into the SQLite and Elasticsearch backends,
+sends every query of a mix to both and reports, per query shape, how
+often their results agree (hit counts, result pages, facets) next to
+each backend's latency. Run from apex-search-lite/:
+
+    python -m benchmarks.conformance --size 20000 --queries 500
+    python -m benchmarks.conformance --es-url http://localhost:9200 --json conformance.json
+
+Without --es-url the Elasticsearch side runs against MockElasticsearch,
+which checks query building and response handling but not ES analysis
+(fuzziness, scoring). Exits 1 when more than --max-mismatch-rate of the
+queries disagree.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Any, Optional
+
+from benchmarks.backends import create_backend
+from benchmarks.corpus import CorpusGenerator, BODY_WORDS
+from benchmarks.stats import summarize
+
+# Ways two backends' answers to the same query can differ
+MISMATCH_KINDS = ['error', 'total_hits', 'page', 'order', 'facets']
+
+# Examples of each mismatch kind kept for the report
+MAX_EXAMPLES = 5
+
+
+def extra_queries(corpus: CorpusGenerator, count: int, seed: int) -> List[Dict[str, Any]]:
+    """
+    Queries for the common search parameters the benchmark mix leaves out:
+    free text with exclusions, recipient and threat score ranges
+    """
+    rng = random.Random(seed)
+    queries = []
+    for index in range(count):
+        kind = index % 3
+        if kind == 0:
+            include, exclude = rng.sample(BODY_WORDS[:30], 2)
+            params = {'text': f"{include} -{exclude}", '_shape': 'text'}
+        elif kind == 1:
+            params = {'recipient': rng.choice(corpus.recipients).split('@')[0] + '@', '_shape': 'recipient'}
+        else:
+            params = {
+                'threat_category': rng.choice(list(corpus.category_mix)),
+                'threat_score': {'gte': round(rng.uniform(0.2, 0.9), 2)},
+                '_shape': 'category_score'
+            }
+        queries.append(params)
+    return queries
+
+
+def _message_ids(result: Dict[str, Any]) -> List[str]:
+    return [message['message_id'] for message in result.get('messages', [])]
+
+
+def _facets_agree(expected: List[Dict[str, Any]], actual: List[Dict[str, Any]]) -> bool:
+    """
+    Same counts for every value both list; a value only one lists is
+    accepted when it ties with the smallest count shown (where the cut-off
+    falls among equal counts is arbitrary)
+    """
+    expected_counts = {bucket['name']: bucket['count'] for bucket in expected}
+    actual_counts = {bucket['name']: bucket['count'] for bucket in actual}
+    for name in expected_counts.keys() & actual_counts.keys():
+        if expected_counts[name] != actual_counts[name]:
+            return False
+    for counts, other in ((expected_counts, actual_counts), (actual_counts, expected_counts)):
+        floor = min(other.values(), default=0)
+        for name in counts.keys() - other.keys():
+            if counts[name] > floor and len(other) >= len(counts):
+                return False
+    return True
+
+
+def compare_results(expected: Dict[str, Any], actual: Dict[str, Any],
+                    approximate_facets: Dict[str, int]) -> List[str]:
+    """
+    Mismatch kinds between the reference (SQLite) result and another
+    backend's. approximate_facets maps facets the other backend samples to
+    the sample size; they are only compared when all hits fit in it.
+    """
+    if 'error' in expected or 'error' in actual:
+        return ['error'] if ('error' in expected) != ('error' in actual) else []
+
+    mismatches = []
+    expected_total = expected.get('total_hits') or 0
+    actual_total = actual.get('total_hits') or 0
+    if actual.get('total_hits_relation') == 'gte':
+        if expected_total < actual_total:
+            mismatches.append('total_hits')
+    elif expected_total != actual_total:
+        mismatches.append('total_hits')
+
+    expected_ids = _message_ids(expected)
+    actual_ids = _message_ids(actual)
+    if set(expected_ids) != set(actual_ids):
+        mismatches.append('page')
+    elif expected_ids != actual_ids:
+        mismatches.append('order')
+
+    expected_facets = expected.get('facets', {})
+    actual_facets = actual.get('facets', {})
+    for name in expected_facets.keys() & actual_facets.keys():
+        sample_size = approximate_facets.get(name)
+        if sample_size and expected_total > sample_size:
+            continue
+        if not _facets_agree(expected_facets[name], actual_facets[name]):
+            mismatches.append('facets')
+            break
+    return mismatches
+
+
+def run_conformance(corpus: CorpusGenerator, queries: List[Dict[str, Any]], db_path: str,
+                    es_url: Optional[str] = None, warmup: int = 20) -> Dict[str, Any]:
+    reference = create_backend('sqlite', db_path)
+    other = create_backend('es', db_path, es_url=es_url)
+    try:
+        load_seconds = {}
+        for backend in (reference, other):
+            start = time.time()
+            backend.load(corpus.messages())
+            load_seconds[backend.name] = round(time.time() - start, 3)
+
+        es_module = other.backend.module
+        approximate_facets = {name: es_module.FACET_SAMPLE_SIZE for name in es_module.HIGH_CARDINALITY_FACETS
+                              if es_module.FACET_SAMPLE_SIZE > 0}
+
+        for params in queries[:warmup]:
+            search_params = {k: v for k, v in params.items() if k != '_shape'}
+            reference.search(search_params)
+            other.search(search_params)
+
+        latencies: Dict[str, Dict[str, List[float]]] = {reference.name: {}, other.name: {}}
+        shapes: Dict[str, Dict[str, Any]] = {}
+        examples: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind in MISMATCH_KINDS}
+
+        for params in queries:
+            shape = params['_shape']
+            search_params = {k: v for k, v in params.items() if k != '_shape'}
+
+            results = {}
+            for backend in (reference, other):
+                start = time.perf_counter()
+                results[backend.name] = backend.search(search_params)
+                latencies[backend.name].setdefault(shape, []).append((time.perf_counter() - start) * 1000)
+
+            mismatches = compare_results(results[reference.name], results[other.name], approximate_facets)
+            counts = shapes.setdefault(shape, {'queries': 0, 'agree': 0, **{kind: 0 for kind in MISMATCH_KINDS}})
+            counts['queries'] += 1
+            if not mismatches:
+                counts['agree'] += 1
+            for kind in mismatches:
+                counts[kind] += 1
+                if len(examples[kind]) < MAX_EXAMPLES:
+                    examples[kind].append({
+                        'params': search_params,
+                        reference.name: {'total_hits': results[reference.name].get('total_hits'),
+                                         'error': results[reference.name].get('error')},
+                        other.name: {'total_hits': results[other.name].get('total_hits'),
+                                     'error': results[other.name].get('error')}
+                    })
+
+        total = sum(counts['queries'] for counts in shapes.values())
+        agreed = sum(counts['agree'] for counts in shapes.values())
+        return {
+            'backends': [reference.name, other.name],
+            'load_seconds': load_seconds,
+            'queries': total,
+            'agree': agreed,
+            'mismatch_rate': round(1 - agreed / total, 4) if total else 0.0,
+            'by_shape': shapes,
+            'latency': {
+                name: {
+                    'all': summarize([value for values in by_shape.values() for value in values]),
+                    'by_shape': {shape: summarize(values) for shape, values in sorted(by_shape.items())}
+                }
+                for name, by_shape in latencies.items()
+            },
+            'examples': {kind: found for kind, found in examples.items() if found}
+        }
+    finally:
+        reference.close()
+        other.close()
+
+
+def print_report(report: Dict[str, Any]):
+    reference, other = report['backends']
+    print(f"\n=== {reference} vs {other}: {report['agree']}/{report['queries']} queries agree "
+          f"(mismatch rate {report['mismatch_rate']:.2%}) ===")
+    print(f"Loaded in {', '.join(f'{name} {seconds}s' for name, seconds in report['load_seconds'].items())}")
+    print(f"{'shape':<16} {'n':>6} {'agree':>7}  {'mismatches':<40} "
+          f"{reference + ' p50/p95':>22} {other + ' p50/p95':>30}")
+    for shape, counts in sorted(report['by_shape'].items()):
+        mismatches = ", ".join(f"{kind}={counts[kind]}" for kind in MISMATCH_KINDS if counts[kind]) or '-'
+        ref = report['latency'][reference]['by_shape'][shape]
+        oth = report['latency'][other]['by_shape'][shape]
+        print(f"{shape:<16} {counts['queries']:>6} {counts['agree'] / counts['queries']:>7.1%}  {mismatches:<40} "
+              f"{ref['p50_ms']:>10.2f}/{ref['p95_ms']:<8.2f}ms {oth['p50_ms']:>16.2f}/{oth['p95_ms']:<8.2f}ms")
+    for kind, found in report['examples'].items():
+        print(f"\n{kind} mismatch, e.g. {json.dumps(found[0], default=str)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='APEX search backend conformance and latency comparison')
+    parser.add_argument('--size', type=int, default=5000, help='messages in the synthetic corpus')
+    parser.add_argument('--queries', type=int, default=500, help='benchmark-mix queries to compare')
+    parser.add_argument('--extra-queries', type=int, default=60,
+                        help='text/recipient/score queries added to the mix')
+    parser.add_argument('--seed', type=int, default=42, help='corpus and query mix seed')
+    parser.add_argument('--days', type=int, default=30, help='days of mail the corpus spans')
+    parser.add_argument('--es-url', default=None,
+                        help='Elasticsearch to compare against (default: in-memory MockElasticsearch)')
+    parser.add_argument('--max-mismatch-rate', type=float, default=0.0,
+                        help='fail when more than this share of queries disagree')
+    parser.add_argument('--json', dest='json_path', default=None, help='write the full report here')
+    args = parser.parse_args()
+
+    corpus = CorpusGenerator(size=args.size, seed=args.seed, days=args.days)
+    queries = corpus.query_mix(args.queries) + extra_queries(corpus, args.extra_queries, args.seed)
+
+    temp_dir = tempfile.mkdtemp(prefix='apex_conformance_')
+    try:
+        report = run_conformance(corpus, queries, os.path.join(temp_dir, 'apex_search.db'), args.es_url)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    if report['mismatch_rate'] > args.max_mismatch_rate:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
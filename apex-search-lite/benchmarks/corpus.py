@@ -0,0 +1,232 @@
+"""
+Synthetic mail corpus generator
+Reproducible messages in the add_sample_data schema, with Zipf-distributed
+senders and domains so a few hot senders dominate like real mail flow
+"""
+
+import bisect
+import itertools
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterator, Optional, Sequence
+
+# Share of each threat category in generated mail
+DEFAULT_CATEGORY_MIX = {
+    'legitimate': 0.70,
+    'spam': 0.15,
+    'phishing': 0.10,
+    'malware': 0.05
+}
+
+# APEX action taken for each category
+CATEGORY_ACTIONS = {
+    'legitimate': ['deliver'],
+    'spam': ['quarantine', 'deliver'],
+    'phishing': ['quarantine', 'block'],
+    'malware': ['block', 'quarantine']
+}
+
+# Threat score range per category
+CATEGORY_SCORES = {
+    'legitimate': (0.0, 0.3),
+    'spam': (0.5, 0.9),
+    'phishing': (0.7, 1.0),
+    'malware': (0.85, 1.0)
+}
+
+# Generated corpora end here by default so runs are comparable across days
+DEFAULT_END_TIME = datetime(2025, 11, 1)
+
+SUBJECT_TEMPLATES = {
+    'legitimate': [
+        'Monthly Report {month}', 'Meeting notes: {topic}', 'Invoice {number} attached',
+        'Re: {topic} follow-up', 'Quarterly review for {team}', 'Updated {topic} schedule'
+    ],
+    'spam': [
+        'Breaking News: You Won ${amount}!', 'Limited offer on {product}', 'Lose weight fast with {product}',
+        'Exclusive {product} deal just for you', 'Congratulations, claim your {product}'
+    ],
+    'phishing': [
+        'Urgent: Verify Your Account', 'Action required: {team} password expires', 'Wire transfer {number} pending',
+        'Your mailbox is full', 'Invoice {number} overdue - pay now', 'Security alert for your {product} account'
+    ],
+    'malware': [
+        'Scanned document {number}', 'Shipping notice {number}', 'Payment receipt {number}',
+        'Voicemail from {team}', 'Resume for {topic} position'
+    ]
+}
+
+FILLER = {
+    'month': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+              'September', 'October', 'November', 'December'],
+    'topic': ['budget', 'roadmap', 'hiring', 'migration', 'audit', 'launch', 'offsite', 'compliance'],
+    'team': ['Finance', 'HR', 'IT', 'Sales', 'Legal', 'Operations'],
+    'product': ['iPhone', 'gift card', 'crypto wallet', 'Office 365', 'PayPal', 'DocuSign', 'pharmacy']
+}
+
+# Vocabulary for message bodies; word frequency is itself Zipf-distributed
+BODY_WORDS = (
+    'the please account verify click here report attached review payment invoice team '
+    'meeting schedule update password security login bank transfer urgent immediately '
+    'confirm details document shared access link expires today offer free winner claim '
+    'prize delivery package tracking order receipt refund tax statement quarterly budget '
+    'project deadline approve signature contract policy customer support service notice'
+).split()
+
+ATTACHMENT_TYPES = {
+    'legitimate': ['report.pdf', 'notes.docx', 'budget.xlsx', 'slides.pptx'],
+    'spam': ['offer.pdf', 'coupon.png'],
+    'phishing': ['invoice.html', 'secure_message.htm', 'statement.pdf'],
+    'malware': ['document.exe', 'scan.zip', 'invoice.js', 'macro.docm', 'payload.iso']
+}
+
+TLDS = ['com', 'net', 'org', 'io', 'co', 'biz', 'info', 'ru', 'xyz']
+
+
+class ZipfSampler:
+    def __init__(self, items: Sequence[Any], exponent: float, rng: Optional[random.Random] = None):
+        """Sample items with probability proportional to 1 / rank^exponent"""
+        self.items = list(items)
+        self.rng = rng
+        weights = [1.0 / (rank ** exponent) for rank in range(1, len(self.items) + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def sample(self, rng: Optional[random.Random] = None) -> Any:
+        point = (rng or self.rng).random() * self.cum_weights[-1]
+        return self.items[bisect.bisect_left(self.cum_weights, point)]
+
+
+class CorpusGenerator:
+    def __init__(self, size: int = 10000, seed: int = 42, domains: int = 2000,
+                 senders_per_domain: int = 20, zipf_exponent: float = 1.1,
+                 category_mix: Optional[Dict[str, float]] = None, days: int = 30,
+                 end_time: datetime = DEFAULT_END_TIME, body_words: int = 80):
+        """
+        Reproducible synthetic corpus. The same arguments always generate
+        the same messages in the same order.
+        """
+        self.size = size
+        self.seed = seed
+        self.domain_count = domains
+        self.senders_per_domain = senders_per_domain
+        self.zipf_exponent = zipf_exponent
+        self.category_mix = category_mix or DEFAULT_CATEGORY_MIX
+        self.days = days
+        self.end_time = end_time
+        self.body_words = body_words
+
+        # Vocabulary is derived from its own RNG so query generators can
+        # rebuild it without replaying the whole corpus
+        vocab_rng = random.Random(seed)
+        self.domains = [self._domain_name(vocab_rng, i) for i in range(domains)]
+        self.recipients = [f"user{i}@company.com" for i in range(500)]
+        self._sender_ranks = ZipfSampler(range(senders_per_domain), zipf_exponent)
+
+    def _domain_name(self, rng: random.Random, index: int) -> str:
+        stem = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 10)))
+        return f"{stem}{index}.{rng.choice(TLDS)}"
+
+    def domain_sampler(self, rng: random.Random) -> ZipfSampler:
+        """Zipf sampler over this corpus's sender domains"""
+        return ZipfSampler(self.domains, self.zipf_exponent, rng)
+
+    def sender_for(self, domain: str, rng: random.Random) -> str:
+        """Zipf-distributed sender local part within a domain"""
+        rank = self._sender_ranks.sample(rng)
+        local = ['info', 'admin', 'billing', 'noreply', 'support', 'ceo', 'hr', 'security'][rank % 8]
+        return f"{local}{rank}@{domain}"
+
+    def messages(self) -> Iterator[Dict[str, Any]]:
+        """Yield the corpus one message dict at a time"""
+        rng = random.Random(self.seed + 1)
+        domains = self.domain_sampler(rng)
+        words = ZipfSampler(BODY_WORDS, 1.0, rng)
+        categories = list(self.category_mix)
+        category_weights = [self.category_mix[c] for c in categories]
+        span_seconds = self.days * 86400
+
+        for index in range(self.size):
+            category = rng.choices(categories, category_weights)[0]
+            domain = domains.sample()
+            low, high = CATEGORY_SCORES.get(category, (0.0, 1.0))
+            template = rng.choice(SUBJECT_TEMPLATES.get(category, SUBJECT_TEMPLATES['legitimate']))
+            subject = template.format(
+                month=rng.choice(FILLER['month']),
+                topic=rng.choice(FILLER['topic']),
+                team=rng.choice(FILLER['team']),
+                product=rng.choice(FILLER['product']),
+                number=rng.randint(1000, 99999),
+                amount=rng.choice(['1 Million', '5,000', '500'])
+            )
+            body_length = max(5, int(rng.gauss(self.body_words, self.body_words / 3)))
+            timestamp = self.end_time - timedelta(seconds=rng.randint(0, span_seconds))
+
+            attachments = []
+            if rng.random() < (0.6 if category == 'malware' else 0.2):
+                attachments = rng.sample(ATTACHMENT_TYPES.get(category, ATTACHMENT_TYPES['legitimate']),
+                                         rng.randint(1, 2))
+            urls = [f"https://{domain}/{rng.choice(BODY_WORDS)}/{rng.randint(1, 9999)}"
+                    for _ in range(rng.choice([0, 0, 1, 1, 2, 3]))]
+
+            yield {
+                'message_id': f"bench_{self.seed}_{index:08d}",
+                'sender_email': self.sender_for(domain, rng),
+                'sender_domain': domain,
+                'sender_ip': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                'recipient_email': rng.choice(self.recipients),
+                'subject': subject,
+                'content': ' '.join(words.sample() for _ in range(body_length)),
+                'timestamp': timestamp.isoformat(),
+                'threat_category': category,
+                'apex_action': rng.choice(CATEGORY_ACTIONS.get(category, ['deliver'])),
+                'threat_score': round(rng.uniform(low, high), 3),
+                'file_attachments': attachments,
+                'urls': urls
+            }
+
+    def query_mix(self, count: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Reproducible search parameter mix in the engine's query_params
+        format, drawing senders and domains from the same Zipf skew as the
+        corpus so hot senders are also the most searched.
+        """
+        rng = random.Random(self.seed + 2 if seed is None else seed)
+        domains = self.domain_sampler(rng)
+        shapes = [
+            ('sender', 0.25), ('domain', 0.20), ('subject', 0.20), ('content', 0.10),
+            ('category_date', 0.15), ('ip_address', 0.05), ('combined', 0.05)
+        ]
+        names = [name for name, _ in shapes]
+        weights = [weight for _, weight in shapes]
+        categories = list(self.category_mix)
+
+        queries = []
+        for _ in range(count):
+            shape = rng.choices(names, weights)[0]
+            domain = domains.sample()
+            if shape == 'sender':
+                params = {'sender': self.sender_for(domain, rng).split('@')[0]}
+            elif shape == 'domain':
+                params = {'domain': domain}
+            elif shape == 'subject':
+                params = {'subject': rng.choice(FILLER['topic'] + FILLER['product'] + ['urgent', 'invoice', 'verify'])}
+            elif shape == 'content':
+                params = {'content': ' '.join(rng.sample(BODY_WORDS[:30], 2))}
+            elif shape == 'category_date':
+                day = rng.randint(1, self.days)
+                params = {
+                    'threat_category': rng.choice(categories),
+                    'date_from': (self.end_time - timedelta(days=day)).isoformat(),
+                    'date_to': self.end_time.isoformat()
+                }
+            elif shape == 'ip_address':
+                params = {'ip_address': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"}
+            else:
+                params = {
+                    'domain': domain,
+                    'threat_category': rng.choice(categories),
+                    'subject': rng.choice(FILLER['topic'])
+                }
+            params['_shape'] = shape
+            queries.append(params)
+        return queries
@@ -0,0 +1,317 @@
+"""
+In-memory Elasticsearch stand-in
+Evaluates the subset of the query DSL that apex-search/api/es_engine.py emits,
+so the ES engine's query building and response handling can be benchmarked
+and compared with the SQLite engine without a cluster
+"""
+
+import copy
+import fnmatch
+import re
+from typing import Dict, List, Any, Optional
+
+from search_backend import add_es_api_path
+
+add_es_api_path()
+from index_lifecycle import parse_timestamp  # noqa: E402
+
+_TOKEN_RE = re.compile(r'\w+')
+_QUERY_TERM_RE = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+
+
+def _tokens(value: Any) -> List[str]:
+    return _TOKEN_RE.findall(str(value).lower())
+
+
+def _values(doc: Dict[str, Any], field: str) -> List[Any]:
+    """
+    Field values from a document. Subfields (sender_email.wildcard) read
+    the parent; .reversed ones read it reversed and lowercased, like the
+    reversed_domain analyzer.
+    """
+    value = doc.get(field)
+    if value is None and '.' in field:
+        parent, subfield = field.split('.', 1)
+        value = doc.get(parent)
+        if value is not None and subfield == 'reversed':
+            value = str(value).lower()[::-1]
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _condition(condition: Any, key: str = 'value'):
+    """A leaf query's operand and whether it is case-insensitive"""
+    if isinstance(condition, dict):
+        return condition.get(key), condition.get('case_insensitive', False)
+    return condition, False
+
+
+def _bound(value: Any, round_up: bool) -> Any:
+    """Range bound as something comparable with document values"""
+    if isinstance(value, (int, float)):
+        return value
+    moment = parse_timestamp(value, round_up=round_up)
+    return moment if moment is not None else str(value)
+
+
+def _comparable(value: Any, bound: Any) -> Any:
+    if isinstance(bound, (int, float)):
+        return float(value)
+    if hasattr(bound, 'year'):
+        return parse_timestamp(value)
+    return str(value)
+
+
+class MockIndices:
+    def __init__(self, client: 'MockElasticsearch'):
+        self.client = client
+
+    def exists(self, index: str, **kwargs) -> bool:
+        return index in self.client.docs
+
+    def exists_alias(self, name: str, **kwargs) -> bool:
+        return False
+
+    def delete(self, index: str, **kwargs) -> Dict[str, Any]:
+        for name in index.split(','):
+            self.client.docs.pop(name, None)
+            self.client.settings.pop(name, None)
+        return {'acknowledged': True}
+
+    def create(self, index: str, body: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, Any]:
+        self.client.docs.setdefault(index, {})
+        self.client.settings[index] = copy.deepcopy(body or {})
+        return {'acknowledged': True, 'index': index}
+
+    def get_alias(self, index: str = '*', **kwargs) -> Dict[str, Any]:
+        return {name: {'aliases': {}} for name in self.client.resolve(index)}
+
+    def put_index_template(self, name: str, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        self.client.templates[name] = copy.deepcopy(body)
+        return {'acknowledged': True}
+
+    def update_aliases(self, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return {'acknowledged': True}
+
+    def refresh(self, index: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        return {'_shards': {'failed': 0}}
+
+
+class MockElasticsearch:
+    def __init__(self):
+        """
+        Minimal synchronous client with the methods the search engine
+        calls. An alias is modelled as the name its indices start with
+        (apex_messages -> apex_messages-*); a point-in-time is the list of
+        indices it was opened on.
+        """
+        self.docs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.settings: Dict[str, Dict[str, Any]] = {}
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.points_in_time: Dict[str, List[str]] = {}
+        self.indices = MockIndices(self)
+
+    def ping(self, **kwargs) -> bool:
+        return True
+
+    def options(self, **kwargs) -> 'MockElasticsearch':
+        return self
+
+    def resolve(self, index: str) -> List[str]:
+        """Concrete index names for a comma-separated list of names, aliases and patterns"""
+        names = []
+        for name in index.split(','):
+            if name in self.docs:
+                names.append(name)
+            elif '*' in name:
+                names.extend(sorted(fnmatch.filter(self.docs, name)))
+            else:
+                names.extend(sorted(existing for existing in self.docs if existing.startswith(f"{name}-")))
+        return names
+
+    def index(self, index: str, body: Dict[str, Any], id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        docs = self.docs.setdefault(index, {})
+        doc_id = id or str(len(docs))
+        docs[doc_id] = body
+        return {'_index': index, '_id': doc_id, 'result': 'created'}
+
+    def bulk(self, body: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        items = []
+        for action, document in zip(body[::2], body[1::2]):
+            meta = action['index']
+            result = self.index(index=meta['_index'], body=document, id=meta.get('_id'))
+            items.append({'index': {'_index': result['_index'], '_id': result['_id'], 'status': 201}})
+        return {'errors': False, 'items': items}
+
+    def open_point_in_time(self, index: str, **kwargs) -> Dict[str, Any]:
+        pit_id = f"pit-{len(self.points_in_time)}"
+        self.points_in_time[pit_id] = self.resolve(index)
+        return {'id': pit_id}
+
+    def close_point_in_time(self, id: str, **kwargs) -> Dict[str, Any]:
+        self.points_in_time.pop(id, None)
+        return {'succeeded': True}
+
+    def search(self, body: Dict[str, Any], index: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        if 'pit' in body:
+            names = self.points_in_time[body['pit']['id']]
+        else:
+            names = self.resolve(index or '*')
+        query = body.get('query', {'match_all': {}})
+        hits = [(name, doc_id, doc) for name in names for doc_id, doc in self.docs[name].items()
+                if self._matches(doc, query)]
+
+        sort_fields = []
+        for sort in body.get('sort', []):
+            (field, options), = sort.items()
+            if field != '_score':
+                sort_fields.append(field)
+        for sort in reversed(body.get('sort', [])):
+            (field, options), = sort.items()
+            if field == '_score':
+                continue
+            reverse = (options.get('order', 'asc') if isinstance(options, dict) else options) == 'desc'
+            hits.sort(key=lambda hit: str(hit[2].get(field, '')), reverse=reverse)
+
+        # Sort values end with the hit's position, like ES's _shard_doc tiebreaker
+        sort_values = [[str(hit[2].get(field, '')) for field in sort_fields] + [position]
+                       for position, hit in enumerate(hits)]
+        start = body.get('from', 0)
+        if 'search_after' in body:
+            start = next((position + 1 for position, values in enumerate(sort_values)
+                          if values == body['search_after']), len(hits))
+        size = body.get('size', 10)
+        page = list(zip(hits, sort_values))[start:start + size]
+
+        response: Dict[str, Any] = {
+            'took': 0,
+            'timed_out': False,
+            'hits': {
+                'hits': [{'_index': name, '_id': doc_id, '_score': 1.0, '_source': doc, 'sort': values}
+                         for (name, doc_id, doc), values in page]
+            }
+        }
+        if 'pit' in body:
+            response['pit_id'] = body['pit']['id']
+
+        track = body.get('track_total_hits', 10000)
+        if track is True:
+            response['hits']['total'] = {'value': len(hits), 'relation': 'eq'}
+        elif track is not False:
+            response['hits']['total'] = {'value': min(len(hits), track),
+                                         'relation': 'eq' if len(hits) <= track else 'gte'}
+
+        if body.get('aggs'):
+            response['aggregations'] = self._aggregations([doc for _, _, doc in hits], body['aggs'])
+        return response
+
+    def _aggregations(self, docs: List[Dict[str, Any]], aggs: Dict[str, Any]) -> Dict[str, Any]:
+        results = {}
+        for name, agg in aggs.items():
+            if 'terms' in agg:
+                results[name] = self._terms_agg(docs, agg['terms'])
+            elif 'sampler' in agg:
+                # One shard: the sample is the first shard_size matches
+                sample = docs[:agg['sampler'].get('shard_size', 100)]
+                results[name] = dict(self._aggregations(sample, agg.get('aggs', {})), doc_count=len(sample))
+            elif 'filter' in agg:
+                matched = [doc for doc in docs if self._matches(doc, agg['filter'])]
+                results[name] = dict(self._aggregations(matched, agg.get('aggs', {})), doc_count=len(matched))
+        return results
+
+    def _terms_agg(self, docs: List[Dict[str, Any]], terms: Dict[str, Any]) -> Dict[str, Any]:
+        counts: Dict[Any, int] = {}
+        for doc in docs:
+            for value in _values(doc, terms['field']):
+                counts[value] = counts.get(value, 0) + 1
+        buckets = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+        return {'buckets': [{'key': key, 'doc_count': count}
+                            for key, count in buckets[:terms.get('size', 10)]]}
+
+    def _text_matches(self, doc: Dict[str, Any], fields: List[str], text: str) -> bool:
+        """simple_query_string with default_operator and: words, "phrases", -excluded, prefix*"""
+        present = set(token for field in fields for value in _values(doc, field) for token in _tokens(value))
+        for negated, phrase, word in _QUERY_TERM_RE.findall(text):
+            term = phrase or word
+            if not phrase and term.endswith('*'):
+                prefix = term.rstrip('*').lower()
+                found = any(token.startswith(prefix) for token in present)
+            else:
+                found = set(_tokens(term)) <= present
+            if found == bool(negated):
+                return False
+        return True
+
+    def _matches(self, doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+        (kind, spec), = query.items()
+
+        if kind == 'match_all':
+            return True
+
+        if kind == 'bool':
+            must = spec.get('must', []) + spec.get('filter', [])
+            if not all(self._matches(doc, clause) for clause in must):
+                return False
+            if any(self._matches(doc, clause) for clause in spec.get('must_not', [])):
+                return False
+            should = spec.get('should', [])
+            minimum = spec.get('minimum_should_match', 0 if must else 1 if should else 0)
+            return sum(1 for clause in should if self._matches(doc, clause)) >= minimum
+
+        if kind == 'simple_query_string':
+            return self._text_matches(doc, spec['fields'], spec['query'])
+
+        (field, condition), = spec.items()
+        values = _values(doc, field)
+
+        if kind == 'term':
+            target, insensitive = _condition(condition)
+            if insensitive:
+                return any(str(value).lower() == str(target).lower() for value in values)
+            return any(value == target for value in values)
+
+        if kind == 'terms':
+            return any(value in condition for value in values)
+
+        if kind == 'wildcard':
+            pattern, insensitive = _condition(condition)
+            if insensitive:
+                return any(fnmatch.fnmatchcase(str(value).lower(), pattern.lower()) for value in values)
+            return any(fnmatch.fnmatchcase(str(value), pattern) for value in values)
+
+        if kind == 'prefix':
+            prefix, insensitive = _condition(condition)
+            if insensitive:
+                return any(str(value).lower().startswith(prefix.lower()) for value in values)
+            return any(str(value).startswith(prefix) for value in values)
+
+        if kind == 'range':
+            bounds = {operator: _bound(bound, round_up=operator in ('lte', 'gt'))
+                      for operator, bound in condition.items() if operator in ('gte', 'gt', 'lte', 'lt')}
+            for value in values:
+                if all(self._compare(value, operator, bound) for operator, bound in bounds.items()):
+                    return True
+            return False
+
+        if kind in ('match', 'match_phrase'):
+            text, _ = _condition(condition, 'query')
+            wanted = set(_tokens(text))
+            present = set(token for value in values for token in _tokens(value))
+            operator = condition.get('operator', 'or') if isinstance(condition, dict) else 'or'
+            return wanted <= present if operator == 'and' else bool(wanted & present)
+
+        raise ValueError(f"MockElasticsearch does not support '{kind}' queries")
+
+    @staticmethod
+    def _compare(value: Any, operator: str, bound: Any) -> bool:
+        value = _comparable(value, bound)
+        if value is None:
+            return False
+        if operator == 'gte':
+            return value >= bound
+        if operator == 'gt':
+            return value > bound
+        if operator == 'lte':
+            return value <= bound
+        return value < bound
@@ -0,0 +1,229 @@
+"""
+Ingest throughput benchmark and regression gate
+
+Measures messages/sec for the single-row (add_message), bulk
+(add_messages) and concurrent (add_message from several threads) ingest
+paths, each into a fresh database, together with how many bytes each
+message costs in the table, its indexes and the FTS index. Results are
+compared with a stored baseline; a path that got slower by more than
+--max-regression percent fails the run. Run from apex-search-lite/:
+
+    python -m benchmarks.ingest_bench --update-baseline   # record
+    python -m benchmarks.ingest_bench                     # gate
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+from benchmarks.corpus import CorpusGenerator
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest_baseline.json')
+
+PATHS = ['single', 'bulk', 'concurrent']
+
+
+def _process_write_bytes() -> Optional[int]:
+    """Bytes this process has caused to be written to storage (Linux only)"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _storage_breakdown(db_path: str) -> Dict[str, int]:
+    """Bytes used by the messages table, its indexes, the FTS index and near-duplicate signatures"""
+    breakdown = {'table': 0, 'indexes': 0, 'fts': 0, 'similarity': 0, 'other': 0}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()
+    except sqlite3.OperationalError:
+        # SQLite built without the dbstat virtual table
+        return {}
+    finally:
+        conn.close()
+
+    for name, size in rows:
+        if name == 'messages':
+            breakdown['table'] += size
+        elif name.startswith('idx_') or name.startswith('sqlite_autoindex_messages'):
+            breakdown['indexes'] += size
+        elif name.startswith('messages_fts'):
+            breakdown['fts'] += size
+        elif name in ('message_signatures', 'message_lsh'):
+            breakdown['similarity'] += size
+        else:
+            breakdown['other'] += size
+    return breakdown
+
+
+def run_path(path: str, messages: List[Dict[str, Any]], work_dir: str,
+             batch_size: int, threads: int) -> Dict[str, Any]:
+    """Ingest the messages through one path into a fresh database"""
+    from search_engine import ApexSearchEngine
+
+    db_path = os.path.join(work_dir, f'ingest_{path}.db')
+    engine = ApexSearchEngine(db_path)
+    written_before = _process_write_bytes()
+    failures = 0
+
+    start = time.perf_counter()
+    if path == 'single':
+        for message in messages:
+            if not engine.add_message(message):
+                failures += 1
+
+    elif path == 'bulk':
+        for batch_start in range(0, len(messages), batch_size):
+            batch = messages[batch_start:batch_start + batch_size]
+            failures += len(batch) - engine.add_messages(batch)
+
+    elif path == 'concurrent':
+        failure_counts = [0] * threads
+
+        def worker(index: int):
+            for message in messages[index::threads]:
+                if not engine.add_message(message):
+                    failure_counts[index] += 1
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        failures = sum(failure_counts)
+
+    else:
+        raise ValueError(f"Unknown ingest path: {path}")
+    elapsed = time.perf_counter() - start
+
+    written_after = _process_write_bytes()
+    engine.close()
+
+    # Fold the WAL back in so file sizes reflect the data, not checkpoint timing
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    ingested = len(messages) - failures
+    breakdown = _storage_breakdown(db_path)
+    per_message = {key: round(size / max(1, ingested), 1) for key, size in breakdown.items()}
+    raw_bytes = sum(len(json.dumps(message)) for message in messages) / max(1, len(messages))
+
+    result = {
+        'path': path,
+        'messages': ingested,
+        'failures': failures,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(ingested / elapsed, 1) if elapsed else 0.0,
+        'db_bytes_per_message': round(os.path.getsize(db_path) / max(1, ingested), 1),
+        'stored_bytes_per_message': per_message,
+        'raw_json_bytes_per_message': round(raw_bytes, 1)
+    }
+    if written_before is not None and written_after is not None:
+        written = written_after - written_before
+        result['io_bytes_written_per_message'] = round(written / max(1, ingested), 1)
+        result['write_amplification'] = round(written / max(1, ingested) / raw_bytes, 2)
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+            max_regression_pct: float) -> List[str]:
+    """Describe every path that is slower than baseline by more than the threshold"""
+    regressions = []
+    for path, result in results.items():
+        expected = baseline.get('paths', {}).get(path, {}).get('messages_per_sec')
+        if not expected:
+            continue
+        change_pct = (result['messages_per_sec'] - expected) / expected * 100
+        result['baseline_messages_per_sec'] = expected
+        result['change_pct'] = round(change_pct, 1)
+        if change_pct < -max_regression_pct:
+            regressions.append(f"{path}: {result['messages_per_sec']}/s vs baseline {expected}/s "
+                               f"({change_pct:.1f}%)")
+    return regressions
+
+
+def print_result(result: Dict[str, Any]):
+    line = (f"{result['path']:<11} {result['messages_per_sec']:>10.1f} msg/s  "
+            f"{result['db_bytes_per_message']:>8.1f} B/msg on disk")
+    stored = result['stored_bytes_per_message']
+    if stored:
+        line += (f"  (table {stored['table']:.0f}, indexes {stored['indexes']:.0f}, "
+                 f"fts {stored['fts']:.0f}, similarity {stored['similarity']:.0f})")
+    if 'write_amplification' in result:
+        line += f"  write amp {result['write_amplification']:.2f}x"
+    if 'change_pct' in result:
+        line += f"  [{result['change_pct']:+.1f}% vs baseline]"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='APEX search ingest throughput benchmark')
+    parser.add_argument('--size', type=int, default=5000, help='messages per path')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma-separated subset of ' + ', '.join(PATHS))
+    parser.add_argument('--batch-size', type=int, default=500, help='messages per add_messages call')
+    parser.add_argument('--threads', type=int, default=4, help='writer threads for the concurrent path')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--max-regression', type=float, default=20.0,
+                        help='fail when a path is this many percent slower than baseline')
+    parser.add_argument('--update-baseline', action='store_true', help='record this run as the new baseline')
+    parser.add_argument('--json', dest='json_path', default=None, help='write the full report here')
+    args = parser.parse_args()
+
+    messages = list(CorpusGenerator(size=args.size, seed=args.seed).messages())
+    work_dir = tempfile.mkdtemp(prefix='apex_ingest_')
+    results = {}
+    try:
+        for path in args.paths.split(','):
+            results[path] = run_path(path, messages, work_dir, args.batch_size, args.threads)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'config': {'size': args.size, 'seed': args.seed, 'batch_size': args.batch_size, 'threads': args.threads},
+        'paths': results
+    }
+
+    regressions = []
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print(f"Warning: baseline was recorded with {baseline.get('config')}, this run uses {report['config']}")
+        regressions = compare(results, baseline, args.max_regression)
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+
+    for result in results.values():
+        print_result(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\nIngest regression beyond {args.max_regression}%:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
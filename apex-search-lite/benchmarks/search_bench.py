@@ -0,0 +1,139 @@
+"""
+Search latency benchmark
+
+Generates a reproducible synthetic corpus, loads it into each backend and
+replays a query mix, reporting p50/p95/p99 latency, throughput and index
+size. Run from apex-search-lite/:
+
+    python -m benchmarks.search_bench --size 100000 --queries 2000
+    python -m benchmarks.search_bench --backend both --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Any
+
+from benchmarks.backends import create_backend
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.stats import summarize, format_summary
+
+
+def run_backend(backend_name: str, corpus: CorpusGenerator, queries: List[Dict[str, Any]],
+                db_path: str, warmup: int = 50) -> Dict[str, Any]:
+    """Load the corpus into one backend and replay the query mix against it"""
+    backend = create_backend(backend_name, db_path)
+    try:
+        load_start = time.time()
+        loaded = backend.load(corpus.messages())
+        load_seconds = time.time() - load_start
+
+        # Warm caches with a slice of the mix that is not measured
+        for params in queries[:warmup]:
+            backend.search({k: v for k, v in params.items() if k != '_shape'})
+
+        latencies: List[float] = []
+        by_shape: Dict[str, List[float]] = {}
+        errors = 0
+        timed_out = 0
+        total_hits = 0
+
+        replay_start = time.time()
+        for params in queries:
+            shape = params['_shape']
+            search_params = {k: v for k, v in params.items() if k != '_shape'}
+
+            start = time.perf_counter()
+            result = backend.search(search_params)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            if 'error' in result:
+                errors += 1
+                continue
+            if result.get('timed_out'):
+                timed_out += 1
+            total_hits += result.get('total_hits', 0)
+            latencies.append(elapsed_ms)
+            by_shape.setdefault(shape, []).append(elapsed_ms)
+        replay_seconds = time.time() - replay_start
+
+        return {
+            'backend': backend.name,
+            'messages_loaded': loaded,
+            'load_seconds': round(load_seconds, 3),
+            'load_rate_per_sec': round(loaded / load_seconds, 1) if load_seconds else 0.0,
+            'size_bytes': backend.size_bytes(),
+            'queries': len(queries),
+            'errors': errors,
+            'timed_out': timed_out,
+            'mean_hits': round(total_hits / max(1, len(latencies)), 1),
+            'throughput_qps': round(len(queries) / replay_seconds, 1) if replay_seconds else 0.0,
+            'latency': summarize(latencies),
+            'latency_by_shape': {shape: summarize(values) for shape, values in sorted(by_shape.items())}
+        }
+    finally:
+        backend.close()
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n=== {report['backend']} ===")
+    print(f"Loaded {report['messages_loaded']} messages in {report['load_seconds']}s "
+          f"({report['load_rate_per_sec']}/s), index size {report['size_bytes'] / (1024 * 1024):.1f} MB")
+    print(f"Replayed {report['queries']} queries at {report['throughput_qps']} qps "
+          f"({report['errors']} errors, {report['timed_out']} timed out, {report['mean_hits']} mean hits)")
+    print(format_summary('all queries', report['latency']))
+    for shape, summary in report['latency_by_shape'].items():
+        print(format_summary(f"  {shape}", summary))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='APEX search latency benchmark')
+    parser.add_argument('--size', type=int, default=10000, help='messages in the synthetic corpus')
+    parser.add_argument('--queries', type=int, default=1000, help='queries to replay')
+    parser.add_argument('--seed', type=int, default=42, help='corpus and query mix seed')
+    parser.add_argument('--domains', type=int, default=2000, help='distinct sender domains')
+    parser.add_argument('--zipf', type=float, default=1.1, help='sender/domain Zipf exponent')
+    parser.add_argument('--days', type=int, default=30, help='days of mail the corpus spans')
+    parser.add_argument('--category-mix', type=json.loads, default=None,
+                        help='JSON object of threat_category -> share, e.g. \'{"phishing": 0.5, "legitimate": 0.5}\'')
+    parser.add_argument('--backend', choices=['sqlite', 'es', 'both'], default='sqlite')
+    parser.add_argument('--db-path', default=None, help='SQLite database path (default: a temp dir)')
+    parser.add_argument('--warmup', type=int, default=50, help='unmeasured warm-up queries')
+    parser.add_argument('--json', dest='json_path', default=None, help='write the full report here')
+    args = parser.parse_args()
+
+    corpus = CorpusGenerator(size=args.size, seed=args.seed, domains=args.domains,
+                             zipf_exponent=args.zipf, category_mix=args.category_mix, days=args.days)
+    queries = corpus.query_mix(args.queries)
+
+    temp_dir = None
+    db_path = args.db_path
+    if db_path is None:
+        temp_dir = tempfile.mkdtemp(prefix='apex_bench_')
+        db_path = os.path.join(temp_dir, 'apex_search.db')
+
+    backends = ['sqlite', 'es'] if args.backend == 'both' else [args.backend]
+    reports = []
+    try:
+        for backend_name in backends:
+            report = run_backend(backend_name, corpus, queries, db_path, args.warmup)
+            print_report(report)
+            reports.append(report)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'corpus': {'size': args.size, 'seed': args.seed, 'domains': args.domains,
+                           'zipf': args.zipf, 'days': args.days},
+                'results': reports
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Latency statistics helpers shared by the benchmark and load tools
+"""
+
+import math
+from typing import Dict, List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max/mean of a list of latencies in milliseconds"""
+    values = sorted(latencies_ms)
+    if not values:
+        return {'count': 0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'mean_ms': 0.0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3),
+        'mean_ms': round(sum(values) / len(values), 3)
+    }
+
+
+def format_summary(label: str, summary: Dict[str, float]) -> str:
+    """One aligned report line for a latency summary"""
+    return (f"{label:<28} n={summary['count']:<7} p50={summary['p50_ms']:>9.2f}ms "
+            f"p95={summary['p95_ms']:>9.2f}ms p99={summary['p99_ms']:>9.2f}ms "
+            f"max={summary['max_ms']:>9.2f}ms")
+
+
+# Histogram bucket upper bounds in milliseconds
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+
+def histogram(latencies_ms: List[float], buckets: Sequence[float] = HISTOGRAM_BUCKETS_MS) -> List[Dict[str, float]]:
+    """Count latencies into fixed log-spaced buckets"""
+    counts = [0] * len(buckets)
+    for value in latencies_ms:
+        for index, upper in enumerate(buckets):
+            if value <= upper:
+                counts[index] += 1
+                break
+    return [{'le_ms': upper if upper != float('inf') else '+Inf', 'count': count}
+            for upper, count in zip(buckets, counts)]
+
+
+def format_histogram(buckets: List[Dict[str, float]], width: int = 40) -> List[str]:
+    """ASCII bar chart lines for a histogram"""
+    peak = max((bucket['count'] for bucket in buckets), default=0) or 1
+    lines = []
+    for bucket in buckets:
+        label = bucket['le_ms'] if isinstance(bucket['le_ms'], str) else f"{bucket['le_ms']:g}"
+        bar = '#' * round(bucket['count'] / peak * width)
+        lines.append(f"  <= {label:>6} ms {bucket['count']:>8} {bar}")
+    return lines
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Concurrent load generator for the APEX Search API
+
+Drives /search, /search/quick, /api/search/advanced and POST /messages at
+a target request rate with a thread pool, using the synthetic corpus from
+benchmarks/ for realistic queries and messages. Latency is measured from
+each request's scheduled send time, so a saturated server shows up as
+queueing delay instead of being hidden by a slower send rate.
+
+    # against a running server
+    python load_test.py --rps 200 --duration 30 --write-ratio 0.1
+
+    # start a throwaway local server and ramp until it saturates
+    python load_test.py --start-server --ramp 50,100,200,400,800
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.stats import summarize, format_summary, histogram, format_histogram
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+# Share of read traffic sent to each search endpoint
+DEFAULT_READ_MIX = {'search': 0.5, 'quick': 0.2, 'advanced': 0.3}
+
+# Engine parameter -> /api/search/advanced field
+ADVANCED_FIELDS = {
+    'sender': 'sender_email',
+    'domain': 'sender_domain',
+    'ip_address': 'sender_ip',
+    'subject': 'text',
+    'threat_category': 'threat_category',
+    'date_from': 'date_from',
+    'date_to': 'date_to'
+}
+
+
+class RequestFactory:
+    def __init__(self, corpus: CorpusGenerator, read_mix: Dict[str, float], write_ratio: float, seed: int):
+        """Builds the next request (endpoint, method, path, payload) of the traffic mix"""
+        self.rng = random.Random(seed)
+        self.queries = corpus.query_mix(5000, seed=seed)
+        self.messages = corpus.messages()
+        self.read_endpoints = list(read_mix)
+        self.read_weights = [read_mix[name] for name in self.read_endpoints]
+        self.write_ratio = write_ratio
+        self.run_id = f"{int(time.time())}_{seed}"
+        self.write_count = 0
+        self._lock = threading.Lock()
+
+    def next_message(self) -> Dict[str, Any]:
+        with self._lock:
+            try:
+                message = next(self.messages)
+            except StopIteration:
+                self.messages = CorpusGenerator(seed=self.rng.randint(0, 10 ** 6)).messages()
+                message = next(self.messages)
+            self.write_count += 1
+            # Unique per run so repeated load tests insert rather than replace
+            message['message_id'] = f"load_{self.run_id}_{self.write_count}"
+            return message
+
+    def next_request(self) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
+        if self.rng.random() < self.write_ratio:
+            return 'messages', 'POST', '/messages', self.next_message()
+
+        params = dict(self.rng.choice(self.queries))
+        params.pop('_shape', None)
+        endpoint = self.rng.choices(self.read_endpoints, self.read_weights)[0]
+
+        if endpoint == 'quick':
+            term = params.get('sender') or params.get('domain') or params.get('ip_address') \
+                or params.get('subject') or params.get('content') or params.get('threat_category')
+            return 'quick', 'GET', f"/search/quick?{urlencode({'q': term})}", None
+
+        if endpoint == 'advanced':
+            payload = {ADVANCED_FIELDS[key]: value for key, value in params.items() if key in ADVANCED_FIELDS}
+            return 'advanced', 'POST', '/api/search/advanced', payload
+
+        return 'search', 'POST', '/search', params
+
+
+class LoadStage:
+    def __init__(self, base_url: str, factory: RequestFactory, rps: float, duration: float,
+                 threads: int, timeout: float):
+        """One constant-rate stage of the load test"""
+        self.base_url = base_url.rstrip('/')
+        self.factory = factory
+        self.rps = rps
+        self.duration = duration
+        self.threads = threads
+        self.timeout = timeout
+        self.results: List[Dict[str, Any]] = []
+        self._results_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _send(self, scheduled_at: float, request: Tuple[str, str, str, Optional[Dict[str, Any]]]):
+        endpoint, method, path, payload = request
+        started_at = time.perf_counter()
+        status = 0
+        error = None
+        timed_out = False
+        try:
+            response = self._session().request(method, self.base_url + path, json=payload, timeout=self.timeout)
+            status = response.status_code
+            if status == 200 and endpoint != 'messages':
+                timed_out = bool(response.json().get('timed_out'))
+        except requests.RequestException as e:
+            error = type(e).__name__
+        finished_at = time.perf_counter()
+
+        with self._results_lock:
+            self.results.append({
+                'endpoint': endpoint,
+                'status': status,
+                'error': error,
+                'timed_out': timed_out,
+                # Includes time spent waiting for a free client thread
+                'latency_ms': (finished_at - scheduled_at) * 1000,
+                'service_ms': (finished_at - started_at) * 1000
+            })
+
+    def run(self) -> Dict[str, Any]:
+        interval = 1.0 / self.rps
+        total = int(self.rps * self.duration)
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='apex-load') as pool:
+            for index in range(total):
+                scheduled_at = start + index * interval
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._send, scheduled_at, self.factory.next_request())
+        elapsed = time.perf_counter() - start
+
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        by_endpoint: Dict[str, List[Dict[str, Any]]] = {}
+        for result in self.results:
+            by_endpoint.setdefault(result['endpoint'], []).append(result)
+
+        def describe(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+            latencies = [r['latency_ms'] for r in results]
+            errors = [r for r in results if r['error'] or r['status'] >= 400 or r['status'] == 0]
+            statuses: Dict[str, int] = {}
+            for r in results:
+                key = r['error'] or str(r['status'])
+                statuses[key] = statuses.get(key, 0) + 1
+            return {
+                'requests': len(results),
+                'error_rate': round(len(errors) / len(results), 4) if results else 0.0,
+                'timed_out': sum(1 for r in results if r['timed_out']),
+                'statuses': statuses,
+                'latency': summarize(latencies),
+                'service_time': summarize([r['service_ms'] for r in results]),
+                'histogram': histogram(latencies)
+            }
+
+        overall = describe(self.results)
+        overall['target_rps'] = self.rps
+        overall['achieved_rps'] = round(len(self.results) / elapsed, 1) if elapsed else 0.0
+        overall['endpoints'] = {name: describe(results) for name, results in sorted(by_endpoint.items())}
+        return overall
+
+
+def print_stage(report: Dict[str, Any]):
+    print(f"\n=== target {report['target_rps']} rps, achieved {report['achieved_rps']} rps, "
+          f"error rate {report['error_rate'] * 100:.2f}%, {report['timed_out']} partial (timed_out) ===")
+    print(format_summary('all requests', report['latency']))
+    for name, endpoint in report['endpoints'].items():
+        print(format_summary(f"  {name} ({endpoint['error_rate'] * 100:.1f}% err)", endpoint['latency']))
+    print("Latency histogram (from scheduled send time):")
+    for line in format_histogram(report['histogram']):
+        print(line)
+
+
+def is_saturated(report: Dict[str, Any], slo_p95_ms: float, max_error_rate: float) -> bool:
+    """A stage is saturated when it misses the rate, the p95 SLO or the error budget"""
+    return (report['achieved_rps'] < 0.9 * report['target_rps']
+            or report['latency']['p95_ms'] > slo_p95_ms
+            or report['error_rate'] > max_error_rate)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(work_dir: str) -> Tuple[subprocess.Popen, str]:
+    """Run the lite API on a free port with its data and logs in work_dir"""
+    os.makedirs(os.path.join(work_dir, 'logs'), exist_ok=True)
+    port = _free_port()
+    env = dict(os.environ, APEX_SEARCH_PORT=str(port))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(API_DIR, 'app.py')],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Local API exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("Local API did not become healthy within 30s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='APEX Search API load generator')
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--start-server', action='store_true',
+                        help='start a throwaway local API (temp data dir) instead of using --base-url')
+    parser.add_argument('--rps', type=float, default=50, help='target requests per second')
+    parser.add_argument('--ramp', default=None,
+                        help='comma-separated RPS stages, e.g. 50,100,200; stops at the saturation point')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per stage')
+    parser.add_argument('--threads', type=int, default=32, help='client threads')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='share of requests that are POST /messages')
+    parser.add_argument('--read-mix', type=json.loads, default=DEFAULT_READ_MIX,
+                        help='JSON share of reads per endpoint (search, quick, advanced)')
+    parser.add_argument('--preload', type=int, default=2000, help='messages to ingest before measuring')
+    parser.add_argument('--timeout', type=float, default=10, help='per-request timeout in seconds')
+    parser.add_argument('--slo-p95-ms', type=float, default=100, help='p95 latency that counts as saturated')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='error rate that counts as saturated')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', dest='json_path', default=None, help='write the full report here')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if args.start_server:
+        server, base_url = start_local_server(tempfile.mkdtemp(prefix='apex_load_'))
+        print(f"Started local API at {base_url}")
+
+    try:
+        corpus = CorpusGenerator(size=10 ** 9, seed=args.seed)
+        factory = RequestFactory(corpus, args.read_mix, args.write_ratio, args.seed)
+
+        if args.preload:
+            print(f"Preloading {args.preload} messages...")
+            session = requests.Session()
+            for _ in range(args.preload):
+                session.post(f"{base_url}/messages", json=factory.next_message(), timeout=args.timeout)
+
+        stages = [float(rps) for rps in args.ramp.split(',')] if args.ramp else [args.rps]
+        reports = []
+        saturation_rps = None
+        for rps in stages:
+            report = LoadStage(base_url, factory, rps, args.duration, args.threads, args.timeout).run()
+            print_stage(report)
+            reports.append(report)
+            if is_saturated(report, args.slo_p95_ms, args.max_error_rate):
+                saturation_rps = rps
+                break
+
+        if args.ramp:
+            if saturation_rps is None:
+                print(f"\nNo saturation up to {stages[-1]} rps")
+            else:
+                sustained = [r['target_rps'] for r in reports[:-1]]
+                print(f"\nSaturated at {saturation_rps} rps; last healthy stage: "
+                      f"{sustained[-1] if sustained else 'none'} rps")
+
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump({'base_url': base_url, 'saturation_rps': saturation_rps, 'stages': reports}, f, indent=2)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
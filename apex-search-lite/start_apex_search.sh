@@ -31,9 +31,10 @@ echo -e "${YELLOW}🐍 Installing Python dependencies...${NC}"
 cd apex-search-lite/api
 pip3 install -r requirements.txt
 
-# Start the API server
+# Start the API server (one search engine per gunicorn worker)
 echo -e "${YELLOW}🚀 Starting APEX Search API...${NC}"
-python3 app.py &
+mkdir -p logs data
+gunicorn -c gunicorn.conf.py wsgi:app &
 
 # Wait for server to start
 sleep 5
@@ -47,6 +48,12 @@ else
     exit 1
 fi
 
+# Seed sample data on first run (gunicorn workers never add it themselves)
+if curl -s http://localhost:5000/health | grep -q '"total_messages": *0[,}]'; then
+    echo -e "${YELLOW}📥 Adding sample data...${NC}"
+    curl -s -X POST http://localhost:5000/setup > /dev/null
+fi
+
 echo ""
 echo -e "${GREEN}🎉 APEX Search System is ready!${NC}"
 echo ""
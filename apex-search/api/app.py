@@ -3,14 +3,27 @@ APEX Super Fast Message Search API
 Provides sub-100ms search capabilities for email data
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from elasticsearch import Elasticsearch
-from datetime import datetime, timedelta
-import json
-import os
+from datetime import datetime
+from functools import wraps
+import hmac
 import logging
-from typing import Dict, List, Any
+import os
+from typing import Any, Optional
+
+from bulk_indexer import BulkIndexer, iter_ndjson, BULK_WORKERS, BULK_CHUNK_DOCS, BULK_CHUNK_BYTES
+from index_lifecycle import RETENTION_DAYS
+from es_engine import (
+    ElasticsearchEngine, client_settings, normalize_customer_id, decode_cursor,
+    ES_HOSTS, INDEX_NAME, LAYOUT, TENANT_MODE, TENANT_HEADER
+)
+
+try:
+    import orjson
+except ImportError:  # optional: much faster encoding of large search responses
+    orjson = None
 
 # Configure logging
 logging.basicConfig(
@@ -23,24 +36,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class FastJSONProvider(DefaultJSONProvider):
+    """Encode jsonify responses with orjson when it is installed"""
+    
+    def dumps(self, obj: Any, **kwargs) -> str:
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs) -> Response:
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
-# Elasticsearch configuration
-ES_URL = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
-es = Elasticsearch([ES_URL])
+# Elasticsearch engine (query building, search, indexing): see es_engine
+engine = ElasticsearchEngine()
 
-# APEX Search Index Configuration
-INDEX_NAME = 'apex_messages'
+# In tenant mode, index management (setup, reset, rollover, sample data)
+# acts on every tenant's messages and needs this operator token in
+# ADMIN_HEADER; without APEX_ADMIN_TOKEN it is refused outright
+ADMIN_TOKEN = os.getenv('APEX_ADMIN_TOKEN', '')
+ADMIN_HEADER = 'X-Admin-Token'
+
+def request_customer_id() -> Optional[str]:
+    """
+    The tenant this request is for: required from TENANT_HEADER in tenant
+    mode (ValueError when missing or malformed), else None
+    """
+    if TENANT_MODE != 'header':
+        return None
+    return normalize_customer_id(request.headers.get(TENANT_HEADER))
+
+def admin_only(view):
+    """Reject index management from tenants (tenant mode without the operator token)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if TENANT_MODE == 'header':
+            token = request.headers.get(ADMIN_HEADER, '')
+            if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+                return jsonify({'error': 'Index management needs the operator token in tenant mode'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
-        es.ping()
+        engine.ping()
         return jsonify({
             'status': 'healthy',
             'elasticsearch': 'connected',
+            'client': client_settings(),
             'timestamp': datetime.utcnow().isoformat()
         })
     except Exception as e:
@@ -49,286 +106,154 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/metrics/client', methods=['GET'])
+def client_metrics():
+    """Latency of this process's Elasticsearch requests, per operation, as the API sees them"""
+    return jsonify({
+        'pid': os.getpid(),
+        'client': client_settings(),
+        'operations': engine.metrics.snapshot()
+    })
+
 @app.route('/search', methods=['POST'])
 def search_messages():
     """
     Super fast message search endpoint
-    Supports search by sender, domain, IP, subject, content, date range
+    Supports search by sender, domain, IP, subject, content, date range,
+    facet selection and cursor paging (see ElasticsearchEngine.search_messages)
     """
     try:
-        data = request.get_json()
-        
-        # Build Elasticsearch query
-        query = build_search_query(data)
-        
-        # Execute search with performance timing
-        start_time = datetime.utcnow()
-        response = es.search(
-            index=INDEX_NAME,
-            body=query,
-            timeout='100ms'  # Sub-100ms requirement
-        )
-        end_time = datetime.utcnow()
-        
-        search_time = (end_time - start_time).total_seconds() * 1000
-        
-        # Format results
-        results = {
-            'query_time_ms': round(search_time, 2),
-            'total_hits': response['hits']['total']['value'],
-            'messages': [hit['_source'] for hit in response['hits']['hits']],
-            'facets': extract_facets(response)
-        }
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        # Never the body's own customer_id
+        data['customer_id'] = request_customer_id()
+        results = engine.search_messages(data)
+        if 'error' in results:
+            return jsonify(results), 500
         
-        logger.info(f"Search completed in {search_time:.2f}ms")
+        logger.info(f"Search completed in {results['query_time_ms']:.2f}ms")
         return jsonify(results)
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def build_search_query(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Build optimized Elasticsearch query"""
-    
-    must_clauses = []
-    should_clauses = []
-    
-    # Sender email search
-    if 'sender' in data:
-        must_clauses.append({
-            'wildcard': {
-                'sender_email': f"*{data['sender']}*"
-            }
-        })
-    
-    # Domain search
-    if 'domain' in data:
-        must_clauses.append({
-            'wildcard': {
-                'sender_domain': f"*{data['domain']}*"
-            }
-        })
-    
-    # IP address search
-    if 'ip_address' in data:
-        must_clauses.append({
-            'term': {
-                'sender_ip': data['ip_address']
-            }
-        })
-    
-    # Subject search
-    if 'subject' in data:
-        should_clauses.append({
-            'match': {
-                'subject': {
-                    'query': data['subject'],
-                    'fuzziness': 'AUTO'
-                }
-            }
-        })
-    
-    # Content search
-    if 'content' in data:
-        should_clauses.append({
-            'match': {
-                'content': {
-                    'query': data['content'],
-                    'fuzziness': 'AUTO'
-                }
-            }
-        })
-    
-    # Date range search
-    if 'date_from' in data or 'date_to' in data:
-        date_range = {}
-        if 'date_from':
-            date_range['gte'] = data['date_from']
-        if 'date_to':
-            date_range['lte'] = data['date_to']
-        
-        must_clauses.append({
-            'range': {
-                'timestamp': date_range
-            }
-        })
-    
-    # Threat category search
-    if 'threat_category' in data:
-        must_clauses.append({
-            'term': {
-                'threat_category': data['threat_category']
-            }
-        })
-    
-    # APEX action search
-    if 'apex_action' in data:
-        must_clauses.append({
-            'term': {
-                'apex_action': data['apex_action']
-            }
-        })
-    
-    # Build final query
-    query = {
-        'size': data.get('size', 50),
-        'from': data.get('from', 0),
-        'query': {
-            'bool': {
-                'must': must_clauses,
-                'should': should_clauses,
-                'minimum_should_match': 1 if should_clauses else 0
-            }
-        },
-        'sort': [
-            {'timestamp': {'order': 'desc'}},
-            {'_score': {'order': 'desc'}}
-        ],
-        'aggs': {
-            'threat_categories': {
-                'terms': {'field': 'threat_category'}
-            },
-            'apex_actions': {
-                'terms': {'field': 'apex_action'}
-            },
-            'sender_domains': {
-                'terms': {'field': 'sender_domain'}
-            }
-        }
-    }
-    
-    return query
-
-def extract_facets(response: Dict[str, Any]) -> Dict[str, List[Dict]]:
-    """Extract aggregation facets from search response"""
-    facets = {}
-    
-    if 'aggregations' in response:
-        aggs = response['aggregations']
-        
-        if 'threat_categories' in aggs:
-            facets['threat_categories'] = [
-                {'name': bucket['key'], 'count': bucket['doc_count']}
-                for bucket in aggs['threat_categories']['buckets']
-            ]
-        
-        if 'apex_actions' in aggs:
-            facets['apex_actions'] = [
-                {'name': bucket['key'], 'count': bucket['doc_count']}
-                for bucket in aggs['apex_actions']['buckets']
-            ]
-        
-        if 'sender_domains' in aggs:
-            facets['sender_domains'] = [
-                {'name': bucket['key'], 'count': bucket['doc_count']}
-                for bucket in aggs['sender_domains']['buckets']
-            ]
-    
-    return facets
+@app.route('/search/cursor', methods=['DELETE'])
+def delete_search_cursor():
+    """Close a cursor the client will not page to the end"""
+    try:
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        cursor_state = decode_cursor(data.get('cursor', ''))
+        if TENANT_MODE == 'header' and cursor_state.get('customer_id') != request_customer_id():
+            raise ValueError('Invalid cursor')
+        engine.close_cursor(cursor_state['pit_id'])
+        return jsonify({'status': 'success'})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Close cursor error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/index/setup', methods=['POST'])
+@admin_only
 def setup_index():
-    """Setup APEX messages index with optimized mapping"""
-    
-    mapping = {
-        'mappings': {
-            'properties': {
-                'message_id': {'type': 'keyword'},
-                'sender_email': {'type': 'keyword'},
-                'sender_domain': {'type': 'keyword'},
-                'sender_ip': {'type': 'ip'},
-                'recipient_email': {'type': 'keyword'},
-                'subject': {
-                    'type': 'text',
-                    'analyzer': 'standard',
-                    'fields': {
-                        'keyword': {'type': 'keyword'}
-                    }
-                },
-                'content': {
-                    'type': 'text',
-                    'analyzer': 'standard'
-                },
-                'timestamp': {'type': 'date'},
-                'threat_category': {'type': 'keyword'},
-                'apex_action': {'type': 'keyword'},
-                'threat_score': {'type': 'float'},
-                'file_attachments': {'type': 'keyword'},
-                'urls': {'type': 'keyword'}
-            }
-        },
-        'settings': {
-            'number_of_shards': 1,
-            'number_of_replicas': 0,
-            'refresh_interval': '1s',
-            'index.mapping.total_fields.limit': 2000
-        }
-    }
-    
+    """
+    Install the index template and create the current period's index.
+    Existing indices are kept (new mapping applies to new periods);
+    ?reset=true deletes every apex_messages index first.
+    """
     try:
-        # Delete existing index if it exists
-        if es.indices.exists(index=INDEX_NAME):
-            es.indices.delete(index=INDEX_NAME)
+        reset = request.args.get('reset', 'false').lower() == 'true'
+        
+        if not reset and engine.has_legacy_index():
+            return jsonify({
+                'error': f'Index {INDEX_NAME} predates time-based indices; reindex it or rerun with ?reset=true'
+            }), 409
         
-        # Create new index
-        es.indices.create(index=INDEX_NAME, body=mapping)
+        rollover = engine.setup_index(reset)
         
         return jsonify({
             'status': 'success',
-            'message': f'Index {INDEX_NAME} created successfully'
+            'message': f'Index template {INDEX_NAME} installed',
+            'period': LAYOUT.period,
+            'read_alias': LAYOUT.read_alias,
+            'write_alias': LAYOUT.write_alias,
+            'write_index': rollover['write_index']
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/index/rollover', methods=['POST'])
+@admin_only
+def rollover_index():
+    """
+    Index maintenance, meant to run from cron: move the write alias to the
+    current period's index and delete indices past retention
+    """
+    try:
+        retention_days = request.args.get('retention_days', RETENTION_DAYS, type=int)
+        return jsonify({
+            'rollover': engine.rollover_write_alias(),
+            'retention': engine.enforce_retention(retention_days)
+        })
+    except Exception as e:
+        logger.error(f"Index rollover error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/index/bulk', methods=['POST'])
+def bulk_index():
+    """
+    Bulk index messages through the _bulk API.
+    Takes NDJSON (one message per line, streamed without buffering the
+    whole body) or a JSON list of messages.
+    """
+    try:
+        customer_id = request_customer_id()
+        parse_errors = []
+        if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            documents = iter_ndjson(request.stream, parse_errors)
+        else:
+            data = request.get_json()
+            documents = data.get('messages') if isinstance(data, dict) else data
+            if not isinstance(documents, list):
+                return jsonify({'error': 'Expected NDJSON or a list of messages'}), 400
+        
+        indexer = BulkIndexer(
+            ES_HOSTS[0],
+            INDEX_NAME,
+            route=LAYOUT.index_for_document,
+            workers=request.args.get('workers', BULK_WORKERS, type=int),
+            chunk_docs=request.args.get('chunk_docs', BULK_CHUNK_DOCS, type=int),
+            chunk_bytes=request.args.get('chunk_bytes', BULK_CHUNK_BYTES, type=int),
+            customer_id=customer_id
+        )
+        report = indexer.index_documents(documents)
+        report['failed'] += len(parse_errors)
+        report['errors'] = (parse_errors + report['errors'])[:20]
+        
+        return jsonify(report), 200 if not report['failed'] else 207
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Bulk index error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/index/sample-data', methods=['POST'])
+@admin_only
 def add_sample_data():
     """Add sample data for testing"""
-    
-    sample_messages = [
-        {
-            'message_id': 'msg_001',
-            'sender_email': 'phisher@malicious-domain.com',
-            'sender_domain': 'malicious-domain.com',
-            'sender_ip': '192.168.1.100',
-            'recipient_email': 'user@company.com',
-            'subject': 'Urgent: Verify Your Account',
-            'content': 'Click here to verify your account immediately',
-            'timestamp': datetime.utcnow().isoformat(),
-            'threat_category': 'phishing',
-            'apex_action': 'quarantine',
-            'threat_score': 0.95,
-            'file_attachments': ['malware.exe'],
-            'urls': ['http://fake-bank.com/login']
-        },
-        {
-            'message_id': 'msg_002',
-            'sender_email': 'legitimate@sender.com',
-            'sender_domain': 'sender.com',
-            'sender_ip': '10.0.0.1',
-            'recipient_email': 'user@company.com',
-            'subject': 'Monthly Report',
-            'content': 'Please find attached the monthly report',
-            'timestamp': (datetime.utcnow() - timedelta(days=1)).isoformat(),
-            'threat_category': 'legitimate',
-            'apex_action': 'deliver',
-            'threat_score': 0.05,
-            'file_attachments': ['report.pdf'],
-            'urls': []
-        }
-    ]
-    
     try:
-        for i, message in enumerate(sample_messages):
-            es.index(
-                index=INDEX_NAME,
-                id=f'sample_{i}',
-                body=message
-            )
-        
+        added = engine.add_sample_data()
         return jsonify({
             'status': 'success',
-            'message': f'Added {len(sample_messages)} sample messages'
+            'message': f'Added {added} sample messages'
         })
         
     except Exception as e:
@@ -0,0 +1,494 @@
+"""
+APEX Search bulk indexing pipeline
+Streams NDJSON messages into Elasticsearch through the _bulk API
+
+    python bulk_indexer.py messages.ndjson --workers 4 --chunk-docs 2000
+    zcat export.ndjson.gz | python bulk_indexer.py - --es-url http://es:9200
+
+Speaks plain HTTP (keep-alive connection per worker) rather than going
+through the elasticsearch client, so it can be pointed at any server that
+answers /_bulk and /<index>/_settings - including a local stand-in.
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Any, Optional, Iterable, Iterator, Tuple
+from urllib.parse import urlsplit, quote
+
+try:
+    import orjson
+except ImportError:  # optional: faster encoding of bulk bodies
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# ELASTICSEARCH_URL may list several nodes; the loader talks to the first
+DEFAULT_ES_URL = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200').split(',')[0].strip()
+DEFAULT_INDEX = 'apex_messages'
+
+# A chunk is sent when it reaches either limit. Elastic recommends bulk
+# requests of a few MB; much larger ones only add memory pressure
+BULK_WORKERS = int(os.getenv('APEX_BULK_WORKERS', '4'))
+BULK_CHUNK_DOCS = int(os.getenv('APEX_BULK_CHUNK_DOCS', '1000'))
+BULK_CHUNK_BYTES = int(os.getenv('APEX_BULK_CHUNK_BYTES', str(5 * 1024 * 1024)))
+
+# 429s (and 502-504s) are retried with exponential backoff and jitter
+BULK_MAX_RETRIES = int(os.getenv('APEX_BULK_MAX_RETRIES', '6'))
+BULK_BACKOFF_SECONDS = float(os.getenv('APEX_BULK_BACKOFF_SECONDS', '0.5'))
+BULK_MAX_BACKOFF_SECONDS = 30.0
+
+# Loads of at least this many documents switch index refresh off until
+# they finish (0 disables the switch)
+LARGE_LOAD_DOCS = int(os.getenv('APEX_BULK_LARGE_LOAD_DOCS', '10000'))
+
+BULK_TIMEOUT_SECONDS = float(os.getenv('APEX_BULK_TIMEOUT_SECONDS', '60'))
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+# Failed documents reported back in full; the rest are only counted
+MAX_ERROR_SAMPLES = 20
+
+# Loads that switched refresh off are recorded in one document per index in
+# this index, so loads in different processes (gunicorn workers, CLI runs)
+# agree on which one finishes last and switches it back on. A hold older
+# than REFRESH_HOLD_SECONDS belongs to a load that died and is ignored
+REFRESH_HOLDS_INDEX = os.getenv('APEX_BULK_REFRESH_HOLDS_INDEX', 'apex_bulk_refresh_holds')
+REFRESH_HOLD_SECONDS = float(os.getenv('APEX_BULK_REFRESH_HOLD_SECONDS', '3600'))
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def iter_ndjson(lines: Iterable[bytes], errors: Optional[List[Dict[str, Any]]] = None) -> Iterator[Any]:
+    """
+    Parse NDJSON lines, skipping blank ones. Lines that are not valid JSON
+    are appended to errors (line number and message) instead of stopping
+    the load.
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield orjson.loads(line) if orjson is not None else json.loads(line)
+        except ValueError as e:
+            if errors is not None:
+                errors.append({'line': line_number, 'error': f'Invalid JSON: {str(e)}'})
+
+
+class BulkHTTPError(Exception):
+    def __init__(self, status: int, body: bytes, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {body[:200].decode('utf-8', 'replace')}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class BulkIndexer:
+    def __init__(self, es_url: str = DEFAULT_ES_URL, index: str = DEFAULT_INDEX,
+                 workers: int = BULK_WORKERS, chunk_docs: int = BULK_CHUNK_DOCS,
+                 chunk_bytes: int = BULK_CHUNK_BYTES, max_retries: int = BULK_MAX_RETRIES,
+                 backoff_seconds: float = BULK_BACKOFF_SECONDS,
+                 large_load_docs: int = LARGE_LOAD_DOCS,
+                 timeout_seconds: float = BULK_TIMEOUT_SECONDS,
+                 route: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 customer_id: Optional[str] = None):
+        """
+        Parallel _bulk loader. Documents are indexed under their message_id,
+        so retrying a chunk (or rerunning a whole load) overwrites rather
+        than duplicates. route picks each document's index (e.g. its
+        time-based index); without it everything goes to index. Large loads
+        switch refresh off on the concrete indices they write to.
+        
+        customer_id stamps every document with that tenant. Documents with
+        a tenant (given or their own customer_id) are routed to its shard
+        and keyed by tenant and message_id, as es_engine.document_id does.
+        """
+        url = urlsplit(es_url)
+        self.scheme = url.scheme or 'http'
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or (443 if self.scheme == 'https' else 9200)
+        self.base_path = url.path.rstrip('/')
+        self.auth_header = None
+        if url.username:
+            credentials = f"{url.username}:{url.password or ''}".encode('utf-8')
+            self.auth_header = f"Basic {base64.b64encode(credentials).decode('ascii')}"
+
+        self.index = index
+        self.workers = max(1, workers)
+        self.chunk_docs = max(1, chunk_docs)
+        self.chunk_bytes = max(1, chunk_bytes)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.large_load_docs = large_load_docs
+        self.timeout_seconds = timeout_seconds
+        self.route = route
+        self.customer_id = customer_id
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._report: Dict[str, Any] = {}
+        self._targets: set = set()
+        self._holder_id = uuid.uuid4().hex
+
+    # HTTP
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.scheme == 'https':
+                conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout_seconds)
+            else:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_seconds)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 content_type: str = 'application/json') -> Any:
+        """One request on this thread's keep-alive connection; JSON response or BulkHTTPError"""
+        headers = {'Content-Type': content_type, 'Accept': 'application/json'}
+        if self.auth_header:
+            headers['Authorization'] = self.auth_header
+
+        conn = self._connection()
+        try:
+            conn.request(method, self.base_path + path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Stale keep-alive connection or a dropped server: reconnect next time
+            conn.close()
+            self._local.conn = None
+            raise
+
+        if response.status >= 300:
+            retry_after = response.getheader('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            raise BulkHTTPError(response.status, data, retry_after)
+        return json.loads(data) if data else {}
+
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None):
+        delay = min(BULK_MAX_BACKOFF_SECONDS, self.backoff_seconds * (2 ** attempt))
+        # Full jitter, so workers throttled together do not retry together
+        delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._lock:
+            self._report['retries'] += 1
+        time.sleep(delay)
+
+    # Index settings
+
+    def set_refresh_interval(self, interval: Optional[str], index: Optional[str] = None):
+        """
+        Set refresh_interval on index (default: this loader's index); None
+        restores the default. An index that does not exist yet is skipped.
+        """
+        self._request('PUT', f"/{quote(index or self.index)}/_settings?ignore_unavailable=true",
+                      _dumps({'index': {'refresh_interval': interval}}))
+
+    def refresh(self, index: Optional[str] = None):
+        self._request('POST', f"/{quote(index or self.index)}/_refresh?ignore_unavailable=true")
+
+    def _update_holds(self, index: str,
+                      change: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]) -> Tuple[list, list]:
+        """
+        Apply change to the live refresh holds on index and return them
+        before and after. The write is conditional on the document not
+        having moved since it was read, and retried when another load got
+        there first.
+        """
+        path = f"/{quote(REFRESH_HOLDS_INDEX)}/_doc/{quote(index, safe='')}"
+        while True:
+            try:
+                document = self._request('GET', path)
+                condition = f"?if_seq_no={document['_seq_no']}&if_primary_term={document['_primary_term']}"
+                holds = document['_source'].get('holds', [])
+            except BulkHTTPError as e:
+                if e.status != 404:
+                    raise
+                condition = '?op_type=create'
+                holds = []
+
+            now = time.time()
+            holds = [hold for hold in holds if hold['expires_at'] > now]
+            updated = change(holds)
+            try:
+                self._request('PUT', path + condition, _dumps({'holds': updated}))
+            except BulkHTTPError as e:
+                if e.status == 409:
+                    continue
+                raise
+            return holds, updated
+
+    def _hold_refresh_off(self, index: str) -> bool:
+        """Switch refresh off on index for this load, unless another load already has"""
+        own_hold = {'id': self._holder_id, 'expires_at': time.time() + REFRESH_HOLD_SECONDS}
+        try:
+            holds, _ = self._update_holds(index, lambda holds: holds + [own_hold])
+        except Exception as e:
+            logger.error(f"Could not record a refresh hold on {index}: {str(e)}")
+            return False
+
+        if not holds:
+            try:
+                self.set_refresh_interval('-1', index)
+            except Exception as e:
+                logger.error(f"Could not disable refresh on {index}: {str(e)}")
+                try:
+                    self._release_refresh(index)
+                except Exception:
+                    pass  # the hold expires on its own
+                return False
+        return True
+
+    def _release_refresh(self, index: str):
+        """
+        Drop this load's hold on index; the last hold restores the default
+        interval (never an interval read at the start, which may have been
+        another load's -1)
+        """
+        _, remaining = self._update_holds(
+            index, lambda holds: [hold for hold in holds if hold['id'] != self._holder_id])
+        if remaining:
+            return
+        self.set_refresh_interval(None, index)
+        self.refresh(index)
+
+    # Chunks
+
+    def _chunks(self, documents: Iterable[Any]) -> Iterator[Tuple[List[bytes], List[Any]]]:
+        """
+        Group documents into _bulk bodies by document count and bytes. The
+        indices written to so far are collected in self._targets.
+        """
+        lines: List[bytes] = []
+        ids: List[Any] = []
+        size = 0
+        for document in documents:
+            if not isinstance(document, dict):
+                self._record_failure(None, 'Document is not a JSON object')
+                continue
+
+            if self.customer_id:
+                document['customer_id'] = self.customer_id
+            customer_id = document.get('customer_id')
+
+            action: Dict[str, Any] = {'_index': self.route(document) if self.route else self.index}
+            self._targets.add(action['_index'])
+            if customer_id:
+                action['routing'] = customer_id
+            if document.get('message_id'):
+                action['_id'] = f"{customer_id}:{document['message_id']}" if customer_id else str(document['message_id'])
+            line = _dumps({'index': action}) + b'\n' + _dumps(document) + b'\n'
+
+            if lines and (len(lines) >= self.chunk_docs or size + len(line) > self.chunk_bytes):
+                yield lines, ids
+                lines, ids, size = [], [], 0
+            lines.append(line)
+            ids.append(action.get('_id'))
+            size += len(line)
+
+        if lines:
+            yield lines, ids
+
+    def _record_failure(self, document_id: Optional[str], error: Any):
+        with self._lock:
+            self._report['failed'] += 1
+            if len(self._report['errors']) < MAX_ERROR_SAMPLES:
+                self._report['errors'].append({'id': document_id, 'error': error})
+
+    def _send_chunk(self, lines: List[bytes], ids: List[Any]):
+        """
+        Send one chunk, retrying the whole request on 429/5xx and, within
+        a successful response, only the documents rejected with 429
+        """
+        attempt = 0
+        while lines:
+            try:
+                body = b''.join(lines)
+                result = self._request('POST', '/_bulk', body, content_type='application/x-ndjson')
+            except BulkHTTPError as e:
+                if e.status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    for document_id in ids:
+                        self._record_failure(document_id, str(e))
+                    return
+                self._backoff(attempt, e.retry_after)
+                attempt += 1
+                continue
+            except (http.client.HTTPException, OSError) as e:
+                if attempt >= self.max_retries:
+                    for document_id in ids:
+                        self._record_failure(document_id, str(e))
+                    return
+                self._backoff(attempt)
+                attempt += 1
+                continue
+
+            with self._lock:
+                self._report['bytes'] += len(body)
+                self._report['requests'] += 1
+
+            retry_lines: List[bytes] = []
+            retry_ids: List[Any] = []
+            indexed = 0
+            items = result.get('items', []) if result.get('errors') else []
+            if not result.get('errors'):
+                indexed = len(lines)
+            for line, document_id, item in zip(lines, ids, items):
+                outcome = next(iter(item.values()), {})
+                status = outcome.get('status', 500)
+                if status < 300:
+                    indexed += 1
+                elif status == 429 and attempt < self.max_retries:
+                    retry_lines.append(line)
+                    retry_ids.append(document_id)
+                else:
+                    self._record_failure(document_id, outcome.get('error'))
+
+            with self._lock:
+                self._report['indexed'] += indexed
+
+            lines, ids = retry_lines, retry_ids
+            if lines:
+                self._backoff(attempt)
+                attempt += 1
+
+    # Load
+
+    def index_documents(self, documents: Iterable[Any]) -> Dict[str, Any]:
+        """
+        Index documents (any iterable, consumed lazily) and return a report.
+        At most workers * 2 chunks are held in memory at once.
+        """
+        start_time = time.time()
+        self._report = {
+            'index': self.index,
+            'indexed': 0,
+            'failed': 0,
+            'retries': 0,
+            'requests': 0,
+            'bytes': 0,
+            'refresh_disabled': False,
+            'errors': []
+        }
+        queued_docs = 0
+        held: List[str] = []
+        considered: set = set()
+        self._targets = set()
+        in_flight: List[Future] = []
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def release(_future):
+            slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='apex-bulk') as pool:
+                for lines, ids in self._chunks(documents):
+                    queued_docs += len(lines)
+                    if self.large_load_docs and queued_docs >= self.large_load_docs:
+                        # Refreshing mid-load makes segments nobody searches yet
+                        for index in sorted(self._targets - considered):
+                            considered.add(index)
+                            if self._hold_refresh_off(index):
+                                held.append(index)
+                                logger.info(f"Refresh disabled on {index} for a large bulk load")
+                        self._report['refresh_disabled'] = bool(held)
+
+                    slots.acquire()
+                    future = pool.submit(self._send_chunk, lines, ids)
+                    future.add_done_callback(release)
+                    in_flight.append(future)
+                    running = []
+                    for pending in in_flight:
+                        if pending.done():
+                            pending.result()  # surface unexpected errors now
+                        else:
+                            running.append(pending)
+                    in_flight = running
+
+                for future in in_flight:
+                    future.result()
+        finally:
+            for index in held:
+                try:
+                    self._release_refresh(index)
+                except Exception as e:
+                    logger.error(f"Could not restore refresh_interval on {index}: {str(e)}")
+                    self._report['refresh_restore_error'] = str(e)
+
+        duration = time.time() - start_time
+        self._report['duration_ms'] = round(duration * 1000, 2)
+        self._report['docs_per_sec'] = round(self._report['indexed'] / duration, 1) if duration else 0.0
+        logger.info(
+            f"Bulk indexed {self._report['indexed']} documents into {self.index} "
+            f"({self._report['failed']} failed, {self._report['retries']} retries) "
+            f"in {self._report['duration_ms']:.2f}ms"
+        )
+        return self._report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Bulk index NDJSON messages into Elasticsearch')
+    parser.add_argument('path', help="NDJSON file, or - for stdin")
+    parser.add_argument('--es-url', default=DEFAULT_ES_URL)
+    parser.add_argument('--index', default=DEFAULT_INDEX)
+    parser.add_argument('--no-routing', action='store_true',
+                        help='write everything to --index instead of the time-based index of each message')
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS)
+    parser.add_argument('--chunk-docs', type=int, default=BULK_CHUNK_DOCS, help='documents per _bulk request')
+    parser.add_argument('--chunk-bytes', type=int, default=BULK_CHUNK_BYTES, help='bytes per _bulk request')
+    parser.add_argument('--max-retries', type=int, default=BULK_MAX_RETRIES)
+    parser.add_argument('--large-load-docs', type=int, default=LARGE_LOAD_DOCS,
+                        help='disable refresh once this many documents are queued (0 never)')
+    parser.add_argument('--customer-id', default=None,
+                        help="load every message as this tenant's (default: each message's own customer_id)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    route = None
+    if not args.no_routing:
+        from index_lifecycle import IndexLayout
+        route = IndexLayout(args.index).index_for_document
+
+    indexer = BulkIndexer(
+        args.es_url, args.index,
+        workers=args.workers,
+        chunk_docs=args.chunk_docs,
+        chunk_bytes=args.chunk_bytes,
+        max_retries=args.max_retries,
+        large_load_docs=args.large_load_docs,
+        route=route,
+        customer_id=args.customer_id
+    )
+    parse_errors: List[Dict[str, Any]] = []
+    stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+    try:
+        report = indexer.index_documents(iter_ndjson(stream, parse_errors))
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    report['failed'] += len(parse_errors)
+    report['errors'] = (parse_errors + report['errors'])[:MAX_ERROR_SAMPLES]
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
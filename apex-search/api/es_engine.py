@@ -0,0 +1,963 @@
+"""
+APEX Search Elasticsearch engine
+Query building, search execution and indexing over the time-based apex_messages-* indices
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+import base64
+import json
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, List, Any, Callable, Optional
+
+from elasticsearch import Elasticsearch, NotFoundError
+
+from index_lifecycle import IndexLayout, RETENTION_DAYS, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Elasticsearch configuration; several nodes may be listed, comma-separated
+ES_URL = os.getenv('ELASTICSEARCH_URL', 'http://localhost:9200')
+ES_HOSTS = [url.strip() for url in ES_URL.split(',') if url.strip()]
+
+# Connections kept open per node. Every API process has its own client, so
+# this should match the threads one process serves requests on: with fewer,
+# concurrent searches wait for a connection or open throwaway ones. The
+# default follows gunicorn.conf.py's threads default
+ES_CONNECTIONS_PER_NODE = int(os.getenv('APEX_ES_CONNECTIONS_PER_NODE', os.getenv('APEX_SEARCH_THREADS', '4')))
+
+# gzip request and response bodies (search responses and bulk bodies shrink
+# several times over, for a little CPU on both ends)
+ES_HTTP_COMPRESS = os.getenv('APEX_ES_HTTP_COMPRESS', '1') == '1'
+
+# Client-side limit on one request's round trip, in seconds. Searches get
+# their own, shorter one: ES already stops them at their search timeout, so
+# this only catches nodes that do not answer at all
+ES_REQUEST_TIMEOUT = float(os.getenv('APEX_ES_REQUEST_TIMEOUT', '30'))
+ES_SEARCH_REQUEST_TIMEOUT = float(os.getenv('APEX_ES_SEARCH_REQUEST_TIMEOUT', '2'))
+
+# Retries on another node for connection errors and these statuses. Writes
+# are idempotent (documents are keyed by message_id) and also retry on
+# timeout; searches do not - a retry could only answer after their budget
+ES_MAX_RETRIES = int(os.getenv('APEX_ES_MAX_RETRIES', '2'))
+ES_RETRY_ON_STATUS = (429, 502, 503, 504)
+
+# Discover the cluster's nodes from ES_HOSTS at start and after a node
+# fails. Leave off behind a load balancer or in Docker, where nodes publish
+# addresses the API cannot reach
+ES_SNIFF = os.getenv('APEX_ES_SNIFF', '0') == '1'
+ES_SNIFF_INTERVAL = float(os.getenv('APEX_ES_SNIFF_INTERVAL', '60'))
+
+# Latest client round trips kept per operation for latency percentiles
+CLIENT_METRICS_WINDOW = int(os.getenv('APEX_ES_CLIENT_METRICS_WINDOW', '1000'))
+
+# Tenancy: with APEX_TENANT_MODE=header every search and write is for the
+# tenant (customerId, the customer's email domain) named in this header,
+# as set by the APEX web app's middleware
+TENANT_MODE = os.getenv('APEX_TENANT_MODE', 'off')
+TENANT_HEADER = 'X-Customer-Id'
+
+# APEX Search Index Configuration
+# Messages live in daily/weekly apex_messages-YYYY.MM.DD indices; INDEX_NAME
+# is the read alias over all of them (see index_lifecycle)
+INDEX_NAME = 'apex_messages'
+LAYOUT = IndexLayout(INDEX_NAME)
+
+# Default per-search budget, as ES's own search timeout (partial results
+# with timed_out set when it runs out); timeout_ms overrides it
+SEARCH_TIMEOUT_MS = int(os.getenv('APEX_ES_SEARCH_TIMEOUT_MS', '100'))  # Sub-100ms requirement
+
+# Request keys that are not search parameters, left out of cursors
+CURSOR_EXCLUDED_PARAMS = ('cursor', 'customer_id', 'aggs', 'track_total_hits', 'format', 'timeout_ms')
+
+# How long a cursor's point-in-time stays open between page requests
+PIT_KEEP_ALIVE = os.getenv('APEX_ES_PIT_KEEP_ALIVE', '2m')
+
+# Fields free text is searched in
+TEXT_SEARCH_FIELDS = ['subject', 'content']
+
+# Facets a search can ask for, by response name -> field
+FACET_FIELDS = {
+    'threat_categories': 'threat_category',
+    'apex_actions': 'apex_action',
+    'sender_domains': 'sender_domain'
+}
+
+# Facets over fields with too many distinct values to count over every
+# match; they are computed from a per-shard sample of the matches instead
+HIGH_CARDINALITY_FACETS = {'sender_domains'}
+
+DEFAULT_FACET_SIZE = 10
+MAX_FACET_SIZE = 100
+
+# Matches sampled per shard for high-cardinality facets; 0 counts them all
+FACET_SAMPLE_SIZE = int(os.getenv('APEX_ES_FACET_SAMPLE_SIZE', '2000'))
+
+# Hits are counted exactly up to this many; past it total_hits is a lower
+# bound (total_hits_relation "gte") and ES can stop counting early
+TRACK_TOTAL_HITS = int(os.getenv('APEX_ES_TRACK_TOTAL_HITS', '10000'))
+
+# Unit date filters are rounded to (ES date math: m, h, d); empty disables
+DATE_ROUNDING = os.getenv('APEX_ES_DATE_ROUNDING', 'm')
+
+# Only the parts of a search response the API uses; the client then
+# decodes (and we re-encode) far less per request
+SEARCH_FILTER_PATH = [
+    'took',
+    'timed_out',
+    'pit_id',
+    'hits.total',
+    'hits.hits._source',
+    'hits.hits.sort',
+    'aggregations.*.buckets.key',
+    'aggregations.*.buckets.doc_count',
+    # Sampled facets nest their buckets one level down
+    'aggregations.*.*.buckets.key',
+    'aggregations.*.*.buckets.doc_count'
+]
+
+_DOMAIN_RE = re.compile(r'^[a-z0-9-]+(\.[a-z0-9-]+)+$')
+_CUSTOMER_ID_RE = re.compile(r'^[a-z0-9]([a-z0-9-]*[a-z0-9])?(\.[a-z0-9]([a-z0-9-]*[a-z0-9])?)*$')
+_EMAIL_RE = re.compile(r'^[^@\s]+@[a-z0-9-]+(\.[a-z0-9-]+)+$')
+
+def _escape_wildcard(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('*', '\\*').replace('?', '\\?')
+
+def _contains_query(field: str, value: str) -> Dict[str, Any]:
+    """Substring match on a field's wildcard-type subfield (n-gram indexed)"""
+    return {'wildcard': {f'{field}.wildcard': {'value': f"*{_escape_wildcard(value)}*", 'case_insensitive': True}}}
+
+def _domain_suffix_query(domain: str) -> Dict[str, Any]:
+    """Sender domains ending in domain, as a prefix of the reversed-domain subfield"""
+    return {'prefix': {'sender_domain.reversed': domain[::-1]}}
+
+def build_sender_query(sender: str) -> Dict[str, Any]:
+    """
+    Cheapest query for a sender filter:
+    a full address is a term lookup, 'name@' or 'name*' a prefix,
+    '@domain' a domain lookup, anything else a substring match
+    """
+    sender = sender.strip().lower()
+    if _EMAIL_RE.match(sender):
+        return {'term': {'sender_email': {'value': sender, 'case_insensitive': True}}}
+    if sender.startswith('@') and _DOMAIN_RE.match(sender[1:]):
+        return {'term': {'sender_domain': {'value': sender[1:], 'case_insensitive': True}}}
+    if sender.endswith('@') or (sender.endswith('*') and '*' not in sender[:-1]):
+        return {'prefix': {'sender_email': {'value': sender.rstrip('*'), 'case_insensitive': True}}}
+    return _contains_query('sender_email', sender)
+
+def build_domain_query(domain: str) -> Dict[str, Any]:
+    """
+    Cheapest query for a domain filter:
+    a full domain matches itself and its subdomains (term + reversed prefix),
+    '.suffix' matches every domain under it, anything else a substring match
+    """
+    domain = domain.strip().lower()
+    if domain.startswith('.') and _DOMAIN_RE.match(f"x{domain}"):
+        return _domain_suffix_query(domain)
+    if _DOMAIN_RE.match(domain):
+        return {
+            'bool': {
+                'should': [
+                    {'term': {'sender_domain': {'value': domain, 'case_insensitive': True}}},
+                    _domain_suffix_query(f".{domain}")
+                ],
+                'minimum_should_match': 1
+            }
+        }
+    return _contains_query('sender_domain', domain)
+
+def normalize_customer_id(value: Optional[str]) -> str:
+    """A tenant id as stored (lowercase domain), or ValueError"""
+    customer_id = (value or '').strip().lower()
+    if not customer_id or len(customer_id) > 253 or not _CUSTOMER_ID_RE.match(customer_id):
+        raise ValueError(f'Invalid or missing {TENANT_HEADER}')
+    return customer_id
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Cursor state, or ValueError for anything that is not one of ours.
+    Cursors are not signed: they carry search parameters, which go through
+    build_search_query again, never query DSL.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if (not isinstance(state, dict) or not {'pit_id', 'search_after', 'params'} <= set(state)
+            or not isinstance(state['pit_id'], str) or not isinstance(state['params'], dict)
+            or not isinstance(state['search_after'], list)
+            or not all(value is None or isinstance(value, (str, int, float)) for value in state['search_after'])):
+        raise ValueError('Invalid cursor')
+    return state
+
+def pin_relative_dates(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace now-relative date bounds with the instants they mean right
+    now, so every page of a cursor filters on the same range
+    """
+    pinned = dict(data)
+    for key, round_up in (('date_from', False), ('date_to', True)):
+        value = data.get(key)
+        if isinstance(value, str) and value.startswith('now'):
+            moment = parse_timestamp(value, round_up=round_up)
+            if moment is not None:
+                pinned[key] = moment.isoformat(timespec='milliseconds') + 'Z'
+    return pinned
+
+def round_date(value: Any) -> Any:
+    """
+    Round a date bound to DATE_ROUNDING with ES date math. Dashboards that
+    poll with now-relative or client-clock timestamps then send identical
+    range filters for a whole minute, and the node query cache can reuse
+    them. gte bounds round down and lte bounds round up, so the range only
+    ever widens to whole units.
+    """
+    if not DATE_ROUNDING or not isinstance(value, str) or '/' in value:
+        return value
+    if value.startswith('now'):
+        return f"{value}/{DATE_ROUNDING}"
+    if 'T' in value and '||' not in value:
+        return f"{value}||/{DATE_ROUNDING}"
+    return value
+
+def build_search_query(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build optimized Elasticsearch query.
+    Exact and range conditions go in filter context: they are not scored
+    and the node query cache can keep their matches between requests.
+    Only subject/content text is scored. Every condition must hold, as in
+    the SQLite engine.
+    """
+    
+    filter_clauses = []
+    text_clauses = []
+    
+    # Sender email search
+    if 'sender' in data:
+        filter_clauses.append(build_sender_query(data['sender']))
+    
+    # Domain search
+    if 'domain' in data:
+        filter_clauses.append(build_domain_query(data['domain']))
+    
+    # IP address search
+    if 'ip_address' in data:
+        filter_clauses.append({
+            'term': {
+                'sender_ip': data['ip_address']
+            }
+        })
+    
+    # Recipient search
+    if 'recipient' in data:
+        recipient = data['recipient'].strip().lower()
+        if _EMAIL_RE.match(recipient):
+            filter_clauses.append({'term': {'recipient_email': {'value': recipient, 'case_insensitive': True}}})
+        else:
+            filter_clauses.append({'wildcard': {'recipient_email': {
+                'value': f"*{_escape_wildcard(recipient)}*", 'case_insensitive': True}}})
+    
+    # Free text over subject and content: words, "phrases", -excluded, prefix*
+    if 'text' in data:
+        text_clauses.append({
+            'simple_query_string': {
+                'query': data['text'],
+                'fields': TEXT_SEARCH_FIELDS,
+                'default_operator': 'and'
+            }
+        })
+    
+    # Subject search
+    if 'subject' in data:
+        text_clauses.append({
+            'match': {
+                'subject': {
+                    'query': data['subject'],
+                    'operator': 'and',
+                    'fuzziness': 'AUTO'
+                }
+            }
+        })
+    
+    # Content search
+    if 'content' in data:
+        text_clauses.append({
+            'match': {
+                'content': {
+                    'query': data['content'],
+                    'operator': 'and',
+                    'fuzziness': 'AUTO'
+                }
+            }
+        })
+    
+    # Date range search
+    if 'date_from' in data or 'date_to' in data:
+        date_range = {}
+        if 'date_from' in data:
+            date_range['gte'] = round_date(data['date_from'])
+        if 'date_to' in data:
+            date_range['lte'] = round_date(data['date_to'])
+        
+        filter_clauses.append({
+            'range': {
+                'timestamp': date_range
+            }
+        })
+    
+    # Threat category search
+    if 'threat_category' in data:
+        filter_clauses.append({
+            'term': {
+                'threat_category': data['threat_category']
+            }
+        })
+    
+    # APEX action search
+    if 'apex_action' in data:
+        filter_clauses.append({
+            'term': {
+                'apex_action': data['apex_action']
+            }
+        })
+    
+    # Threat score range, e.g. {'gt': 0.8} or {'gte': 0.2, 'lte': 0.5}
+    if 'threat_score' in data:
+        score_range = {operator: float(value) for operator, value in data['threat_score'].items()
+                       if operator in ('gt', 'gte', 'lt', 'lte')}
+        if score_range:
+            filter_clauses.append({'range': {'threat_score': score_range}})
+    
+    bool_query: Dict[str, Any] = {'filter': filter_clauses}
+    sort = [{'timestamp': {'order': 'desc'}}]
+    if text_clauses:
+        bool_query['must'] = text_clauses
+        if data.get('sort') == 'relevance':
+            sort.insert(0, {'_score': {'order': 'desc'}})
+        else:
+            sort.append({'_score': {'order': 'desc'}})
+    
+    # Build final query
+    query = {
+        'size': data.get('size', 50),
+        'from': data.get('from', 0),
+        'query': {
+            'bool': bool_query
+        },
+        # Without text there is nothing to score: sorting on _score would
+        # only make every hit compute a constant
+        'sort': sort,
+        'track_total_hits': total_hits_limit(data.get('track_total_hits'))
+    }
+    
+    aggs = build_facet_aggs(data.get('aggs', True))
+    if aggs:
+        query['aggs'] = aggs
+    
+    return query
+
+def scope_to_customer(query: Dict[str, Any], customer_id: str) -> Dict[str, Any]:
+    """
+    A search body restricted to one tenant's messages. Applied to every
+    request, cursor pages included.
+    """
+    scoped = {'bool': {'filter': [{'term': {'customer_id': customer_id}}]}}
+    if 'query' in query:
+        scoped['bool']['must'] = [query['query']]
+    return dict(query, query=scoped)
+
+def total_hits_limit(requested: Any) -> Any:
+    """track_total_hits for a request: False, or a count no higher than TRACK_TOTAL_HITS"""
+    if requested is False:
+        return False
+    if isinstance(requested, int) and not isinstance(requested, bool) and requested >= 0:
+        return min(requested, TRACK_TOTAL_HITS)
+    return TRACK_TOTAL_HITS
+
+def build_facet_aggs(requested: Any) -> Dict[str, Any]:
+    """
+    Aggregations for the requested facets: true for all of them, a list
+    of names, a {name: size} object, or false/[] for none
+    """
+    if requested is True or requested is None:
+        sizes = {name: DEFAULT_FACET_SIZE for name in FACET_FIELDS}
+    elif not requested:
+        return {}
+    elif isinstance(requested, list):
+        sizes = {name: DEFAULT_FACET_SIZE for name in requested}
+    elif isinstance(requested, dict):
+        sizes = requested
+    else:
+        raise ValueError("aggs must be true, false, a list of facet names or a {name: size} object")
+    
+    aggs = {}
+    for name, size in sizes.items():
+        if name not in FACET_FIELDS:
+            raise ValueError(f"Unknown facet '{name}'; use one of {', '.join(FACET_FIELDS)}")
+        if not isinstance(size, int) or isinstance(size, bool) or size < 1:
+            raise ValueError(f"Facet size for '{name}' must be a positive integer")
+        terms = {'field': FACET_FIELDS[name], 'size': min(size, MAX_FACET_SIZE)}
+        
+        if name in HIGH_CARDINALITY_FACETS and FACET_SAMPLE_SIZE > 0:
+            # Count the top matches on each shard rather than all of them.
+            # The sample is small, so building buckets from the values
+            # directly (map) beats loading global ordinals for every domain.
+            terms['execution_hint'] = 'map'
+            aggs[name] = {
+                'sampler': {'shard_size': FACET_SAMPLE_SIZE},
+                'aggs': {'top': {'terms': terms}}
+            }
+        else:
+            aggs[name] = {'terms': terms}
+    
+    return aggs
+
+def extract_facets(response: Dict[str, Any]) -> Dict[str, List[Dict]]:
+    """Extract aggregation facets from search response"""
+    facets = {}
+    
+    if 'aggregations' in response:
+        aggs = response['aggregations']
+        
+        for name in FACET_FIELDS:
+            if name not in aggs:
+                continue
+            # Sampled facets keep their terms under the sampler
+            agg = aggs[name].get('top', aggs[name])
+            facets[name] = [
+                {'name': bucket['key'], 'count': bucket['doc_count']}
+                for bucket in agg.get('buckets', [])
+            ]
+    
+    return facets
+
+# Mapping and settings every apex_messages-* index gets from the template
+INDEX_MAPPING = {
+    'mappings': {
+        'properties': {
+            # Tenant (customerId); also the document's shard routing
+            'customer_id': {'type': 'keyword'},
+            'message_id': {'type': 'keyword'},
+            'sender_email': {
+                'type': 'keyword',
+                'fields': {
+                    # n-gram indexed, for substring matches
+                    'wildcard': {'type': 'wildcard'}
+                }
+            },
+            'sender_domain': {
+                'type': 'keyword',
+                'fields': {
+                    'wildcard': {'type': 'wildcard'},
+                    # moc.emca.liam: suffix (subdomain) matches become prefix queries
+                    'reversed': {'type': 'text', 'analyzer': 'reversed_domain'}
+                }
+            },
+            'sender_ip': {'type': 'ip'},
+            'recipient_email': {'type': 'keyword'},
+            'subject': {
+                'type': 'text',
+                'analyzer': 'standard',
+                'fields': {
+                    'keyword': {'type': 'keyword'}
+                }
+            },
+            'content': {
+                'type': 'text',
+                'analyzer': 'standard'
+            },
+            'timestamp': {'type': 'date'},
+            'threat_category': {'type': 'keyword'},
+            'apex_action': {'type': 'keyword'},
+            'threat_score': {'type': 'float'},
+            'file_attachments': {'type': 'keyword'},
+            'urls': {'type': 'keyword'}
+        }
+    },
+    'settings': {
+        # shards and replicas: APEX_ES_SHARDS / APEX_ES_REPLICAS per index
+        'refresh_interval': '1s',
+        'index.mapping.total_fields.limit': 2000,
+        # Each tenant's messages sit together in every segment, newest first
+        'index.sort.field': ['customer_id', 'timestamp'],
+        'index.sort.order': ['asc', 'desc'],
+        'analysis': {
+            'analyzer': {
+                'reversed_domain': {
+                    'type': 'custom',
+                    'tokenizer': 'keyword',
+                    'filter': ['lowercase', 'reverse']
+                }
+            }
+        }
+    }
+}
+
+# Columns of a format='compact' response, in mapping order (a response
+# is always for one tenant, or none)
+MESSAGE_COLUMNS = [column for column in INDEX_MAPPING['mappings']['properties'] if column != 'customer_id']
+
+def document_id(message: Dict[str, Any]) -> str:
+    """
+    A message's _id: its message_id, prefixed with its tenant so one tenant
+    can never overwrite another's copy of the same message
+    """
+    if message.get('customer_id'):
+        return f"{message['customer_id']}:{message['message_id']}"
+    return str(message['message_id'])
+
+def create_client() -> Elasticsearch:
+    """Client for ES_HOSTS with this process's pool size, compression, retry and sniffing settings"""
+    return Elasticsearch(
+        ES_HOSTS,
+        connections_per_node=ES_CONNECTIONS_PER_NODE,
+        http_compress=ES_HTTP_COMPRESS,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=ES_MAX_RETRIES,
+        retry_on_status=ES_RETRY_ON_STATUS,
+        retry_on_timeout=True,
+        sniff_on_start=ES_SNIFF,
+        sniff_on_node_failure=ES_SNIFF,
+        min_delay_between_sniffing=ES_SNIFF_INTERVAL
+    )
+
+def client_settings() -> Dict[str, Any]:
+    """The settings create_client uses, for health and metrics output"""
+    return {
+        'hosts': len(ES_HOSTS),
+        'connections_per_node': ES_CONNECTIONS_PER_NODE,
+        'http_compress': ES_HTTP_COMPRESS,
+        'request_timeout_s': ES_REQUEST_TIMEOUT,
+        'search_request_timeout_s': ES_SEARCH_REQUEST_TIMEOUT,
+        'max_retries': ES_MAX_RETRIES,
+        'sniff': ES_SNIFF
+    }
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class ClientMetrics:
+    def __init__(self, window: int = CLIENT_METRICS_WINDOW):
+        """
+        Round-trip latency of Elasticsearch requests as the API sees them,
+        per operation. Where ES reports its own time (took), the rest of the
+        round trip - network, waiting for a pooled connection, encoding and
+        decoding - is tracked as overhead: when that grows rather than took,
+        the bottleneck is in front of the cluster, not in it.
+        
+        listeners are called with (operation, seconds, error) for every
+        request, to feed another metrics system.
+        """
+        self.window = window
+        self.listeners: List[Callable[[str, float, bool], None]] = []
+        self._operations: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, operation: str, seconds: float, error: bool = False, took_ms: Optional[float] = None):
+        with self._lock:
+            state = self._operations.get(operation)
+            if state is None:
+                state = {'count': 0, 'errors': 0, 'total_s': 0.0, 'max_s': 0.0,
+                         'took_count': 0, 'took_ms': 0.0, 'overhead_ms': 0.0,
+                         'recent': deque(maxlen=self.window)}
+                self._operations[operation] = state
+            state['count'] += 1
+            state['errors'] += int(error)
+            state['total_s'] += seconds
+            state['max_s'] = max(state['max_s'], seconds)
+            state['recent'].append(seconds)
+            if took_ms is not None:
+                state['took_count'] += 1
+                state['took_ms'] += took_ms
+                state['overhead_ms'] += max(0.0, seconds * 1000 - took_ms)
+        for listener in self.listeners:
+            try:
+                listener(operation, seconds, error)
+            except Exception as e:
+                logger.warning(f"Client metrics listener failed: {str(e)}")
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Per operation: counts, mean/max latency, percentiles over the latest requests and mean took/overhead"""
+        with self._lock:
+            operations = {name: dict(state, recent=sorted(state['recent']))
+                          for name, state in self._operations.items()}
+        
+        report = {}
+        for name, state in sorted(operations.items()):
+            recent = state['recent']
+            entry = {
+                'count': state['count'],
+                'errors': state['errors'],
+                'mean_ms': round(state['total_s'] / state['count'] * 1000, 2),
+                'max_ms': round(state['max_s'] * 1000, 2),
+                'p50_ms': round(_percentile(recent, 0.50) * 1000, 2),
+                'p95_ms': round(_percentile(recent, 0.95) * 1000, 2),
+                'p99_ms': round(_percentile(recent, 0.99) * 1000, 2)
+            }
+            if state['took_count']:
+                entry['took_mean_ms'] = round(state['took_ms'] / state['took_count'], 2)
+                entry['overhead_mean_ms'] = round(state['overhead_ms'] / state['took_count'], 2)
+            report[name] = entry
+        return report
+
+class ElasticsearchEngine:
+    def __init__(self, client: Optional[Elasticsearch] = None):
+        """
+        Search and indexing over the apex_messages-* indices, with the same
+        search_messages/add_message/get_stats surface as the SQLite engine
+        """
+        self.es = client or create_client()
+        self.metrics = ClientMetrics()
+    
+    def _request(self, operation: str, call: Callable[..., Any], **kwargs) -> Any:
+        """Make one client call, recording its round trip (and ES's took) in self.metrics"""
+        start = time.perf_counter()
+        try:
+            response = call(**kwargs)
+        except Exception:
+            self.metrics.observe(operation, time.perf_counter() - start, error=True)
+            raise
+        took_ms = response.get('took') if hasattr(response, 'get') else None
+        self.metrics.observe(operation, time.perf_counter() - start, took_ms=took_ms)
+        return response
+    
+    def ping(self) -> bool:
+        return bool(self._request('ping', self.es.ping))
+    
+    def search_messages(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Super fast message search.
+        Raises ValueError for parameters or cursors it cannot use; failures
+        of the search itself come back as {'error': ...} like the SQLite
+        engine's.
+        
+        Facets: "aggs" picks them - a list of names, a {name: size} object, or
+        false/[] for none, which skips aggregation work for list-only views.
+        By default every facet is computed with DEFAULT_FACET_SIZE buckets.
+        "track_total_hits" false skips counting; otherwise counts are capped at
+        TRACK_TOTAL_HITS.
+        
+        Deep paging: send "cursor": true with the filters to get the first page
+        and a next_cursor, then {"cursor": "<next_cursor>"} for each following
+        page. Pages come from one point-in-time via search_after, so they stay
+        consistent while messages are indexed and cost the same at any depth.
+        
+        Tenants: "customer_id" limits the search to that tenant's messages and
+        to the shards its routing puts them on. Callers set it from the
+        authenticated tenant, never from the request body.
+        """
+        cursor = data.get('cursor')
+        customer_id = data.get('customer_id')
+        cursor_state = None
+        search_kwargs: Dict[str, Any] = {}
+        timeout_ms = data.get('timeout_ms') or SEARCH_TIMEOUT_MS
+        
+        if isinstance(cursor, str):
+            # Later pages rebuild the query from the parameters stored in the
+            # cursor, so a hand-made cursor can only ask what a first page can
+            cursor_state = decode_cursor(cursor)
+            if cursor_state.get('customer_id') != customer_id:
+                raise ValueError('Invalid cursor')
+            cursor_params = cursor_state['params']
+            query = build_search_query(dict(cursor_params, aggs=False, track_total_hits=False))
+            query.pop('from', None)
+            query['search_after'] = cursor_state['search_after']
+        else:
+            if cursor:
+                data = pin_relative_dates(data)
+            cursor_params = {key: value for key, value in data.items() if key not in CURSOR_EXCLUDED_PARAMS}
+            
+            # Build Elasticsearch query
+            query = build_search_query(data)
+        
+        try:
+            # Searches are not retried on timeout: the retry would answer
+            # after the search's budget anyway
+            searcher = self.es.options(request_timeout=max(ES_SEARCH_REQUEST_TIMEOUT, int(timeout_ms) / 1000 + 1),
+                                       retry_on_timeout=False)
+            
+            if cursor_state:
+                pit_id = cursor_state['pit_id']
+            else:
+                # Only the indices whose period overlaps the date filter
+                indices = LAYOUT.search_indices(data.get('date_from'), data.get('date_to'))
+                target = ",".join(indices) if indices else LAYOUT.read_alias
+                
+                if cursor:
+                    query.pop('from', None)
+                    # The PIT covers only the routed shards; its searches take no routing
+                    pit_id = self._request('open_point_in_time', searcher.open_point_in_time, index=target,
+                                           keep_alive=PIT_KEEP_ALIVE, ignore_unavailable=True,
+                                           routing=customer_id)['id']
+                else:
+                    pit_id = None
+                    search_kwargs = {
+                        'index': target,
+                        'ignore_unavailable': True,  # periods with no messages have no index
+                        'allow_no_indices': True,
+                        'routing': customer_id
+                    }
+            
+            if pit_id:
+                # A point-in-time search names no index; the PIT fixes them
+                query['pit'] = {'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE}
+            
+            # Execute search with performance timing
+            start_time = time.perf_counter()
+            response = self._request(
+                'search',
+                searcher.search,
+                body=scope_to_customer(query, customer_id) if customer_id else query,
+                timeout=f"{int(timeout_ms)}ms",
+                filter_path=SEARCH_FILTER_PATH,
+                **search_kwargs
+            )
+            search_time = (time.perf_counter() - start_time) * 1000
+            took = response.get('took', 0)
+            
+            # filter_path drops hits.hits entirely when nothing matched, and
+            # hits.total when counting was turned off
+            hits = response.get('hits', {}).get('hits', [])
+            total = response.get('hits', {}).get('total')
+            if cursor_state:
+                total_hits = cursor_state.get('total_hits')
+                total_relation = cursor_state.get('total_hits_relation')
+            elif total:
+                total_hits = total['value']
+                total_relation = total['relation']
+            else:
+                total_hits = total_relation = None
+            
+            # Format results
+            results = {
+                'query_time_ms': round(search_time, 2),
+                # Time inside the cluster and the rest of the round trip
+                'phases_ms': {'cluster': took, 'client': round(max(0.0, search_time - took), 2)},
+                'timed_out': response.get('timed_out', False),
+                'total_hits': total_hits,
+                'total_hits_relation': total_relation,
+                'facets': extract_facets(response)
+            }
+            if data.get('format') == 'compact':
+                results['columns'] = MESSAGE_COLUMNS
+                results['rows'] = [[hit['_source'].get(column) for column in MESSAGE_COLUMNS] for hit in hits]
+            else:
+                results['messages'] = [hit['_source'] for hit in hits]
+            
+            if pit_id:
+                pit_id = response.get('pit_id', pit_id)
+                if hits and len(hits) == query.get('size', 50):
+                    results['next_cursor'] = encode_cursor({
+                        'pit_id': pit_id,
+                        'search_after': hits[-1]['sort'],
+                        'params': cursor_params,
+                        'customer_id': customer_id,
+                        'total_hits': total_hits,
+                        'total_hits_relation': total_relation
+                    })
+                else:
+                    results['next_cursor'] = None
+                    self.close_cursor(pit_id)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Search error: {str(e)}")
+            return {'error': str(e)}
+    
+    def close_cursor(self, pit_id: str):
+        """Release a point-in-time early (it would expire after PIT_KEEP_ALIVE anyway)"""
+        try:
+            self._request('close_point_in_time', self.es.close_point_in_time, id=pit_id)
+        except NotFoundError:
+            pass
+    
+    def add_message(self, message: Dict[str, Any]) -> bool:
+        """Index one message into its period's index, on its tenant's shard"""
+        try:
+            self._request(
+                'index',
+                self.es.index,
+                index=LAYOUT.index_for_document(message),
+                id=document_id(message),
+                routing=message.get('customer_id'),
+                body=message
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error adding message: {str(e)}")
+            return False
+    
+    def add_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        Index a batch of messages in one _bulk request; returns how many
+        were indexed. Large loads should go through bulk_indexer instead.
+        """
+        if not messages:
+            return 0
+        operations: List[Dict[str, Any]] = []
+        for message in messages:
+            action = {'_index': LAYOUT.index_for_document(message), '_id': document_id(message)}
+            if message.get('customer_id'):
+                action['routing'] = message['customer_id']
+            operations.append({'index': action})
+            operations.append(message)
+        try:
+            response = self._request('bulk', self.es.bulk, body=operations)
+        except Exception as e:
+            logger.error(f"Error adding messages: {str(e)}")
+            return 0
+        
+        failed = [item['index'] for item in response['items'] if item['index'].get('error')]
+        for item in failed[:5]:
+            logger.error(f"Error adding message {item.get('_id')}: {item['error']}")
+        return len(messages) - len(failed)
+    
+    def refresh(self):
+        """Make everything indexed so far searchable"""
+        self._request('refresh', self.es.indices.refresh, index=LAYOUT.read_alias,
+                      ignore_unavailable=True, allow_no_indices=True)
+    
+    def get_stats(self, customer_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get search engine statistics, for one tenant when customer_id is given"""
+        try:
+            body = {
+                'size': 0,
+                'track_total_hits': True,
+                'aggs': {
+                    'threat_categories': {'terms': {'field': 'threat_category', 'size': MAX_FACET_SIZE}},
+                    'apex_actions': {'terms': {'field': 'apex_action', 'size': MAX_FACET_SIZE}},
+                    'recent': {'filter': {'range': {'timestamp': {'gte': 'now-24h'}}}}
+                }
+            }
+            response = self._request(
+                'stats',
+                self.es.search,
+                index=LAYOUT.read_alias,
+                body=scope_to_customer(body, customer_id) if customer_id else body,
+                routing=customer_id,
+                ignore_unavailable=True,
+                allow_no_indices=True
+            )
+            aggs = response.get('aggregations', {})
+            return {
+                'total_messages': response['hits']['total']['value'],
+                'threat_categories': {bucket['key']: bucket['doc_count']
+                                      for bucket in aggs.get('threat_categories', {}).get('buckets', [])},
+                'apex_actions': {bucket['key']: bucket['doc_count']
+                                 for bucket in aggs.get('apex_actions', {}).get('buckets', [])},
+                'recent_messages_24h': aggs.get('recent', {}).get('doc_count', 0)
+            }
+        except Exception as e:
+            logger.error(f"Error getting stats: {str(e)}")
+            return {'error': str(e)}
+    
+    def add_sample_data(self) -> int:
+        """Add sample data for testing; returns how many messages were indexed"""
+        sample_messages = [
+            {
+                'message_id': 'msg_001',
+                'sender_email': 'phisher@malicious-domain.com',
+                'sender_domain': 'malicious-domain.com',
+                'sender_ip': '192.168.1.100',
+                'recipient_email': 'user@company.com',
+                'subject': 'Urgent: Verify Your Account',
+                'content': 'Click here to verify your account immediately',
+                'timestamp': datetime.utcnow().isoformat(),
+                'threat_category': 'phishing',
+                'apex_action': 'quarantine',
+                'threat_score': 0.95,
+                'file_attachments': ['malware.exe'],
+                'urls': ['http://fake-bank.com/login']
+            },
+            {
+                'message_id': 'msg_002',
+                'sender_email': 'legitimate@sender.com',
+                'sender_domain': 'sender.com',
+                'sender_ip': '10.0.0.1',
+                'recipient_email': 'user@company.com',
+                'subject': 'Monthly Report',
+                'content': 'Please find attached the monthly report',
+                'timestamp': (datetime.utcnow() - timedelta(days=1)).isoformat(),
+                'threat_category': 'legitimate',
+                'apex_action': 'deliver',
+                'threat_score': 0.05,
+                'file_attachments': ['report.pdf'],
+                'urls': []
+            }
+        ]
+        for i, message in enumerate(sample_messages):
+            self.es.index(
+                index=LAYOUT.index_for_document(message),
+                id=f'sample_{i}',
+                body=message
+            )
+        return len(sample_messages)
+    
+    def list_message_indices(self) -> List[str]:
+        """Concrete apex_messages-* indices"""
+        return sorted(self.es.indices.get_alias(index=LAYOUT.pattern).keys())
+    
+    def has_legacy_index(self) -> bool:
+        """
+        A concrete index named apex_messages (from before time-based
+        indices) would block the read alias
+        """
+        return bool(self.es.indices.exists(index=INDEX_NAME)) and not self.es.indices.exists_alias(name=INDEX_NAME)
+    
+    def setup_index(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Install the index template and create the current period's index.
+        Existing indices are kept (new mapping applies to new periods);
+        reset deletes every apex_messages index first.
+        """
+        if reset:
+            existing = self.list_message_indices() + ([INDEX_NAME] if self.has_legacy_index() else [])
+            for chunk_start in range(0, len(existing), 50):
+                self.es.indices.delete(index=",".join(existing[chunk_start:chunk_start + 50]))
+        
+        self.es.indices.put_index_template(
+            name=INDEX_NAME,
+            body=LAYOUT.template(INDEX_MAPPING['mappings'], INDEX_MAPPING['settings'])
+        )
+        return self.rollover_write_alias()
+    
+    def rollover_write_alias(self) -> Dict[str, Any]:
+        """
+        Make sure the current period's index exists and carries the write
+        alias. Cheap when nothing changed; run at least once per period.
+        """
+        current = LAYOUT.current_index()
+        # 400 when another worker created it first
+        self.es.options(ignore_status=400).indices.create(index=current)
+        
+        try:
+            holders = list(self.es.indices.get_alias(name=LAYOUT.write_alias).keys())
+        except NotFoundError:
+            holders = []
+        if holders == [current]:
+            return {'write_index': current, 'rolled_over': False}
+        
+        # One atomic alias swap: writers never see no write index
+        actions = [{'remove': {'index': index, 'alias': LAYOUT.write_alias}} for index in holders if index != current]
+        actions.append({'add': {'index': current, 'alias': LAYOUT.write_alias, 'is_write_index': True}})
+        self.es.indices.update_aliases(body={'actions': actions})
+        logger.info(f"Write alias {LAYOUT.write_alias} moved to {current}")
+        return {'write_index': current, 'rolled_over': True, 'previous': holders}
+    
+    def enforce_retention(self, retention_days: int = RETENTION_DAYS) -> Dict[str, Any]:
+        """Delete indices whose whole period is older than retention_days"""
+        expired = LAYOUT.expired_indices(self.list_message_indices(), retention_days)
+        for chunk_start in range(0, len(expired), 50):
+            self.es.indices.delete(index=",".join(expired[chunk_start:chunk_start + 50]))
+        if expired:
+            logger.info(f"Retention deleted {len(expired)} indices older than {retention_days} days")
+        return {'retention_days': retention_days, 'deleted': expired}
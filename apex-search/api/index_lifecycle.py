@@ -0,0 +1,210 @@
+"""
+APEX Search time-based indices
+Names, routing and retention for daily/weekly apex_messages-* indices
+
+Every message lives in the index of the period its timestamp falls in
+(apex_messages-2025.10.06 for daily indices; weekly ones are named after
+their Monday). An index template gives each new index the mapping and the
+read alias, apex_messages, which searches use; the write alias,
+apex_messages-write, follows the current period's index.
+"""
+
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional
+
+INDEX_PERIOD = os.getenv('APEX_ES_INDEX_PERIOD', 'day')  # day | week
+INDEX_SHARDS = int(os.getenv('APEX_ES_SHARDS', '1'))
+INDEX_REPLICAS = int(os.getenv('APEX_ES_REPLICAS', '0'))
+
+# Indices whose whole period is older than this are deleted by retention
+RETENTION_DAYS = int(os.getenv('APEX_ES_RETENTION_DAYS', '90'))
+
+# Searches spanning more periods than this go to the read alias instead
+# of naming every index in the URL
+MAX_ROUTED_INDICES = 64
+
+_NAME_DATE_FORMAT = '%Y.%m.%d'
+_RELATIVE_RE = re.compile(r'^now(?P<math>(?:[+-]\d+[yMwdhHms])*)(?:/(?P<round>[yMwdhHms]))?$')
+_ANCHORED_RE = re.compile(r'^(?P<anchor>[^|]+)\|\|(?P<math>(?:[+-]\d+[yMwdhHms])*)(?:/(?P<round>[yMwdhHms]))?$')
+_MATH_RE = re.compile(r'([+-])(\d+)([yMwdhHms])')
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'H': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    month_index = moment.year * 12 + moment.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    # Clamp the day like ES does (Jan 31 + 1M = Feb 28/29)
+    next_month = datetime(year + (month == 12), month % 12 + 1, 1)
+    day = min(moment.day, (next_month - timedelta(days=1)).day)
+    return moment.replace(year=year, month=month, day=day)
+
+
+def _apply_math(moment: datetime, math: str) -> datetime:
+    for sign, amount, unit in _MATH_RE.findall(math):
+        amount = int(amount) if sign == '+' else -int(amount)
+        if unit == 'M':
+            moment = _add_months(moment, amount)
+        elif unit == 'y':
+            moment = _add_months(moment, 12 * amount)
+        else:
+            moment += timedelta(seconds=amount * _UNIT_SECONDS[unit])
+    return moment
+
+
+def _round(moment: datetime, unit: str, round_up: bool) -> datetime:
+    """Floor moment to unit, or (round_up) move it to the unit's last millisecond"""
+    if unit == 'y':
+        start, length_end = datetime(moment.year, 1, 1), datetime(moment.year + 1, 1, 1)
+    elif unit == 'M':
+        start = datetime(moment.year, moment.month, 1)
+        length_end = _add_months(start, 1)
+    else:
+        if unit == 'w':
+            start = datetime(moment.year, moment.month, moment.day) - timedelta(days=moment.weekday())
+        elif unit == 'd':
+            start = datetime(moment.year, moment.month, moment.day)
+        elif unit in ('h', 'H'):
+            start = moment.replace(minute=0, second=0, microsecond=0)
+        elif unit == 'm':
+            start = moment.replace(second=0, microsecond=0)
+        else:
+            start = moment.replace(microsecond=0)
+        length_end = start + timedelta(seconds=_UNIT_SECONDS[unit])
+    return length_end - timedelta(milliseconds=1) if round_up else start
+
+
+def parse_timestamp(value: Any, now: Optional[datetime] = None,
+                    round_up: bool = False) -> Optional[datetime]:
+    """
+    Naive UTC datetime for an ISO timestamp, epoch milliseconds or an ES
+    date-math expression (now-1h/m, 2025-10-01T10:00:00Z||/m). Rounding
+    goes down, or up with round_up, the way ES treats gte and lte bounds.
+    None when the value cannot be read.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value / 1000)
+    if not isinstance(value, str):
+        return None
+
+    value = value.strip()
+    match = _RELATIVE_RE.match(value)
+    if match:
+        moment = now or datetime.utcnow()
+    else:
+        match = _ANCHORED_RE.match(value)
+        anchor = match.group('anchor') if match else value
+        try:
+            moment = datetime.fromisoformat(anchor.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+    if match:
+        moment = _apply_math(moment, match.group('math'))
+        if match.group('round'):
+            moment = _round(moment, match.group('round'), round_up)
+    return moment
+
+
+class IndexLayout:
+    def __init__(self, base_name: str, period: str = INDEX_PERIOD):
+        """Index naming and routing for one family of time-based indices"""
+        if period not in ('day', 'week'):
+            raise ValueError(f"Index period must be 'day' or 'week', not '{period}'")
+        self.base_name = base_name
+        self.period = period
+        self.read_alias = base_name
+        self.write_alias = f"{base_name}-write"
+        self.pattern = f"{base_name}-*"
+        self._name_re = re.compile(rf'^{re.escape(base_name)}-(\d{{4}}\.\d{{2}}\.\d{{2}})$')
+
+    @property
+    def period_length(self) -> timedelta:
+        return timedelta(days=7 if self.period == 'week' else 1)
+
+    def period_start(self, moment: datetime) -> datetime:
+        start = datetime(moment.year, moment.month, moment.day)
+        if self.period == 'week':
+            start -= timedelta(days=start.weekday())
+        return start
+
+    def index_name(self, moment: datetime) -> str:
+        return f"{self.base_name}-{self.period_start(moment).strftime(_NAME_DATE_FORMAT)}"
+
+    def current_index(self, now: Optional[datetime] = None) -> str:
+        return self.index_name(now or datetime.utcnow())
+
+    def index_for_document(self, document: Dict[str, Any]) -> str:
+        """The index a message belongs in; the write alias when it has no usable timestamp"""
+        moment = parse_timestamp(document.get('timestamp'))
+        return self.index_name(moment) if moment else self.write_alias
+
+    def index_period(self, index_name: str) -> Optional[datetime]:
+        """Start of the period an index holds, or None for other names"""
+        match = self._name_re.match(index_name)
+        if not match:
+            return None
+        return datetime.strptime(match.group(1), _NAME_DATE_FORMAT)
+
+    def search_indices(self, date_from: Any = None, date_to: Any = None,
+                       now: Optional[datetime] = None) -> Optional[List[str]]:
+        """
+        Indices that can hold messages between date_from and date_to, or
+        None when the search has to go to the whole read alias (no bounds,
+        unreadable bounds, or too many periods to list)
+        """
+        if date_from is None:
+            # Open-ended searches reach back to the oldest index
+            return None
+        now = now or datetime.utcnow()
+        start = parse_timestamp(date_from, now)
+        if date_to is not None:
+            end = parse_timestamp(date_to, now, round_up=True)
+        else:
+            # Open-ended: up to now, plus a period for senders' clock skew
+            end = now + self.period_length
+        if start is None or end is None:
+            return None
+        if start > end:
+            return []
+
+        current = self.period_start(start)
+        last = self.period_start(end)
+        names = []
+        while current <= last:
+            names.append(self.index_name(current))
+            if len(names) > MAX_ROUTED_INDICES:
+                return None
+            current += self.period_length
+        return names
+
+    def expired_indices(self, index_names: List[str], retention_days: int = RETENTION_DAYS,
+                        now: Optional[datetime] = None) -> List[str]:
+        """Indices whose whole period ended more than retention_days ago"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+        expired = []
+        for name in index_names:
+            period = self.index_period(name)
+            if period is not None and period + self.period_length <= cutoff:
+                expired.append(name)
+        return sorted(expired)
+
+    def template(self, mappings: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, Any]:
+        """Composable index template giving new indices the mapping and read alias"""
+        template_settings = dict(settings)
+        template_settings['number_of_shards'] = INDEX_SHARDS
+        template_settings['number_of_replicas'] = INDEX_REPLICAS
+        return {
+            'index_patterns': [self.pattern],
+            'priority': 100,
+            'template': {
+                'settings': template_settings,
+                'mappings': mappings,
+                'aliases': {self.read_alias: {}}
+            },
+            '_meta': {'period': self.period}
+        }
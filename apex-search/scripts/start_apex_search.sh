@@ -35,6 +35,9 @@ echo "  • Elasticsearch: http://localhost:9200"
 echo "  • Kibana: http://localhost:5601"
 echo "  • Search API: http://localhost:5000"
 echo ""
+echo "🗓️  Index maintenance (rollover + retention), e.g. hourly from cron:"
+echo "curl -X POST http://localhost:5000/index/rollover"
+echo ""
 echo "🔍 Test search:"
 echo "curl -X POST http://localhost:5000/search -H 'Content-Type: application/json' -d '{\"sender\": \"phisher\"}'"
 echo ""
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server'
+import { getCustomerIdFromHeaders } from '@/lib/tenantUtils'
 
 // APEX Trace API Route
 // Connects to the APEX Search System for super fast message search
@@ -9,12 +10,18 @@ export async function POST(request: NextRequest) {
   try {
     const searchParams = await request.json()
     
+    // Searches are scoped to the customer the middleware resolved from the
+    // session (required when the search API runs with APEX_TENANT_MODE=header)
+    const headers: Record<string, string> = { 'Content-Type': 'application/json' }
+    const customerId = getCustomerIdFromHeaders(request.headers)
+    if (customerId) {
+      headers['X-Customer-Id'] = customerId
+    }
+    
     // Forward the search request to the APEX Search System
     const response = await fetch(`${APEX_SEARCH_API_URL}/search`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
       body: JSON.stringify(searchParams),
     })
 
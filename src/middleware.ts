@@ -65,13 +65,46 @@ function getCustomerIdFromEmail(email: string): string | null {
   return parts[1].toLowerCase() // Return domain as customer ID
 }
 
+// Identity headers API routes read (see @/lib/tenantUtils). Copies sent by
+// the client are always dropped; only what this middleware resolved is
+// forwarded to the route handlers
+const IDENTITY_HEADERS = ['x-user-email', 'x-customer-id', 'x-user-role']
+
+interface Identity {
+  email: string
+  customerId: string
+  role: string
+}
+
+/**
+ * Continue to the route with the resolved identity (or none) on the
+ * forwarded request, and echo it on the response as before
+ */
+function nextWithIdentity(request: NextRequest, identity?: Identity): NextResponse {
+  const headers = new Headers(request.headers)
+  IDENTITY_HEADERS.forEach(name => headers.delete(name))
+  if (identity) {
+    headers.set('x-user-email', identity.email)
+    headers.set('x-customer-id', identity.customerId)
+    headers.set('x-user-role', identity.role)
+  }
+  
+  const response = NextResponse.next({ request: { headers } })
+  if (identity) {
+    response.headers.set('x-user-email', identity.email)
+    response.headers.set('x-customer-id', identity.customerId)
+    response.headers.set('x-user-role', identity.role)
+  }
+  return response
+}
+
 // MULTI-TENANT Middleware - Allow any authenticated user, extract their tenant
 export function middleware(request: NextRequest) {
   const { pathname, searchParams } = request.nextUrl;
   
   // Always allow login page and public assets (but NOT API routes - they need headers)
   if (pathname === '/login' || pathname.startsWith('/_next')) {
-    return NextResponse.next();
+    return nextWithIdentity(request);
   }
   
   // API routes are allowed but need customer headers for multi-tenancy
@@ -82,13 +115,9 @@ export function middleware(request: NextRequest) {
   const validToken = process.env.NEXT_PUBLIC_PORTAL_TOKEN || '7885c5de63b9b75428cacee0731b80509590783da34b02dd3373276b75ef8e25';
   
   if (token && token === validToken) {
-    const response = NextResponse.next()
     // Admin access - set special customer ID
-    response.headers.set('x-user-email', 'admin@ilminate.com')
-    response.headers.set('x-customer-id', 'ilminate.com')
-    response.headers.set('x-user-role', 'admin')
     console.log('✅ Token auth - Admin access')
-    return response
+    return nextWithIdentity(request, { email: 'admin@ilminate.com', customerId: 'ilminate.com', role: 'admin' })
   }
 
   // ✅ METHOD 2: Test account via apex_user_display cookie
@@ -98,14 +127,13 @@ export function middleware(request: NextRequest) {
     try {
       const userInfo = JSON.parse(decodeURIComponent(userDisplayCookie.value))
       if (userInfo.email && userInfo.customerId) {
-        const response = NextResponse.next()
-        response.headers.set('x-user-email', userInfo.email)
-        response.headers.set('x-customer-id', userInfo.customerId)
-        response.headers.set('x-user-role', userInfo.role || 'customer')
-        
         console.log(`✅ Test Account: ${userInfo.email} → Customer: ${userInfo.customerId} (API route: ${isApiRoute})`)
         
-        return response
+        return nextWithIdentity(request, {
+          email: userInfo.email,
+          customerId: userInfo.customerId,
+          role: userInfo.role || 'customer'
+        })
       }
     } catch (e) {
       console.error('Failed to parse apex_user_display cookie:', e)
@@ -127,16 +155,14 @@ export function middleware(request: NextRequest) {
       
       if (customerId) {
         // ✅ ALLOW ACCESS - Multi-tenant SaaS model
-        const response = NextResponse.next()
-        
-        // Set headers for API routes to use
-        response.headers.set('x-user-email', email)
-        response.headers.set('x-customer-id', customerId) // e.g., "acme.com"
-        response.headers.set('x-user-role', customerId === 'ilminate.com' ? 'admin' : 'customer')
-        
         console.log(`✅ Authenticated: ${email} → Customer: ${customerId}`)
         
-        return response
+        // Set headers for API routes to use (customerId e.g. "acme.com")
+        return nextWithIdentity(request, {
+          email,
+          customerId,
+          role: customerId === 'ilminate.com' ? 'admin' : 'customer'
+        })
       }
     }
   }
@@ -145,7 +171,7 @@ export function middleware(request: NextRequest) {
   // For API routes, allow through but without customer headers (will fail gracefully)
   if (isApiRoute) {
     console.log('⚠️ API route called without authentication:', pathname)
-    return NextResponse.next()
+    return nextWithIdentity(request)
   }
   
   // For page routes, redirect to login